@@ -2,27 +2,59 @@ import streamlit as st
 import pandas as pd
 from utils.google_sheets import (
       get_google_sheets_service,
-      verificar_o_crear_hoja,
-      agregar_o_actualizar_datos, # Usamos la nueva función
       obtener_nombres_hojas,
       leer_datos_hoja,
+      contar_filas_hoja,
+      leer_pagina_hoja,
+      leer_varias_hojas,
+      leer_pendientes_wsp,
+      FILAS_POR_PAGINA,
       actualizar_flag_wsp,
+      invalidar_cache_hoja,
       ENCABEZADOS, # Importar encabezados para usarlos en la visualización
       # Nuevas importaciones para Drive
       get_google_drive_service,
-      upload_csv_to_drive
+      exportar_hoja_a_drive,
+      configurar_revisiones
   )
-from utils.data_processing import (
-      leer_excel_subido,
-      preparar_datos_para_hoja
+from utils.ingestion import (
+      copiar_archivo_subido,
+      trabajo_procesar_archivos
+  )
+from utils.background_jobs import (
+      obtener_gestor_trabajos,
+      ESTADOS_ACTIVOS
+  )
+from utils.campaigns import Campana, trabajo_campana_envio
+from utils.column_mapping import (
+    almacen_perfiles, resolver_mapeo, huella_encabezado, CAMPOS_MAPEO, ETIQUETAS_CAMPOS
+)
+from utils.data_processing import leer_encabezado_excel
+from utils.client_index import (
+      IndiceClientes,
+      obtener_indice_clientes,
+      resumir_companias,
+      ESTADO_WSP_PENDIENTE,
+      ESTADO_WSP_ENVIADO
+  )
+from utils.identity_index import obtener_indice_identidades
+from utils.sheet_data import DatosHoja, obtener_datos_hoja
+from utils.instrumentation import mostrar_panel_diagnostico
+from utils.local_mirror import (
+      iniciar_sincronizacion_espejo,
+      leer_datos_hoja_espejo
   )
 # Import WhatsApp utility functions
 from utils.whatsapp_messaging import (
     initialize_whatsapp_client,
-    send_whatsapp_message,
-    format_message
+    render_messages,
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_MESSAGES_PER_SECOND
 )
 
+# Cada cuánto se refresca el panel de trabajos mientras hay alguno activo
+INTERVALO_REFRESCO_TRABAJOS_SEGUNDOS = 2
+
   # --- Configuración de la Página ---
 st.set_page_config(
       page_title="Gestor Clientes Broker",
@@ -94,9 +126,16 @@ else:
       # --- Opciones en Sidebar ---
       app_mode = st.sidebar.selectbox(
           "Selecciona una Acción",
-          ["Cargar Datos desde Excel", "Ver/Gestionar Clientes", "Enviar Mensajes (Próximamente)"]
+          ["Cargar Datos desde Excel", "Ver/Gestionar Clientes", "Resumen por Compañía", "Buscar Cliente en Todas las Compañías", "Enviar Mensajes (Próximamente)"]
       )
       st.sidebar.markdown("---")
+      usar_espejo = st.sidebar.checkbox(
+          "Leer desde copia local",
+          value=False,
+          help="Lista y filtra clientes desde una copia local de las hojas que se sincroniza en segundo plano con Google Sheets."
+      )
+      mostrar_panel_diagnostico()
+      st.sidebar.markdown("---")
       if st.sidebar.button("Cerrar Sesión"):
           st.session_state.logged_in = False
           st.session_state.service = None # Limpiar servicio Sheets
@@ -124,11 +163,140 @@ else:
       spreadsheet_id = st.session_state.spreadsheet_id
       service = st.session_state.service # Servicio de Sheets
       drive_service = st.session_state.drive_service # Servicio de Drive (puede ser None)
+      # La caché de lecturas se comparte entre sesiones mientras el spreadsheet no cambie en Drive
+      configurar_revisiones(drive_service)
+
+      if usar_espejo:
+          sincronizador = iniciar_sincronizacion_espejo(service, spreadsheet_id)
+          if sincronizador.ultimo_error:
+              st.sidebar.warning(f"Última sincronización de la copia local fallida: {sincronizador.ultimo_error}")
+          elif sincronizador.ultima_sincronizacion:
+              st.sidebar.caption(f"Copia local sincronizada: {pd.Timestamp.fromtimestamp(sincronizador.ultima_sincronizacion).strftime('%H:%M:%S')}")
+
+      def indice_identidades_vigente():
+          """Índice global de clientes, construido o renovado si hace falta. None si no se pudo construir."""
+          indice = obtener_indice_identidades(service, spreadsheet_id)
+          try:
+              with st.spinner("Actualizando índice de clientes de todas las compañías..."):
+                  indice.asegurar_vigente()
+          except Exception as e:
+              st.warning(f"No se pudo construir el índice de clientes de todas las compañías: {e}")
+              return None
+          return indice
+
+      def mostrar_trabajos(tipo, mostrar_resultado):
+          """Trabajos recientes de `tipo` (de todas las sesiones); se refresca solo mientras haya alguno activo."""
+          gestor = obtener_gestor_trabajos()
+
+          @st.fragment(run_every=INTERVALO_REFRESCO_TRABAJOS_SEGUNDOS if gestor.hay_activos(tipo) else None)
+          def panel_trabajos():
+              trabajos = gestor.listar(tipo=tipo, limite=10)
+              if not trabajos:
+                  return
+              st.subheader("Trabajos en segundo plano")
+              propios = st.session_state.get('trabajos_sesion', [])
+              for trabajo in trabajos:
+                  creado = pd.Timestamp.fromtimestamp(trabajo['creado_en']).strftime('%d/%m %H:%M:%S')
+                  with st.expander(f"{trabajo['descripcion']} — {trabajo['estado']} ({creado})",
+                                   expanded=bool(propios) and trabajo['id'] == propios[-1]):
+                      if trabajo['total']:
+                          st.progress(min(trabajo['hechos'] / trabajo['total'], 1.0),
+                                      text=f"{trabajo['hechos']}/{trabajo['total']} {trabajo['texto'] or ''}")
+                      if (trabajo['estado'] in ESTADOS_ACTIVOS and trabajo.get('cancelable')
+                              and not trabajo.get('cancelado')):
+                          if st.button("Cancelar", key=f"cancelar_{trabajo['id']}"):
+                              gestor.cancelar(trabajo['id'])
+                      if trabajo['error']:
+                          st.error(f"El trabajo falló: {trabajo['error']}")
+                      # Bitácora: el texto va en bloques de código y las tablas (reporte.dataframe) como tablas
+                      lineas = []
+                      for mensaje in trabajo['mensajes'][-100:]:
+                          lineas.append(f"[{mensaje['nivel']}] {mensaje['texto']}")
+                          if mensaje.get('tabla'):
+                              st.code('\n'.join(lineas), language=None)
+                              st.dataframe(pd.DataFrame(mensaje['tabla']), hide_index=True)
+                              lineas = []
+                      if lineas:
+                          st.code('\n'.join(lineas), language=None)
+                      if trabajo['resultado'] is not None:
+                          mostrar_resultado(trabajo['resultado'])
+
+          panel_trabajos()
+
+      def encolar_trabajo(tipo, descripcion, funcion, *args, **kwargs):
+          """Encola el trabajo y lo recuerda en la sesión (su panel se muestra expandido)."""
+          id_trabajo = obtener_gestor_trabajos().enviar(
+              tipo, descripcion, funcion, *args, usuario=st.secrets['login']['username'], **kwargs
+          )
+          st.session_state.setdefault('trabajos_sesion', []).append(id_trabajo)
+          return id_trabajo
+
+      def mostrar_resultado_ingesta(resultados_archivos):
+          grand_total_agregados = sum(r['agregados'] for r in resultados_archivos)
+          grand_total_actualizados = sum(r['actualizados'] for r in resultados_archivos)
+          grand_total_sin_cambios = sum(r['sin_cambios'] for r in resultados_archivos)
+
+          st.markdown("**Resumen por Archivo:**")
+          st.dataframe(pd.DataFrame(resultados_archivos))
+
+          st.markdown("**Resumen Total:**")
+          cancelados = [r['archivo'] for r in resultados_archivos if r['estado'] == 'cancelado']
+          if cancelados:
+              st.warning(f"Carga cancelada: {', '.join(cancelados)} quedaron sin escribir o escritos en parte (ver el resumen por archivo).")
+          st.success(f"Proceso completado. Total de registros nuevos agregados: {grand_total_agregados}")
+          st.info(f"Total de registros existentes actualizados: {grand_total_actualizados}")
+          st.info(f"Total de registros existentes sin cambios: {grand_total_sin_cambios}")
+
+      def mostrar_resultado_campana(resultado):
+          if resultado['envios']:
+              st.dataframe(pd.DataFrame(resultado['envios']), hide_index=True)
+          if resultado['flags_fallidos']:
+              st.warning(f"{len(resultado['flags_fallidos'])} mensajes se enviaron (simulado) pero su flag no se pudo actualizar en Google Sheets:")
+              st.dataframe(pd.DataFrame(resultado['flags_fallidos']), hide_index=True)
+          if resultado['en_duda']:
+              st.warning(f"{len(resultado['en_duda'])} clientes tienen un envío sin confirmar y no se les reenvió:")
+              st.dataframe(pd.DataFrame(resultado['en_duda']), hide_index=True)
+          st.markdown("**Resumen del Envío (Simulación):**")
+          st.success(f"Mensajes enviados exitosamente (simulado): {resultado['exitos']}")
+          st.error(f"Mensajes fallidos: {resultado['fallos']}")
+          if resultado['omitidos'] or resultado['flags_resincronizados']:
+              st.info(f"Omitidos por haberlo recibido antes: {resultado['omitidos']}. "
+                      f"Flags guardados de envíos anteriores: {resultado['flags_resincronizados']}.")
+          st.info("Recuerda que esto es una simulación. Deberás configurar una API real y reemplazar las funciones en utils/whatsapp_messaging.py.")
+
+      def leer_hoja_clientes(nombre_hoja, forzar=False):
+          """Lee la hoja desde la copia local si está activada, o desde Sheets (con caché)."""
+          if usar_espejo:
+              return leer_datos_hoja_espejo(service, spreadsheet_id, nombre_hoja, forzar=forzar)
+          if forzar:
+              invalidar_cache_hoja(spreadsheet_id, nombre_hoja)
+          return leer_datos_hoja(service, spreadsheet_id, nombre_hoja)
+
+      def leer_pendientes_clientes(nombre_hoja):
+          """
+          (encabezado, DataFrame de los clientes con el mensaje WSP pendiente, clientes en la hoja),
+          o None si hubo un error. Desde Sheets solo se leen completas las filas pendientes.
+          """
+          if usar_espejo:
+              datos_crudos = leer_datos_hoja_espejo(service, spreadsheet_id, nombre_hoja)
+              if datos_crudos is None:
+                  return None
+              indice = obtener_indice_clientes(spreadsheet_id, nombre_hoja, datos_crudos)
+              return (indice.datos_hoja.encabezado, indice.df.iloc[indice.filtrar(estado_wsp=ESTADO_WSP_PENDIENTE)],
+                      len(indice.df))
+          pendientes = leer_pendientes_wsp(service, spreadsheet_id, nombre_hoja)
+          if pendientes is None:
+              return None
+          datos = obtener_datos_hoja(spreadsheet_id, nombre_hoja, pendientes['valores'],
+                                     numeros_fila=pendientes['numeros_fila'])
+          return datos.encabezado, datos.df, pendientes['total']
 
       # --- Modo: Cargar Datos desde Excel ---
       if app_mode == "Cargar Datos desde Excel":
           st.title(" Cargar Nuevos Clientes desde Archivo Excel")
           st.markdown("Sube uno o más archivos Excel. El sistema intentará crear/actualizar una hoja por cada archivo.")
+          st.caption("La carga corre en segundo plano: no se interrumpe si la página se recarga.")
+          mostrar_trabajos('ingesta', mostrar_resultado_ingesta)
 
           uploaded_files = st.file_uploader(
               "Selecciona los archivos Excel",
@@ -165,50 +333,75 @@ else:
                   st.warning("No se asignaron nombres válidos a los archivos")
                   st.stop()  # Use st.stop() instead of return outside a function
 
-              if st.button("Procesar Archivos Cargados", disabled=(len(nombres_companias) != len(uploaded_files))):
+              # Columnas de cada archivo: un formato ya confirmado para la compañía usa su perfil
+              # guardado; uno nuevo se detecta y se confirma acá (se guarda al procesar)
+              st.markdown("**Columnas de cada archivo:**")
+              encabezados_archivos = st.session_state.setdefault('encabezados_archivos', {})
+              for data_idx, data in enumerate(nombres_companias):
+                  archivo = data['file']
+                  if archivo.file_id not in encabezados_archivos:
+                      encabezados_archivos[archivo.file_id] = leer_encabezado_excel(archivo)
+                  columnas_archivo = encabezados_archivos[archivo.file_id]
+                  if columnas_archivo is None:
+                      continue
+                  mapeo_archivo, desde_perfil = resolver_mapeo(columnas_archivo, data['name'])
+                  huella = huella_encabezado(columnas_archivo, data['name'])
+                  titulo = (f"'{archivo.name}': formato conocido de '{data['name']}'" if desde_perfil
+                            else f"'{archivo.name}': formato nuevo para '{data['name']}', confirma las columnas")
+                  with st.expander(titulo, expanded=not desde_perfil):
+                      opciones_columnas = [None] + columnas_archivo
+                      for campo in CAMPOS_MAPEO:
+                          mapeo_archivo[campo] = st.selectbox(
+                              ETIQUETAS_CAMPOS[campo], options=opciones_columnas,
+                              index=opciones_columnas.index(mapeo_archivo[campo]),
+                              format_func=lambda columna: "(ninguna)" if columna is None else str(columna),
+                              key=f"mapeo_{data_idx}_{huella}_{campo}"
+                          )
+                  data['columnas'] = columnas_archivo
+                  data['mapeo'] = mapeo_archivo
+
+              sin_nombre = [data['file'].name for data in nombres_companias if data.get('mapeo') and not data['mapeo']['nombre']]
+              if sin_nombre:
+                  st.warning(f"Elige la columna de Nombre/Tomador de: {', '.join(sin_nombre)}")
+
+              solo_cambios = st.checkbox(
+                  "Actualizar solo los clientes con cambios",
+                  value=True,
+                  help="Compara cada cliente con el guardado (sin contar la fecha de actualización) y escribe solo las celdas que cambiaron."
+              )
+
+              procesar_en_paralelo = st.checkbox(
+                  "Procesar archivos en paralelo",
+                  value=True,
+                  help="Lee y prepara varios Excel a la vez y solapa las escrituras en hojas distintas."
+              )
+
+              detectar_en_otras_companias = st.checkbox(
+                  "Detectar clientes ya cargados en otras compañías",
+                  value=True,
+                  help="Avisa qué clientes del archivo comparten identificación, teléfono o email con clientes de otras hojas."
+              )
+
+              if st.button("Procesar Archivos Cargados", disabled=(len(nombres_companias) != len(uploaded_files) or bool(sin_nombre))):
                   if len(nombres_companias) == 0:
                        st.warning("Asegúrate de asignar un nombre de Compañía/Hoja a cada archivo subido.")
                   else:
-                      st.markdown("---")
-                      st.subheader("Resultados del Procesamiento:")
-                      
-                      grand_total_agregados = 0
-                      grand_total_actualizados = 0
-
-                      # Iterar sobre la lista de archivos
+                      # Guardar los mapeos confirmados: la próxima carga de este formato no se vuelve a detectar
                       for data in nombres_companias:
-                          uploaded_file = data["file"]
-                          nombre_hoja = data["name"]
-                          st.markdown(f"**Procesando: {uploaded_file.name} para la hoja '{nombre_hoja}'**")
-
-                          with st.spinner(f"Leyendo y procesando '{uploaded_file.name}'..."):
-                              df_compania = leer_excel_subido(uploaded_file)
-
-                          if df_compania is not None:
-                              with st.spinner(f"Adaptando datos de '{nombre_hoja}'..."):
-                                  datos_para_sheets = preparar_datos_para_hoja(df_compania, nombre_hoja)
-
-                              if datos_para_sheets:
-                                  with st.spinner(f"Verificando/Creando hoja '{nombre_hoja}'..."):
-                                      hoja_lista = verificar_o_crear_hoja(service, spreadsheet_id, nombre_hoja)
-
-                                  if hoja_lista:
-                                      with st.spinner(f"Agregando/Actualizando datos en '{nombre_hoja}'..."):
-                                          # Usar la función que agrega o actualiza
-                                          agregados, actualizados = agregar_o_actualizar_datos(service, spreadsheet_id, nombre_hoja, datos_para_sheets)
-                                          grand_total_agregados += agregados
-                                          grand_total_actualizados += actualizados
-                                  else:
-                                      st.error(f"No se pudieron procesar los datos para '{nombre_hoja}' porque la hoja no pudo ser creada/verificada.")
-                              else:
-                                  st.warning(f"No se prepararon datos válidos del archivo '{uploaded_file.name}' para '{nombre_hoja}'.")
-                          else:
-                              st.error(f"No se pudo leer el archivo Excel: '{uploaded_file.name}'.")
-                          st.markdown("---") # Separador entre archivos
-
-                      st.subheader("Resumen Total:")
-                      st.success(f"Proceso completado. Total de registros nuevos agregados: {grand_total_agregados}")
-                      st.info(f"Total de registros existentes actualizados: {grand_total_actualizados}")
+                          if data.get('mapeo') and not almacen_perfiles.guardar(data['columnas'], data['name'], data['mapeo']):
+                              st.warning(f"No se pudo guardar el perfil de columnas de '{data['file'].name}'.")
+                      # El trabajo usa copias de los archivos: no depende del widget ni de la sesión
+                      archivos_trabajo = [{'name': data['name'], 'file': copiar_archivo_subido(data['file']),
+                                           'mapeo': data.get('mapeo')}
+                                          for data in nombres_companias]
+                      encolar_trabajo(
+                          'ingesta', f"Carga de {', '.join(data['name'] for data in nombres_companias)}",
+                          trabajo_procesar_archivos, service, spreadsheet_id, archivos_trabajo,
+                          solo_cambios=solo_cambios, en_paralelo=procesar_en_paralelo,
+                          indice_identidades=obtener_indice_identidades(service, spreadsheet_id) if detectar_en_otras_companias else None,
+                          cancelable=True
+                      )
+                      st.rerun() # Mostrar el trabajo en el panel
 
       # --- Modo: Ver/Gestionar Clientes ---
       elif app_mode == "Ver/Gestionar Clientes":
@@ -222,108 +415,188 @@ else:
 
               if hoja_seleccionada:
                   st.subheader(f"Clientes de: {hoja_seleccionada}")
-                  with st.spinner(f"Cargando datos de '{hoja_seleccionada}'..."):
-                       datos_crudos = leer_datos_hoja(service, spreadsheet_id, hoja_seleccionada)
+                  # Las lecturas se cachean entre reruns; este botón fuerza una nueva lectura
+                  refrescar = st.button("Refrescar datos de la hoja")
+
+                  # --- Filtros ---
+                  st.markdown("**Filtros:**")
+                  col1, col2 = st.columns(2)
+
+                  # Filtrar por nombre/apellido
+                  filtro_nombre = col1.text_input("Buscar por Nombre/Apellido")
+                  # Filtrar por WSP Enviado
+                  opcion_wsp = ["Todos", "Pendientes (FALSE)", "Enviados (TRUE)"]
+                  filtro_wsp_sel = col2.selectbox("Filtrar por Estado WhatsApp", options=opcion_wsp)
+                  estados_wsp = {"Pendientes (FALSE)": ESTADO_WSP_PENDIENTE, "Enviados (TRUE)": ESTADO_WSP_ENVIADO}
+                  hay_filtros = bool(filtro_nombre.strip()) or filtro_wsp_sel != "Todos"
+
+                  datos_crudos = None # Hoja completa; sin filtros ni copia local solo se lee la página visible
+                  if usar_espejo or hay_filtros:
+                      # Filtrar necesita la hoja completa (con la copia local ya está en memoria)
+                      with st.spinner(f"Cargando datos de '{hoja_seleccionada}'..."):
+                           datos_crudos = leer_hoja_clientes(hoja_seleccionada, forzar=refrescar)
+                      if datos_crudos is None: # Error al leer
+                          st.error(f"No se pudieron cargar los datos de '{hoja_seleccionada}'.")
+                          st.stop()
+                      if len(datos_crudos) <= 1:
+                          if datos_crudos and datos_crudos[0] == ENCABEZADOS:
+                              st.info("La hoja contiene solo los encabezados. Aún no hay datos de clientes.")
+                          else: # datos_crudos es []
+                              st.info(f"No se encontraron datos válidos en la hoja '{hoja_seleccionada}' para mostrar o exportar.")
+                          st.stop()
+                      # DataFrame (con '__row_number__') e índices de filtrado, construidos una vez por carga de datos
+                      indice_hoja = obtener_indice_clientes(spreadsheet_id, hoja_seleccionada, datos_crudos)
+                      # Aplicar filtros (sobre los índices precalculados; la búsqueda ignora mayúsculas y acentos)
+                      posiciones_hoja = indice_hoja.filtrar(filtro_nombre, estados_wsp.get(filtro_wsp_sel))
+                      total_filas = len(posiciones_hoja)
+                  else:
+                      if refrescar:
+                          invalidar_cache_hoja(spreadsheet_id, hoja_seleccionada)
+                      # Tamaño de la grilla (metadatos): puede incluir filas vacías al final
+                      total_filas = contar_filas_hoja(service, spreadsheet_id, hoja_seleccionada)
+                      if total_filas is None:
+                          st.error(f"No se pudieron cargar los datos de '{hoja_seleccionada}'.")
+                          st.stop()
+
+                  # --- Paginación: solo se muestra (y, sin filtros, solo se lee) una página ---
+                  paginas = max(1, -(-total_filas // FILAS_POR_PAGINA))
+                  pagina = int(st.number_input(f"Página (de {paginas})", min_value=1, max_value=paginas, value=1)) - 1
 
                   if datos_crudos is not None:
-                      if len(datos_crudos) > 1: # Si hay más que solo el encabezado (o si no hay encabezado)
-                           # Crear DataFrame para mejor visualización y filtrado
-                           # Usar ENCABEZADOS como columnas si la primera fila coincide, sino usar la primera fila como header
-                           header = ENCABEZADOS if datos_crudos[0] == ENCABEZADOS else datos_crudos[0]
-                           data_start_row = 1 if datos_crudos[0] == ENCABEZADOS else 1 # Siempre empezar desde la segunda fila si hay datos
-                           
-                           df_clientes = pd.DataFrame(datos_crudos[data_start_row:], columns=header)
-                           
-                           # Añadir columna con número de fila original para poder actualizar
-                           df_clientes['__row_number__'] = range(data_start_row + 1, len(datos_crudos) + 1)
-
-                           # --- Filtros ---
-                           st.markdown("**Filtros:**")
-                           col1, col2 = st.columns(2)
-                           
-                           # Filtrar por nombre/apellido
-                           filtro_nombre = col1.text_input("Buscar por Nombre/Apellido")
-                           # Filtrar por WSP Enviado
-                           opcion_wsp = ["Todos", "Pendientes (FALSE)", "Enviados (TRUE)"]
-                           filtro_wsp_sel = col2.selectbox("Filtrar por Estado WhatsApp", options=opcion_wsp)
-
-                           # Aplicar filtros
-                           df_filtrado = df_clientes.copy()
-                           if filtro_nombre:
-                               df_filtrado = df_filtrado[df_clientes['Nombre_Apellido'].str.contains(filtro_nombre, case=False, na=False)]
-                           
-                           if filtro_wsp_sel == "Pendientes (FALSE)":
-                               # Asegurarse de comparar con strings 'FALSE' o vacíos
-                               df_filtrado = df_filtrado[df_filtrado['Mensaje_WSP_Enviado'].str.upper().isin(['FALSE', ''])]
-                           elif filtro_wsp_sel == "Enviados (TRUE)":
-                               df_filtrado = df_filtrado[df_filtrado['Mensaje_WSP_Enviado'].str.upper() == 'TRUE']
-
-                           st.markdown("---")
-                           st.dataframe(df_filtrado.drop(columns=['__row_number__'])) # Ocultar columna auxiliar al mostrar
-
-                           # --- Acción: Marcar como Enviado/Pendiente ---
-                           st.markdown("**Actualizar Estado WhatsApp:**")
-                           
-                           # Usar el índice del dataframe filtrado para seleccionar cliente
-                           clientes_para_actualizar = df_filtrado['Numero_Identificacion'] + " - " + df_filtrado['Nombre_Apellido']
-                           cliente_seleccionado = st.selectbox(
-                               "Selecciona cliente para cambiar estado WSP", 
-                               options=[""] + clientes_para_actualizar.tolist() # Añadir opción vacía
-                           )
-
-                           if cliente_seleccionado:
-                               num_id_seleccionado = cliente_seleccionado.split(" - ")[0]
-                               # Encontrar el número de fila original del cliente seleccionado en el DF *filtrado*
-                               fila_original_num = df_filtrado.loc[df_filtrado['Numero_Identificacion'] == num_id_seleccionado, '__row_number__'].iloc[0]
-
-                               col_act1, col_act2 = st.columns(2)
-                               if col_act1.button("Marcar como ENVIADO (TRUE)"):
-                                   with st.spinner("Actualizando estado..."):
-                                       if actualizar_flag_wsp(service, spreadsheet_id, hoja_seleccionada, fila_original_num, True):
-                                           st.success("¡Estado actualizado! Refresca los datos si es necesario.")
-                                           # Idealmente, refrescaríamos los datos aquí, pero requiere rerun o manejo más complejo
-                                       else:
-                                           st.error("No se pudo actualizar el estado.")
-                                       
-                               if col_act2.button("Marcar como PENDIENTE (FALSE)"):
-                                   with st.spinner("Actualizando estado..."):
-                                       if actualizar_flag_wsp(service, spreadsheet_id, hoja_seleccionada, fila_original_num, False):
-                                           st.success("¡Estado actualizado! Refresca los datos si es necesario.")
-                                       else:
-                                           st.error("No se pudo actualizar el estado.")
-                           
-                           st.markdown("---")
-                           # --- Acción: Exportar a CSV ---
-                           st.markdown("**Exportar Datos a Google Drive:**")
-                           # Opcional: Pedir ID de carpeta de Drive
-                           # drive_folder_id = st.text_input("ID de Carpeta en Google Drive (opcional, dejar vacío para raíz)")
-                           drive_folder_id = None # Por ahora, subir a la raíz
-
-                           if st.button(f"Exportar '{hoja_seleccionada}' a CSV en Drive", disabled=(not drive_ok or not datos_crudos)):
-                               if drive_service and datos_crudos:
-                                   filename = f"Export_{hoja_seleccionada}_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}"
-                                   with st.spinner(f"Exportando '{filename}.csv' a Google Drive..."):
-                                       file_id = upload_csv_to_drive(drive_service, datos_crudos, filename, drive_folder_id)
-                                       if file_id:
-                                           # Opcional: Mostrar enlace
-                                           st.info(f"Archivo creado en Google Drive. Puedes buscarlo por el nombre '{filename}.csv'.")
-                                       else:
-                                           st.error("Falló la exportación a Google Drive.")
-                               elif not drive_ok:
-                                    st.error("La conexión con Google Drive no está disponible.")
-                               else:
-                                    st.warning("No hay datos para exportar.")
-
-                      elif len(datos_crudos) == 1 and datos_crudos[0] == ENCABEZADOS:
-                           st.info("La hoja contiene solo los encabezados. Aún no hay datos de clientes.")
-                      else: # datos_crudos es [] o None
-                           st.info(f"No se encontraron datos válidos en la hoja '{hoja_seleccionada}' para mostrar o exportar.")
-                  else: # datos_crudos es None (error al leer)
-                      st.error(f"No se pudieron cargar los datos de '{hoja_seleccionada}'.")
+                      posiciones_pagina = posiciones_hoja[pagina * FILAS_POR_PAGINA:(pagina + 1) * FILAS_POR_PAGINA]
+                      indice_clientes = indice_hoja
+                  else:
+                      with st.spinner(f"Cargando página {pagina + 1} de '{hoja_seleccionada}'..."):
+                          encabezado = leer_datos_hoja(service, spreadsheet_id, hoja_seleccionada, rango='A1:K1')
+                          # La página siguiente se pide en segundo plano y queda en la caché
+                          resultado_pagina = leer_pagina_hoja(service, spreadsheet_id, hoja_seleccionada, pagina) if encabezado else None
+                      if encabezado is None or (encabezado and resultado_pagina is None): # Error al leer
+                          st.error(f"No se pudieron cargar los datos de '{hoja_seleccionada}'.")
+                          st.stop()
+                      if not encabezado:
+                          st.info(f"No se encontraron datos válidos en la hoja '{hoja_seleccionada}' para mostrar o exportar.")
+                          st.stop()
+                      filas_pagina, primera_fila = resultado_pagina
+                      if not filas_pagina:
+                          if pagina == 0 and encabezado[0] == ENCABEZADOS:
+                              st.info("La hoja contiene solo los encabezados. Aún no hay datos de clientes.")
+                          else:
+                              st.info("No hay más clientes a partir de esta página.")
+                          st.stop()
+                      indice_clientes = IndiceClientes(DatosHoja(encabezado[:1] + filas_pagina, primera_fila=primera_fila))
+                      posiciones_pagina = indice_clientes.filtrar()
+
+                  df_filtrado = indice_clientes.df.iloc[posiciones_pagina]
+                  st.markdown("---")
+                  st.caption(f"Mostrando {len(df_filtrado)} clientes (página {pagina + 1} de {paginas}, "
+                             f"{'hasta ' if datos_crudos is None else ''}{total_filas} en total).")
+                  st.dataframe(df_filtrado.drop(columns=['__row_number__'])) # Ocultar columna auxiliar al mostrar
+
+                  # --- Acción: Marcar como Enviado/Pendiente ---
+                  st.markdown("**Actualizar Estado WhatsApp:**")
+
+                  # Clientes de la página visible
+                  clientes_para_actualizar = indice_clientes.etiquetas(posiciones_pagina)
+                  cliente_seleccionado = st.selectbox(
+                      "Selecciona cliente para cambiar estado WSP",
+                      options=[""] + clientes_para_actualizar # Añadir opción vacía
+                  )
+
+                  if cliente_seleccionado:
+                      num_id_seleccionado = cliente_seleccionado.split(" - ")[0]
+                      # Encontrar el número de fila original del cliente seleccionado entre los *visibles*
+                      fila_original_num = indice_clientes.fila_de(num_id_seleccionado, posiciones_pagina)
+
+                      col_act1, col_act2 = st.columns(2)
+                      if col_act1.button("Marcar como ENVIADO (TRUE)"):
+                          with st.spinner("Actualizando estado..."):
+                              if actualizar_flag_wsp(service, spreadsheet_id, hoja_seleccionada, fila_original_num, True):
+                                  st.success("¡Estado actualizado! Refresca los datos si es necesario.")
+                                  # Idealmente, refrescaríamos los datos aquí, pero requiere rerun o manejo más complejo
+                              else:
+                                  st.error("No se pudo actualizar el estado.")
+
+                      if col_act2.button("Marcar como PENDIENTE (FALSE)"):
+                          with st.spinner("Actualizando estado..."):
+                              if actualizar_flag_wsp(service, spreadsheet_id, hoja_seleccionada, fila_original_num, False):
+                                  st.success("¡Estado actualizado! Refresca los datos si es necesario.")
+                              else:
+                                  st.error("No se pudo actualizar el estado.")
+
+                  st.markdown("---")
+                  # --- Acción: Exportar a CSV ---
+                  st.markdown("**Exportar Datos a Google Drive:**")
+                  # Opcional: Pedir ID de carpeta de Drive
+                  # drive_folder_id = st.text_input("ID de Carpeta en Google Drive (opcional, dejar vacío para raíz)")
+                  drive_folder_id = None # Por ahora, subir a la raíz
+                  formatos_exportacion = {"CSV": 'csv', "CSV comprimido (gzip)": 'csv.gz', "Parquet": 'parquet'}
+                  formato_sel = st.selectbox("Formato de exportación", options=list(formatos_exportacion),
+                                             help="gzip y Parquet suben muchos menos bytes en hojas grandes.")
+
+                  if st.button(f"Exportar '{hoja_seleccionada}' a Drive", disabled=not drive_ok):
+                      if drive_service:
+                          filename = f"Export_{hoja_seleccionada}_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}"
+                          with st.spinner(f"Exportando '{filename}' a Google Drive..."):
+                              # La exportación siempre lleva la hoja completa
+                              datos_exportar = datos_crudos if datos_crudos is not None else leer_hoja_clientes(hoja_seleccionada)
+                              if not datos_exportar:
+                                  st.warning("No hay datos para exportar.")
+                              else:
+                                  file_id = exportar_hoja_a_drive(drive_service, datos_exportar, filename, drive_folder_id,
+                                                                  formato=formatos_exportacion[formato_sel])
+                                  if file_id:
+                                      # Opcional: Mostrar enlace
+                                      st.info(f"Archivo creado en Google Drive. Puedes buscarlo por el nombre '{filename}'.")
+                                  else:
+                                      st.error("Falló la exportación a Google Drive.")
+                      else:
+                           st.error("La conexión con Google Drive no está disponible.")
+
+      # --- Modo: Resumen por Compañía ---
+      elif app_mode == "Resumen por Compañía":
+          st.title(" Resumen por Compañía")
+
+          forzar_resumen = st.button("🔄 Refrescar datos")
+          with st.spinner("Leyendo todas las compañías..."):
+              # Todas las hojas en una sola llamada a la API
+              dataframes = leer_varias_hojas(service, spreadsheet_id, usar_cache=not forzar_resumen)
+
+          if dataframes is None:
+              st.stop()
+          if not dataframes:
+              st.warning("Aún no se han cargado datos de ninguna compañía.")
+              st.stop()
+
+          resumen = resumir_companias(dataframes)
+          col_clientes, col_pendientes, col_enviados = st.columns(3)
+          col_clientes.metric("Clientes", int(resumen['Clientes'].sum()))
+          col_pendientes.metric("Mensajes WSP pendientes", int(resumen['WSP_Pendientes'].sum()))
+          col_enviados.metric("Mensajes WSP enviados", int(resumen['WSP_Enviados'].sum()))
+          st.dataframe(resumen, hide_index=True)
+
+      # --- Modo: Buscar Cliente en Todas las Compañías ---
+      elif app_mode == "Buscar Cliente en Todas las Compañías":
+          st.title(" Buscar Cliente en Todas las Compañías")
+          st.markdown("Busca por número de identificación, teléfono o email en todas las hojas a la vez.")
+
+          if st.button("🔄 Reconstruir índice"):
+              obtener_indice_identidades(service, spreadsheet_id).construido_en = None
+          indice_identidades = indice_identidades_vigente()
+
+          texto_busqueda = st.text_input("Identificación, teléfono o email")
+          if indice_identidades and texto_busqueda.strip():
+              resultados_busqueda = indice_identidades.buscar(texto_busqueda)
+              if resultados_busqueda:
+                  st.success(f"{len(resultados_busqueda)} coincidencia(s) encontrada(s).")
+                  st.dataframe(pd.DataFrame(resultados_busqueda), hide_index=True)
+              else:
+                  st.info("Ningún cliente coincide con la búsqueda.")
 
       # --- Modo: Enviar Mensajes ---
       elif app_mode == "Enviar Mensajes (Próximamente)": # Mantener nombre hasta que funcione
           st.title(" Envío de Mensajes Personalizados (WhatsApp)")
+          st.caption("Los envíos corren en segundo plano: no se interrumpen si la página se recarga.")
+          mostrar_trabajos('campana', mostrar_resultado_campana)
 
           # Verificar cliente WhatsApp (placeholder por ahora)
           whatsapp_client = st.session_state.whatsapp_client
@@ -346,25 +619,18 @@ else:
           if hoja_seleccionada_wsp:
               st.subheader(f"Enviar mensajes a clientes de: {hoja_seleccionada_wsp}")
 
-              # 2. Cargar y filtrar clientes pendientes
+              # 2. Cargar los clientes pendientes (Mensaje_WSP_Enviado FALSE o vacío)
               with st.spinner(f"Cargando clientes pendientes de '{hoja_seleccionada_wsp}'..."):
-                  datos_crudos_wsp = leer_datos_hoja(service, spreadsheet_id, hoja_seleccionada_wsp)
+                  pendientes_wsp = leer_pendientes_clientes(hoja_seleccionada_wsp)
 
-              if datos_crudos_wsp is None or len(datos_crudos_wsp) <= 1:
+              if pendientes_wsp is None or not pendientes_wsp[2]:
                   st.info(f"No se encontraron datos de clientes o solo encabezados en '{hoja_seleccionada_wsp}'.")
                   st.stop()
 
-              header_wsp = ENCABEZADOS if datos_crudos_wsp[0] == ENCABEZADOS else datos_crudos_wsp[0]
-              data_start_row_wsp = 1 # Asumimos que siempre hay encabezado o queremos ignorar la fila 0 si no es el estándar
-
-              df_clientes_wsp = pd.DataFrame(datos_crudos_wsp[data_start_row_wsp:], columns=header_wsp)
-              # Añadir número de fila original (importante para actualizar el flag)
-              df_clientes_wsp['__row_number__'] = range(data_start_row_wsp + 1, len(datos_crudos_wsp) + 1)
-
-              # Filtrar por Mensaje_WSP_Enviado == FALSE o vacío
-              df_pendientes = df_clientes_wsp[
-                  df_clientes_wsp['Mensaje_WSP_Enviado'].str.upper().isin(['FALSE', ''])
-              ].copy() # Usar .copy() para evitar SettingWithCopyWarning
+              # El DataFrame incluye el número de fila original (importante para actualizar el flag)
+              header_wsp, df_pendientes, _ = pendientes_wsp
+              header_wsp = ENCABEZADOS if header_wsp == ENCABEZADOS else header_wsp
+              df_pendientes = df_pendientes.copy() # Usar .copy() para evitar SettingWithCopyWarning
 
               if df_pendientes.empty:
                   st.success(f"¡Todos los clientes de '{hoja_seleccionada_wsp}' ya tienen el mensaje marcado como enviado!")
@@ -396,55 +662,41 @@ else:
 
               # 5. Botón de Envío
               st.markdown("---")
+              with st.expander("Opciones de envío"):
+                  col_env1, col_env2 = st.columns(2)
+                  max_concurrencia = col_env1.number_input("Envíos simultáneos", min_value=1, max_value=50, value=DEFAULT_MAX_CONCURRENCY)
+                  mensajes_por_segundo = col_env2.number_input("Mensajes por segundo (límite del proveedor)", min_value=1, max_value=100, value=DEFAULT_MESSAGES_PER_SECOND)
+
+              # Si esta plantilla ya se envió a esta hoja, el envío retoma la campaña desde su bitácora
+              reenviar_en_duda = False
+              resumen_campana = Campana(hoja_seleccionada_wsp, mensaje_template).resumen() if mensaje_template else None
+              if resumen_campana and resumen_campana['enviados'] + resumen_campana['en_duda']:
+                  aviso_flags = (f" Se guardarán en Google Sheets los {resumen_campana['sin_flag']} flags que faltan."
+                                 if resumen_campana['sin_flag'] else '')
+                  st.info(f"Esta plantilla ya se envió a {resumen_campana['enviados']} clientes de '{hoja_seleccionada_wsp}': "
+                          f"no se les reenviará.{aviso_flags}")
+                  if resumen_campana['en_duda']:
+                      reenviar_en_duda = st.checkbox(
+                          f"Reenviar a los {resumen_campana['en_duda']} clientes con envío sin confirmar (pueden recibirlo dos veces)"
+                      )
               if st.button(f"Enviar {len(df_seleccionados)} Mensajes (Simulación)", disabled=(len(df_seleccionados) == 0)):
                   if not mensaje_template:
                       st.warning("Por favor, escribe un mensaje.")
                   else:
-                      st.subheader("Resultados del Envío (Simulación):")
-                      exitos = 0
-                      fallos = 0
-                      
-                      # Barra de progreso
-                      progress_bar = st.progress(0)
-                      status_text = st.empty()
-
-                      for i, (index, cliente) in enumerate(df_seleccionados.iterrows()):
-                          nombre_cliente = cliente['Nombre_Apellido']
-                          telefono_cliente = cliente['Numero_Telefono_1']
-                          fila_original = cliente['__row_number__']
-                          
-                          # Convertir la fila del DataFrame a un diccionario para formatear
-                          datos_cliente_dict = cliente.to_dict()
-
-                          status_text.text(f"Procesando {i+1}/{len(df_seleccionados)}: {nombre_cliente}...")
-
-                          # Formatear mensaje
-                          mensaje_final = format_message(mensaje_template, datos_cliente_dict)
-                          st.text_area(f"Mensaje para {nombre_cliente}:", value=mensaje_final, height=100, disabled=True, key=f"msg_{index}")
-
-                          # Enviar mensaje (simulado)
-                          enviado_ok = send_whatsapp_message(whatsapp_client, telefono_cliente, mensaje_final, nombre_cliente)
-
-                          # Actualizar flag en Google Sheet si el envío fue exitoso
-                          if enviado_ok:
-                              actualizado_ok = actualizar_flag_wsp(service, spreadsheet_id, hoja_seleccionada_wsp, fila_original, True)
-                              if actualizado_ok:
-                                  st.caption(f"Flag actualizado a TRUE para {nombre_cliente} en Google Sheets.")
-                                  exitos += 1
-                              else:
-                                  st.warning(f"Mensaje enviado (simulado) a {nombre_cliente}, pero falló la actualización del flag en Google Sheets.")
-                                  # Considerar esto como fallo parcial o total? Por ahora cuenta como éxito de envío.
-                                  exitos += 1 # O decidir si contar como fallo si el flag no se actualiza
-                          else:
-                              fallos += 1
-                          
-                          # Actualizar progreso
-                          progress_bar.progress((i + 1) / len(df_seleccionados))
-                          st.markdown("---") # Separador visual
-
-                      status_text.text("Proceso de envío completado.")
-                      st.subheader("Resumen del Envío (Simulación):")
-                      st.success(f"Mensajes enviados exitosamente (simulado): {exitos}")
-                      st.error(f"Mensajes fallidos: {fallos}")
-                      st.info("Recuerda que esto es una simulación. Deberás configurar una API real y reemplazar las funciones en utils/whatsapp_messaging.py.")
-                      # Podríamos añadir un botón para refrescar los datos de pendientes
+                      # Formatear todos los mensajes de una vez (la plantilla se compila una sola vez)
+                      mensajes = render_messages(mensaje_template, df_seleccionados, columns=header_wsp)
+                      destinatarios = [
+                          {'fila': int(cliente['__row_number__']), 'identificacion': cliente['Numero_Identificacion'],
+                           'nombre': cliente['Nombre_Apellido'], 'telefono': cliente['Numero_Telefono_1'],
+                           'mensaje': mensaje_final}
+                          for (_, cliente), mensaje_final in zip(df_seleccionados.iterrows(), mensajes)
+                      ]
+                      # El envío y el guardado de flags (en lote) corren en segundo plano
+                      encolar_trabajo(
+                          'campana', f"Envío a {len(destinatarios)} clientes de {hoja_seleccionada_wsp}",
+                          trabajo_campana_envio, service, spreadsheet_id, hoja_seleccionada_wsp, whatsapp_client,
+                          mensaje_template, destinatarios, max_concurrency=int(max_concurrencia),
+                          messages_per_second=int(mensajes_por_segundo), reenviar_en_duda=reenviar_en_duda,
+                          cancelable=True
+                      )
+                      st.rerun() # Mostrar el trabajo en el panel
@@ -0,0 +1,340 @@
+"""
+Doble en memoria del subconjunto de Sheets v4 y Drive v3 que usa utils/google_sheets.py.
+
+Imita la forma de googleapiclient (service.spreadsheets().values().get(...).execute()),
+cuenta llamadas y bytes por método, y puede simular latencia y errores 429 de cuota.
+Pensado para benchmarks y pruebas locales: no valida todo lo que valida la API real.
+"""
+import itertools
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from utils.google_sheets import _limites_rango_a1, _indice_a_columna
+
+FILAS_GRILLA_POR_DEFECTO = 1000
+COLUMNAS_GRILLA_POR_DEFECTO = 26
+
+
+def _error_http(estado, mensaje, uri):
+    contenido = json.dumps({'error': {'code': estado, 'message': mensaje}}).encode('utf-8')
+    return HttpError(httplib2.Response({'status': str(estado)}), contenido, uri=uri)
+
+
+def _tamano_json(valor):
+    return len(json.dumps(valor, ensure_ascii=False).encode('utf-8')) if valor is not None else 0
+
+
+class FakeGoogleBackend:
+    """
+    Estado compartido de un spreadsheet y un Drive falsos, más sus estadísticas.
+    `latencia_segundos` se duerme en cada execute(); `probabilidad_429` es la probabilidad
+    de que una llamada falle con 429 (antes de aplicar ningún cambio).
+    """
+
+    def __init__(self, latencia_segundos=0.0, probabilidad_429=0.0, semilla=None):
+        self.latencia_segundos = latencia_segundos
+        self.probabilidad_429 = probabilidad_429
+        self.hojas = {} # titulo -> {'sheetId': int, 'filas': [[str, ...], ...]}
+        self.archivos = {} # file_id -> {'metadata': dict, 'contenido': bytes}
+        self.version = 1 # Revisión del spreadsheet en Drive: aumenta con cada cambio
+        self.modificado = time.time()
+        self._random = random.Random(semilla)
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+        self.reiniciar_estadisticas()
+
+    # --- Estadísticas ---
+    def reiniciar_estadisticas(self):
+        with self._lock:
+            self.estadisticas = defaultdict(lambda: {'llamadas': 0, 'errores_429': 0,
+                                                     'bytes_enviados': 0, 'bytes_recibidos': 0})
+
+    def resumen(self):
+        """Totales de llamadas, 429 y bytes, más el detalle por método."""
+        with self._lock:
+            por_metodo = {metodo: dict(valores) for metodo, valores in self.estadisticas.items()}
+        return {
+            'llamadas': sum(v['llamadas'] for v in por_metodo.values()),
+            'errores_429': sum(v['errores_429'] for v in por_metodo.values()),
+            'bytes_enviados': sum(v['bytes_enviados'] for v in por_metodo.values()),
+            'bytes_recibidos': sum(v['bytes_recibidos'] for v in por_metodo.values()),
+            'por_metodo': por_metodo,
+        }
+
+    # --- Servicios con la forma de googleapiclient ---
+    def sheets_service(self):
+        return _SheetsService(self)
+
+    def drive_service(self):
+        return _DriveService(self)
+
+    # --- Ejecución común ---
+    def _ejecutar(self, peticion):
+        if self.latencia_segundos:
+            time.sleep(self.latencia_segundos)
+        with self._lock:
+            estadisticas = self.estadisticas[peticion.methodId]
+            estadisticas['llamadas'] += 1
+            estadisticas['bytes_enviados'] += len((peticion.body or '').encode('utf-8')) + peticion.bytes_media
+            if self.probabilidad_429 and self._random.random() < self.probabilidad_429:
+                estadisticas['errores_429'] += 1
+                raise _error_http(429, 'Quota exceeded (simulado)', peticion.uri)
+            respuesta = peticion.accion()
+            estadisticas['bytes_recibidos'] += _tamano_json(respuesta)
+            return respuesta
+
+    # --- Revisión del spreadsheet ---
+    def _marcar_modificado(self):
+        self.version += 1
+        self.modificado = time.time()
+
+    def editar_celda(self, titulo, fila, columna, valor):
+        """Simula una edición hecha fuera de la app (sin contar como llamada); fila 1-based, columna 0-based."""
+        with self._lock:
+            self._escribir_bloque(titulo, fila, columna, [[valor]])
+
+    # --- Utilidades de rango ---
+    def _hoja_y_limites(self, rango, uri):
+        nombre_hoja, separador, rango_celdas = rango.rpartition('!')
+        if not separador: # Solo el nombre de la hoja: toda la hoja
+            nombre_hoja, rango_celdas = rango, ''
+        nombre_hoja = nombre_hoja.strip("'").replace("''", "'")
+        limites = _limites_rango_a1(rango_celdas)
+        if nombre_hoja not in self.hojas or limites is None:
+            raise _error_http(400, f'Unable to parse range: {rango}', uri)
+        return nombre_hoja, limites
+
+    def _valores_rango(self, nombre_hoja, limites):
+        c0, c1, f0, f1 = limites
+        filas = self.hojas[nombre_hoja]['filas']
+        fin_filas = len(filas) if f1 == float('inf') else min(len(filas), int(f1))
+        valores = []
+        for fila in filas[f0 - 1:fin_filas]:
+            fin_cols = len(fila) if c1 == float('inf') else min(len(fila), int(c1) + 1)
+            celdas = list(fila[c0:fin_cols])
+            while celdas and celdas[-1] == '': # La API omite las celdas vacías finales
+                celdas.pop()
+            valores.append(celdas)
+        while valores and not valores[-1]: # ... y las filas vacías finales
+            valores.pop()
+        return valores
+
+    def _escribir_bloque(self, nombre_hoja, fila_inicio, col_inicio, valores):
+        filas = self.hojas[nombre_hoja]['filas']
+        for desplazamiento, fila_valores in enumerate(valores):
+            indice_fila = fila_inicio - 1 + desplazamiento
+            while len(filas) <= indice_fila:
+                filas.append([])
+            fila = filas[indice_fila]
+            fin = col_inicio + len(fila_valores)
+            if len(fila) < fin:
+                fila.extend([''] * (fin - len(fila)))
+            fila[col_inicio:fin] = [_a_celda(valor) for valor in fila_valores]
+        self._marcar_modificado()
+        ancho = max((len(v) for v in valores), default=0)
+        return (f"'{nombre_hoja}'!{_indice_a_columna(col_inicio)}{fila_inicio}:"
+                f"{_indice_a_columna(col_inicio + max(ancho, 1) - 1)}{fila_inicio + len(valores) - 1}")
+
+    def _propiedades(self, titulo):
+        hoja = self.hojas[titulo]
+        return {
+            'sheetId': hoja['sheetId'], 'title': titulo, 'index': list(self.hojas).index(titulo),
+            'gridProperties': {'rowCount': max(FILAS_GRILLA_POR_DEFECTO, len(hoja['filas'])),
+                               'columnCount': COLUMNAS_GRILLA_POR_DEFECTO},
+        }
+
+    def agregar_hoja(self, titulo, filas=None):
+        """Crea una hoja directamente (sin contar como llamada). Útil para preparar escenarios."""
+        with self._lock:
+            self.hojas[titulo] = {'sheetId': next(self._ids), 'filas': [list(f) for f in (filas or [])]}
+            self._marcar_modificado()
+            return self._propiedades(titulo)
+
+
+def _a_celda(valor):
+    """Como USER_ENTERED, pero guardando siempre texto: booleanos a TRUE/FALSE."""
+    if isinstance(valor, bool):
+        return 'TRUE' if valor else 'FALSE'
+    return '' if valor is None else str(valor)
+
+
+class _Peticion:
+    """Equivalente a googleapiclient.http.HttpRequest: se ejecuta con execute()."""
+
+    def __init__(self, backend, metodo, accion, body=None, uri='', bytes_media=0):
+        self._backend = backend
+        self.methodId = metodo
+        self.accion = accion
+        self.body = json.dumps(body, ensure_ascii=False) if body is not None else None
+        self.uri = uri or f'fake://{metodo}'
+        self.bytes_media = bytes_media
+
+    def execute(self, http=None, num_retries=0):
+        # Como googleapiclient, reintenta los 429 hasta num_retries veces (sin esperar)
+        for intento in range(num_retries + 1):
+            try:
+                return self._backend._ejecutar(self)
+            except HttpError as error:
+                if error.resp.status != 429 or intento == num_retries:
+                    raise
+
+
+class _SheetsService:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def spreadsheets(self):
+        return _Spreadsheets(self._backend)
+
+
+class _Spreadsheets:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def get(self, spreadsheetId, fields=None, **kwargs):
+        backend = self._backend
+        def accion():
+            return {'sheets': [{'properties': backend._propiedades(titulo)} for titulo in backend.hojas]}
+        return _Peticion(backend, 'sheets.spreadsheets.get', accion)
+
+    def batchUpdate(self, spreadsheetId, body):
+        backend = self._backend
+        uri = 'fake://sheets.spreadsheets.batchUpdate'
+        def accion():
+            respuestas = []
+            for pedido in body.get('requests', []):
+                if 'addSheet' not in pedido:
+                    respuestas.append({})
+                    continue
+                titulo = pedido['addSheet']['properties']['title']
+                if titulo in backend.hojas:
+                    raise _error_http(400, f'A sheet with the name "{titulo}" already exists.', uri)
+                respuestas.append({'addSheet': {'properties': backend.agregar_hoja(titulo)}})
+            return {'spreadsheetId': spreadsheetId, 'replies': respuestas}
+        return _Peticion(backend, 'sheets.spreadsheets.batchUpdate', accion, body, uri)
+
+    def values(self):
+        return _Values(self._backend)
+
+
+class _Values:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def get(self, spreadsheetId, range, **kwargs):
+        backend = self._backend
+        uri = f'fake://sheets.spreadsheets.values.get/{range}'
+        def accion():
+            nombre_hoja, limites = backend._hoja_y_limites(range, uri)
+            respuesta = {'range': range, 'majorDimension': 'ROWS'}
+            valores = backend._valores_rango(nombre_hoja, limites)
+            if valores:
+                respuesta['values'] = valores
+            return respuesta
+        return _Peticion(backend, 'sheets.spreadsheets.values.get', accion, uri=uri)
+
+    def batchGet(self, spreadsheetId, ranges, **kwargs):
+        backend = self._backend
+        ranges = [ranges] if isinstance(ranges, str) else list(ranges)
+        uri = 'fake://sheets.spreadsheets.values.batchGet'
+        def accion():
+            rangos = []
+            for rango in ranges:
+                nombre_hoja, limites = backend._hoja_y_limites(rango, uri)
+                respuesta = {'range': rango, 'majorDimension': 'ROWS'}
+                valores = backend._valores_rango(nombre_hoja, limites)
+                if valores:
+                    respuesta['values'] = valores
+                rangos.append(respuesta)
+            return {'spreadsheetId': spreadsheetId, 'valueRanges': rangos}
+        return _Peticion(backend, 'sheets.spreadsheets.values.batchGet', accion, uri=uri)
+
+    def update(self, spreadsheetId, range, body, valueInputOption=None, **kwargs):
+        backend = self._backend
+        uri = f'fake://sheets.spreadsheets.values.update/{range}'
+        def accion():
+            nombre_hoja, (c0, _, f0, _) = backend._hoja_y_limites(range, uri)
+            rango_escrito = backend._escribir_bloque(nombre_hoja, f0, c0, body.get('values', []))
+            return {'spreadsheetId': spreadsheetId, 'updatedRange': rango_escrito,
+                    'updatedRows': len(body.get('values', []))}
+        return _Peticion(backend, 'sheets.spreadsheets.values.update', accion, body, uri)
+
+    def append(self, spreadsheetId, range, body, valueInputOption=None, insertDataOption=None, **kwargs):
+        backend = self._backend
+        uri = f'fake://sheets.spreadsheets.values.append/{range}'
+        def accion():
+            nombre_hoja, (c0, _, _, _) = backend._hoja_y_limites(range, uri)
+            filas = backend.hojas[nombre_hoja]['filas']
+            ultima = len(filas)
+            while ultima and not any(filas[ultima - 1]): # Fin de la tabla: última fila con datos
+                ultima -= 1
+            valores = body.get('values', [])
+            rango_escrito = backend._escribir_bloque(nombre_hoja, ultima + 1, c0, valores)
+            return {'spreadsheetId': spreadsheetId,
+                    'updates': {'updatedRange': rango_escrito, 'updatedRows': len(valores)}}
+        return _Peticion(backend, 'sheets.spreadsheets.values.append', accion, body, uri)
+
+    def batchUpdate(self, spreadsheetId, body):
+        backend = self._backend
+        uri = 'fake://sheets.spreadsheets.values.batchUpdate'
+        def accion():
+            # Validar todos los rangos antes de escribir: la API real es atómica
+            bloques = [(backend._hoja_y_limites(dato['range'], uri), dato.get('values', []))
+                       for dato in body.get('data', [])]
+            for (nombre_hoja, (c0, _, f0, _)), valores in bloques:
+                backend._escribir_bloque(nombre_hoja, f0, c0, valores)
+            return {'spreadsheetId': spreadsheetId, 'totalUpdatedRanges': len(bloques),
+                    'totalUpdatedRows': sum(len(valores) for _, valores in bloques)}
+        return _Peticion(backend, 'sheets.spreadsheets.values.batchUpdate', accion, body, uri)
+
+
+class _DriveService:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def files(self):
+        return _Files(self._backend)
+
+
+class _Files:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def get(self, fileId, fields=None, **kwargs):
+        backend = self._backend
+        def accion():
+            # Cualquier otro fileId se toma como el spreadsheet (el doble tiene uno solo)
+            if fileId in backend.archivos:
+                return {'id': fileId, 'version': '1'}
+            modificado = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(backend.modificado))
+            return {'id': fileId, 'version': str(backend.version), 'modifiedTime': f'{modificado}.000Z'}
+        return _Peticion(backend, 'drive.files.get', accion, uri=f'fake://drive.files.get/{fileId}')
+
+    def create(self, body=None, media_body=None, fields=None, **kwargs):
+        backend = self._backend
+        contenido = _leer_media(media_body) if media_body is not None else b''
+        def accion():
+            file_id = f'fake-file-{next(backend._ids)}'
+            backend.archivos[file_id] = {'metadata': dict(body or {}), 'contenido': contenido}
+            return {'id': file_id}
+        return _Peticion(backend, 'drive.files.create', accion, body, bytes_media=len(contenido))
+
+
+def _leer_media(media_body):
+    """Lee un MediaUpload por partes, como lo haría una subida reanudable."""
+    partes = []
+    inicio = 0
+    tamano_parte = media_body.chunksize() if media_body.chunksize() > 0 else 1024 * 1024
+    while True:
+        parte = media_body.getbytes(inicio, tamano_parte)
+        partes.append(parte)
+        inicio += len(parte)
+        total = media_body.size()
+        if len(parte) < tamano_parte or (total is not None and inicio >= total):
+            return b''.join(partes)
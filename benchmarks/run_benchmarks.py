@@ -0,0 +1,236 @@
+"""
+Benchmarks de ingesta, exportación, lectura de todas las compañías (también desde varias sesiones) y envío contra el backend falso (sin cuotas de Google).
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.run_benchmarks                       # 1k, 10k y 100k filas
+    python -m benchmarks.run_benchmarks --filas 1000 --latencia 0.05 --p429 0.02
+    python -m benchmarks.run_benchmarks --json resultados.json
+    python -m benchmarks.run_benchmarks --filas 1000 --cuota 60      # con la cuota real por minuto
+
+Para cada escenario informa llamadas a la API, errores 429, reintentos, bytes
+enviados/recibidos y tiempo total, de modo que una regresión en el número de llamadas se vea antes de producción.
+"""
+import argparse
+import importlib.util
+import json
+import time
+import uuid
+
+import pandas as pd
+from streamlit import config as st_config, logger as st_logger
+
+from utils.google_sheets import (
+    ENCABEZADOS,
+    BufferFlagsWSP,
+    agregar_o_actualizar_datos,
+    configurar_revisiones,
+    exportar_hoja_a_drive,
+    leer_datos_hoja,
+    leer_pendientes_wsp,
+    leer_varias_hojas,
+    verificar_o_crear_hoja
+)
+from utils.request_scheduler import EjecutorPeticiones, configurar_ejecutor, obtener_ejecutor
+from utils.whatsapp_messaging import dispatch_messages, render_messages
+from .fake_google import FakeGoogleBackend
+
+TAMANOS_POR_DEFECTO = [1000, 10000, 100000]
+PLANTILLA_BENCHMARK = "Hola {Nombre_Apellido}, te escribimos por tu póliza {ID_Cliente_Compania}."
+
+
+def generar_filas(cantidad, variante=0):
+    """Filas con la estructura de ENCABEZADOS, como las devuelve preparar_datos_para_hoja."""
+    return [
+        ['', f'Cliente {i}', f'ID_BEN_{i + 1:04d}', 'DNI', f'54911{i:07d}', '',
+         f'cliente{i}@example.com', f'POL-{i}-{variante if i % 10 == 0 else 0}',
+         f'2024-01-01 00:00:{variante:02d}', 'FALSE', '']
+        for i in range(cantidad)
+    ]
+
+
+def _medir(backend, nombre, funcion):
+    backend.reiniciar_estadisticas()
+    reintentos_previos = obtener_ejecutor().reintentos
+    inicio = time.perf_counter()
+    detalle = funcion()
+    segundos = time.perf_counter() - inicio
+    resumen = backend.resumen()
+    return {'escenario': nombre, 'segundos': round(segundos, 3), 'llamadas': resumen['llamadas'],
+            'errores_429': resumen['errores_429'], 'reintentos': obtener_ejecutor().reintentos - reintentos_previos,
+            'bytes_enviados': resumen['bytes_enviados'],
+            'bytes_recibidos': resumen['bytes_recibidos'], 'detalle': detalle,
+            'por_metodo': {metodo: v['llamadas'] for metodo, v in resumen['por_metodo'].items()}}
+
+
+def benchmark_ingesta(backend, filas):
+    """Carga inicial, recarga idéntica, recarga con un 10% de filas modificadas y carga de un archivo con solo un 10% de los clientes."""
+    service = backend.sheets_service()
+    spreadsheet_id = f'bench-{uuid.uuid4().hex}' # Id nuevo: no reutilizar cachés de otras corridas
+    hoja = f'Bench_{filas}'
+    resultados = []
+
+    def carga(datos):
+        def ejecutar():
+            verificar_o_crear_hoja(service, spreadsheet_id, hoja)
+            agregados, actualizados, sin_cambios = agregar_o_actualizar_datos(service, spreadsheet_id, hoja, datos)
+            return {'agregados': agregados, 'actualizados': actualizados, 'sin_cambios': sin_cambios}
+        return ejecutar
+
+    resultados.append(_medir(backend, f'ingesta_inicial_{filas}', carga(generar_filas(filas))))
+    resultados.append(_medir(backend, f'ingesta_sin_cambios_{filas}', carga(generar_filas(filas))))
+    resultados.append(_medir(backend, f'ingesta_10pct_cambios_{filas}', carga(generar_filas(filas, variante=1))))
+    resultados.append(_medir(backend, f'ingesta_subconjunto_{filas}', carga(generar_filas(filas // 10, variante=2))))
+    return resultados
+
+
+def benchmark_exportacion(backend, filas, formatos=('csv', 'csv.gz', 'parquet')):
+    """Exportación a Drive en cada formato (Parquet solo si pyarrow está instalado)."""
+    drive_service = backend.drive_service()
+    datos = [ENCABEZADOS] + generar_filas(filas)
+    resultados = []
+    for formato in formatos:
+        if formato == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+            continue
+        def ejecutar():
+            file_id = exportar_hoja_a_drive(drive_service, datos, f'bench_{filas}', formato=formato)
+            return {'bytes_archivo': len(backend.archivos[file_id]['contenido']) if file_id else 0}
+        resultados.append(_medir(backend, f"exportacion_{formato.replace('.', '_')}_{filas}", ejecutar))
+    return resultados
+
+
+def benchmark_lectura_companias(backend, filas, companias=10):
+    """Lectura de todas las compañías: una llamada por hoja frente a un único batchGet."""
+    service = backend.sheets_service()
+    spreadsheet_id = f'bench-{uuid.uuid4().hex}'
+    hojas = [f'Compania_{filas}_{i}' for i in range(companias)]
+    for hoja in hojas:
+        backend.agregar_hoja(hoja, [ENCABEZADOS] + generar_filas(filas // companias))
+
+    def por_hoja():
+        return {'filas': sum(len(leer_datos_hoja(service, spreadsheet_id, hoja, usar_cache=False)) - 1 for hoja in hojas)}
+
+    def en_lote():
+        dataframes = leer_varias_hojas(service, spreadsheet_id, hojas, usar_cache=False)
+        return {'filas': sum(len(df) for df in dataframes.values())}
+
+    return [_medir(backend, f'lectura_companias_por_hoja_{filas}', por_hoja),
+            _medir(backend, f'lectura_companias_batchget_{filas}', en_lote)]
+
+
+def benchmark_consulta_pendientes(backend, filas):
+    """
+    Clientes con el mensaje WSP pendiente (el 10% cargado último, más uno de cada 50 del resto):
+    leyendo la hoja entera frente a la lectura proyectada.
+    """
+    service = backend.sheets_service()
+    spreadsheet_id = f'bench-{uuid.uuid4().hex}'
+    hoja = f'Pendientes_{filas}'
+    datos = generar_filas(filas)
+    for i, fila in enumerate(datos):
+        fila[9] = 'FALSE' if i >= filas - filas // 10 or i % 50 == 0 else 'TRUE'
+    backend.agregar_hoja(hoja, [ENCABEZADOS] + datos)
+
+    def completa():
+        valores = leer_datos_hoja(service, spreadsheet_id, hoja, usar_cache=False)
+        return {'pendientes': sum(1 for fila in valores[1:] if fila[9] == 'FALSE')}
+
+    def proyectada():
+        return {'pendientes': len(leer_pendientes_wsp(service, spreadsheet_id, hoja, usar_cache=False)['numeros_fila'])}
+
+    return [_medir(backend, f'pendientes_lectura_completa_{filas}', completa),
+            _medir(backend, f'pendientes_proyectada_{filas}', proyectada)]
+
+
+def benchmark_sesiones_compartidas(backend, filas, companias=10, sesiones=10):
+    """Varias sesiones leyendo todas las compañías: la caché por revisión las sirve con una sola lectura por hoja."""
+    service = backend.sheets_service()
+    spreadsheet_id = f'bench-{uuid.uuid4().hex}'
+    hojas = [f'Sesiones_{filas}_{i}' for i in range(companias)]
+    for hoja in hojas:
+        backend.agregar_hoja(hoja, [ENCABEZADOS] + generar_filas(filas // companias))
+
+    def ejecutar():
+        configurar_revisiones(backend.drive_service())
+        try:
+            for _ in range(sesiones):
+                for hoja in hojas:
+                    leer_datos_hoja(service, spreadsheet_id, hoja)
+        finally:
+            configurar_revisiones(None)
+        return {'sesiones': sesiones, 'hojas': companias}
+    return [_medir(backend, f'lectura_{sesiones}_sesiones_{filas}', ejecutar)]
+
+
+def benchmark_envio(backend, filas):
+    """Renderizado de plantilla + envío concurrente (proveedor instantáneo) + flags en lote."""
+    service = backend.sheets_service()
+    spreadsheet_id = f'bench-{uuid.uuid4().hex}'
+    hoja = f'Envio_{filas}'
+    backend.agregar_hoja(hoja, [ENCABEZADOS] + generar_filas(filas))
+    clientes = pd.DataFrame(generar_filas(filas), columns=ENCABEZADOS)
+    clientes['__row_number__'] = range(2, filas + 2)
+
+    def ejecutar():
+        mensajes = render_messages(PLANTILLA_BENCHMARK, clientes)
+        destinatarios = zip(clientes['__row_number__'], clientes['Numero_Telefono_1'], mensajes)
+        buffer_flags = BufferFlagsWSP(service, spreadsheet_id, max_pendientes=500)
+        enviados = 0
+        resultados = dispatch_messages('cliente_benchmark', destinatarios, max_concurrency=20,
+                                       messages_per_second=1_000_000, sender=lambda *_: (True, 'ok'))
+        for resultado in resultados:
+            if resultado['ok']:
+                buffer_flags.agregar(hoja, resultado['key'], True)
+                enviados += 1
+        buffer_flags.vaciar()
+        return {'enviados': enviados, 'flags_fallidos': len(buffer_flags.filas_fallidas())}
+    return [_medir(backend, f'envio_{filas}', ejecutar)]
+
+
+def imprimir_tabla(resultados):
+    columnas = ['escenario', 'segundos', 'llamadas', 'errores_429', 'reintentos', 'bytes_enviados', 'bytes_recibidos']
+    tabla = pd.DataFrame(resultados)[columnas + ['detalle']]
+    with pd.option_context('display.max_colwidth', 80, 'display.width', 200):
+        print(tabla.to_string(index=False))
+
+
+def _silenciar_avisos_streamlit():
+    """Fuera de `streamlit run`, cada st.* emite un aviso de contexto faltante."""
+    st_config.get_option('logger.level') # Fuerza el parseo de la config, que reinicia el nivel de log
+    st_logger.set_log_level('error')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, nargs='+', default=TAMANOS_POR_DEFECTO)
+    parser.add_argument('--latencia', type=float, default=0.0, help="Segundos de latencia simulada por llamada")
+    parser.add_argument('--p429', type=float, default=0.0, help="Probabilidad de 429 por llamada")
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--cuota', type=int, default=0,
+                        help="Peticiones de lectura y de escritura por minuto (0: sin límite, el backend falso no tiene cuotas)")
+    parser.add_argument('--espera-base', type=float, default=0.05,
+                        help="Espera base en segundos del backoff ante errores reintentables")
+    parser.add_argument('--json', help="Guardar los resultados en este archivo JSON")
+    args = parser.parse_args(argv)
+    _silenciar_avisos_streamlit()
+    configurar_ejecutor(EjecutorPeticiones(cuota_lecturas_por_minuto=args.cuota, cuota_escrituras_por_minuto=args.cuota,
+                                           espera_base=args.espera_base))
+
+    resultados = []
+    for filas in args.filas:
+        backend = FakeGoogleBackend(latencia_segundos=args.latencia, probabilidad_429=args.p429, semilla=args.semilla)
+        resultados += benchmark_ingesta(backend, filas)
+        resultados += benchmark_exportacion(backend, filas)
+        resultados += benchmark_lectura_companias(backend, filas)
+        resultados += benchmark_sesiones_compartidas(backend, filas)
+        resultados += benchmark_consulta_pendientes(backend, filas)
+        resultados += benchmark_envio(backend, filas)
+
+    imprimir_tabla(resultados)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as archivo:
+            json.dump(resultados, archivo, indent=2, ensure_ascii=False)
+    return resultados
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import streamlit as st
+
+# Tabla persistente de trabajos (misma carpeta que el espejo local)
+RUTA_TRABAJOS = os.path.join('.cache', 'trabajos.sqlite3')
+MAX_TRABAJOS_SIMULTANEOS = 2
+# Mensajes que se conservan por trabajo (los más recientes) y cada cuánto se persiste el progreso
+MAX_MENSAJES_POR_TRABAJO = 500
+INTERVALO_GUARDADO_SEGUNDOS = 1.0
+
+ESTADO_EN_COLA = 'en_cola'
+ESTADO_EN_CURSO = 'en_curso'
+ESTADO_COMPLETADO = 'completado'
+ESTADO_FALLIDO = 'fallido'
+ESTADO_CANCELADO = 'cancelado'
+ESTADO_INTERRUMPIDO = 'interrumpido' # El proceso terminó mientras el trabajo estaba pendiente
+ESTADOS_ACTIVOS = (ESTADO_EN_COLA, ESTADO_EN_CURSO)
+
+# Filas de una tabla (reporte.dataframe) que se guardan en la bitácora del trabajo
+MAX_FILAS_TABLA_MENSAJE = 200
+
+_hilo = threading.local()
+
+def contexto_trabajo_actual():
+    """ContextoTrabajo del hilo actual, o None si no corre dentro de un trabajo."""
+    return getattr(_hilo, 'contexto', None)
+
+@contextlib.contextmanager
+def en_contexto_trabajo(contexto):
+    """Ejecuta el bloque como parte de `contexto` (p.ej. en un hilo auxiliar del trabajo)."""
+    anterior = contexto_trabajo_actual()
+    _hilo.contexto = contexto
+    try:
+        yield
+    finally:
+        _hilo.contexto = anterior
+
+class ReporteTrabajo:
+    """
+    Reporte de un trabajo con la forma de st.info/st.warning/st.dataframe/...: las funciones
+    que informan al usuario (procesar_archivo, agregar_o_actualizar_datos, BufferFlagsWSP, ...)
+    reciben un `reporte`, que en la página es el propio módulo `st` y en un trabajo es este
+    objeto (contexto.reporte), que guarda cada mensaje en la bitácora del trabajo. Las tablas
+    se guardan como registros (hasta MAX_FILAS_TABLA_MENSAJE filas).
+    """
+
+    def __init__(self, contexto):
+        self._contexto = contexto
+
+    def _registrar(self, nivel, cuerpo):
+        self._contexto.registrar_mensaje(nivel, str(cuerpo))
+
+    def info(self, cuerpo, **kwargs):
+        self._registrar('info', cuerpo)
+
+    def warning(self, cuerpo, **kwargs):
+        self._registrar('warning', cuerpo)
+
+    def error(self, cuerpo, **kwargs):
+        self._registrar('error', cuerpo)
+
+    def success(self, cuerpo, **kwargs):
+        self._registrar('success', cuerpo)
+
+    def write(self, *args, **kwargs):
+        self._registrar('write', ' '.join(str(arg) for arg in args))
+
+    def markdown(self, cuerpo, **kwargs):
+        self._registrar('markdown', cuerpo)
+
+    def caption(self, cuerpo, **kwargs):
+        self._registrar('caption', cuerpo)
+
+    def dataframe(self, datos, **kwargs):
+        df = pd.DataFrame(datos)
+        tabla = json.loads(df.head(MAX_FILAS_TABLA_MENSAJE).to_json(orient='records', date_format='iso'))
+        resto = f" (se guardan las primeras {MAX_FILAS_TABLA_MENSAJE})" if len(df) > MAX_FILAS_TABLA_MENSAJE else ''
+        self._contexto.registrar_mensaje('dataframe', f"Tabla de {len(df)} filas{resto}", tabla=tabla)
+
+class ContextoTrabajo:
+    """
+    Lo que recibe la función de un trabajo para informar progreso, mensajes y cancelación.
+    Los mensajes se informan con `reporte` (ver ReporteTrabajo), que se pasa a las funciones
+    que en la página mostrarían el mensaje con st.
+    Un trabajo `cancelable` consulta debe_detenerse() entre pasos; el trabajo queda como
+    cancelado solo si efectivamente se detuvo por eso.
+    """
+
+    def __init__(self, gestor, id_trabajo, cancelable=False):
+        self._gestor = gestor
+        self.id = id_trabajo
+        self.cancelable = cancelable
+        self.hechos = 0
+        self.total = None
+        self.texto = ''
+        self.mensajes = []
+        self.cancelado = False # Se pidió cancelar
+        self.detenido = False # La función dejó trabajo sin hacer por la cancelación
+        self.iniciado = False
+        self.reporte = ReporteTrabajo(self)
+        self._lock = threading.Lock()
+        self._ultimo_guardado = 0.0
+
+    def progreso(self, hechos, total=None, texto=None):
+        with self._lock:
+            self.hechos = hechos
+            if total is not None:
+                self.total = total
+            if texto is not None:
+                self.texto = texto
+        self._guardar_si_corresponde()
+
+    def debe_detenerse(self):
+        """True si se pidió cancelar; quien lo consulta debe dejar de hacer trabajo nuevo."""
+        if self.cancelado:
+            self.detenido = True
+        return self.cancelado
+
+    def registrar_mensaje(self, nivel, texto, tabla=None):
+        mensaje = {'nivel': nivel, 'texto': texto, 'en': time.time()}
+        if tabla is not None:
+            mensaje['tabla'] = tabla # Lista de registros (ver ReporteTrabajo.dataframe)
+        with self._lock:
+            self.mensajes.append(mensaje)
+            del self.mensajes[:-MAX_MENSAJES_POR_TRABAJO]
+        self._guardar_si_corresponde()
+
+    def _guardar_si_corresponde(self):
+        ahora = time.monotonic()
+        if ahora - self._ultimo_guardado >= INTERVALO_GUARDADO_SEGUNDOS:
+            self._ultimo_guardado = ahora
+            self._gestor._guardar_avance(self)
+
+    def instantanea(self):
+        with self._lock:
+            return {'hechos': self.hechos, 'total': self.total, 'texto': self.texto,
+                    'mensajes': list(self.mensajes)}
+
+class GestorTrabajos:
+    """
+    Ejecuta trabajos largos (cargas de archivos, campañas de envío) en un pool de hilos,
+    fuera del hilo del script de Streamlit: un rerun o refrescar el navegador no los corta,
+    y varias sesiones pueden encolar trabajos a la vez. El estado, el progreso, la bitácora
+    de mensajes y el resultado se guardan en una tabla SQLite, así la interfaz los consulta
+    desde cualquier rerun o sesión. Los trabajos pendientes al reiniciar el proceso quedan
+    como 'interrumpido' (no se pueden retomar: sus datos estaban en memoria).
+
+    La función de un trabajo recibe un ContextoTrabajo como primer argumento y devuelve un
+    resultado serializable a JSON.
+    """
+
+    def __init__(self, ruta=RUTA_TRABAJOS, max_trabajos=MAX_TRABAJOS_SIMULTANEOS):
+        if ruta != ':memory:':
+            os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self._conexion.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._contextos = {} # id -> ContextoTrabajo de los trabajos activos
+        with self._lock, self._conexion:
+            self._conexion.execute(
+                "CREATE TABLE IF NOT EXISTS trabajos ("
+                " id TEXT PRIMARY KEY, tipo TEXT, descripcion TEXT, usuario TEXT, estado TEXT,"
+                " hechos INTEGER, total INTEGER, texto TEXT, mensajes TEXT, resultado TEXT, error TEXT,"
+                " creado_en REAL, iniciado_en REAL, terminado_en REAL)"
+            )
+            self._conexion.execute(
+                "UPDATE trabajos SET estado = ?, terminado_en = ? WHERE estado IN (?, ?)",
+                (ESTADO_INTERRUMPIDO, time.time(), *ESTADOS_ACTIVOS)
+            )
+        self._pool = ThreadPoolExecutor(max_workers=max_trabajos, thread_name_prefix='trabajo')
+
+    def enviar(self, tipo, descripcion, funcion, *args, usuario=None, cancelable=False, **kwargs):
+        """
+        Encola `funcion(contexto, *args, **kwargs)` y devuelve el id del trabajo. Con
+        cancelable=True la función debe atender contexto.debe_detenerse(); si no, el trabajo
+        solo se puede cancelar mientras está en cola.
+        """
+        id_trabajo = uuid.uuid4().hex
+        contexto = ContextoTrabajo(self, id_trabajo, cancelable=cancelable)
+        with self._lock, self._conexion:
+            self._contextos[id_trabajo] = contexto
+            self._conexion.execute(
+                "INSERT INTO trabajos (id, tipo, descripcion, usuario, estado, hechos, texto, mensajes, creado_en)"
+                " VALUES (?, ?, ?, ?, ?, 0, '', '[]', ?)",
+                (id_trabajo, tipo, descripcion, usuario, ESTADO_EN_COLA, time.time())
+            )
+        self._pool.submit(self._ejecutar, contexto, funcion, args, kwargs)
+        return id_trabajo
+
+    def _ejecutar(self, contexto, funcion, args, kwargs):
+        with self._lock:
+            cancelado_en_cola = contexto.cancelado
+            contexto.iniciado = True
+        if cancelado_en_cola:
+            self._terminar(contexto, ESTADO_CANCELADO)
+            return
+        with self._lock, self._conexion:
+            self._conexion.execute("UPDATE trabajos SET estado = ?, iniciado_en = ? WHERE id = ?",
+                                   (ESTADO_EN_CURSO, time.time(), contexto.id))
+        try:
+            with en_contexto_trabajo(contexto):
+                resultado = funcion(contexto, *args, **kwargs)
+        except Exception as e:
+            contexto.registrar_mensaje('error', traceback.format_exc(limit=5))
+            self._terminar(contexto, ESTADO_FALLIDO, error=str(e))
+        else:
+            if contexto.cancelado and not contexto.detenido:
+                contexto.registrar_mensaje('info', "El trabajo terminó completo antes de poder cancelarse.")
+            self._terminar(contexto, ESTADO_CANCELADO if contexto.detenido else ESTADO_COMPLETADO,
+                           resultado=resultado)
+
+    def _guardar_avance(self, contexto):
+        avance = contexto.instantanea()
+        with self._lock, self._conexion:
+            self._conexion.execute(
+                "UPDATE trabajos SET hechos = ?, total = ?, texto = ?, mensajes = ? WHERE id = ?",
+                (avance['hechos'], avance['total'], avance['texto'],
+                 json.dumps(avance['mensajes'], ensure_ascii=False), contexto.id)
+            )
+
+    def _terminar(self, contexto, estado, resultado=None, error=None):
+        self._guardar_avance(contexto)
+        with self._lock, self._conexion:
+            self._conexion.execute(
+                "UPDATE trabajos SET estado = ?, resultado = ?, error = ?, terminado_en = ? WHERE id = ?",
+                (estado, json.dumps(resultado, ensure_ascii=False, default=str), error, time.time(), contexto.id)
+            )
+            self._contextos.pop(contexto.id, None)
+
+    def cancelar(self, id_trabajo):
+        """
+        Pide cancelar el trabajo: si está en cola no llega a correr; si está en curso, la
+        función lo nota al consultar contexto.debe_detenerse(). Devuelve False si el trabajo
+        ya terminó o no se puede cancelar (en curso y no cancelable).
+        """
+        with self._lock:
+            contexto = self._contextos.get(id_trabajo)
+            if contexto is None or (contexto.iniciado and not contexto.cancelable):
+                return False
+            contexto.cancelado = True
+        contexto.registrar_mensaje('warning', "Cancelación solicitada.")
+        return True
+
+    def _a_dict(self, fila):
+        trabajo = dict(fila)
+        trabajo['mensajes'] = json.loads(trabajo['mensajes'] or '[]')
+        trabajo['resultado'] = json.loads(trabajo['resultado']) if trabajo['resultado'] else None
+        contexto = self._contextos.get(trabajo['id'])
+        if contexto is not None: # Activo: el progreso en memoria es más reciente que el guardado
+            trabajo.update(contexto.instantanea())
+            trabajo['cancelado'] = contexto.cancelado
+            trabajo['cancelable'] = contexto.cancelable or not contexto.iniciado
+        return trabajo
+
+    def obtener(self, id_trabajo):
+        """El trabajo como dict (estado, hechos, total, texto, mensajes, resultado, ...), o None."""
+        with self._lock:
+            fila = self._conexion.execute("SELECT * FROM trabajos WHERE id = ?", (id_trabajo,)).fetchone()
+            return self._a_dict(fila) if fila else None
+
+    def listar(self, tipo=None, limite=20):
+        """Los trabajos más recientes (de todas las sesiones), opcionalmente de un tipo."""
+        consulta, parametros = "SELECT * FROM trabajos", []
+        if tipo is not None:
+            consulta += " WHERE tipo = ?"
+            parametros.append(tipo)
+        consulta += " ORDER BY creado_en DESC LIMIT ?"
+        parametros.append(limite)
+        with self._lock:
+            return [self._a_dict(fila) for fila in self._conexion.execute(consulta, parametros).fetchall()]
+
+    def hay_activos(self, tipo=None):
+        """True si hay trabajos en cola o en curso (de `tipo`, si se indica)."""
+        consulta, parametros = "SELECT 1 FROM trabajos WHERE estado IN (?, ?)", list(ESTADOS_ACTIVOS)
+        if tipo is not None:
+            consulta += " AND tipo = ?"
+            parametros.append(tipo)
+        with self._lock:
+            return self._conexion.execute(consulta + " LIMIT 1", parametros).fetchone() is not None
+
+@st.cache_resource
+def obtener_gestor_trabajos():
+    """Gestor de trabajos compartido por todas las sesiones del proceso."""
+    return GestorTrabajos()
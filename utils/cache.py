@@ -0,0 +1,57 @@
+import threading
+import time
+from collections import OrderedDict
+
+class CacheTTL:
+    """
+    Caché en memoria acotada por número de entradas (desaloja la menos usada, LRU)
+    y con expiración por antigüedad (TTL). Es segura para usar desde varios hilos.
+    Los valores se devuelven tal cual se guardaron: quien los lea no debe modificarlos.
+    """
+
+    def __init__(self, max_entradas=64, ttl_segundos=300):
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+        self._entradas = OrderedDict() # clave -> (instante_guardado, valor)
+        self._lock = threading.Lock()
+
+    def obtener(self, clave, defecto=None):
+        """Devuelve el valor guardado para la clave, o `defecto` si no existe o expiró."""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return defecto
+            guardado, valor = entrada
+            if time.monotonic() - guardado > self.ttl_segundos:
+                del self._entradas[clave]
+                return defecto
+            self._entradas.move_to_end(clave) # Marcar como usada recientemente
+            return valor
+
+    def guardar(self, clave, valor):
+        """Guarda un valor, desalojando las entradas menos usadas si se supera el máximo."""
+        with self._lock:
+            self._entradas[clave] = (time.monotonic(), valor)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def invalidar(self, clave):
+        with self._lock:
+            self._entradas.pop(clave, None)
+
+    def invalidar_si(self, predicado):
+        """Elimina las entradas cuya clave cumple `predicado(clave)`. Devuelve cuántas se eliminaron."""
+        with self._lock:
+            claves = [clave for clave in self._entradas if predicado(clave)]
+            for clave in claves:
+                del self._entradas[clave]
+            return len(claves)
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entradas)
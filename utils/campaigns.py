@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from .google_sheets import BufferFlagsWSP
+from .whatsapp_messaging import dispatch_messages, DEFAULT_MAX_CONCURRENCY, DEFAULT_MESSAGES_PER_SECOND
+
+# Bitácoras de salida de las campañas (misma carpeta que el espejo local y los trabajos)
+RUTA_CAMPANAS = os.path.join('.cache', 'campanas')
+
+# Eventos de la bitácora, en el orden en que ocurren para cada destinatario
+EVENTO_INTENTO = 'intento' # Justo antes de llamar al proveedor
+EVENTO_ENVIADO = 'enviado'
+EVENTO_FALLIDO = 'fallido' # El proveedor rechazó el envío: se puede reintentar
+EVENTO_FLAG = 'flag' # Mensaje_WSP_Enviado quedó en TRUE en Google Sheets
+
+# Campañas con un trabajo en curso en este proceso (dos trabajos de la misma campaña duplicarían envíos)
+_campanas_en_curso = set()
+_lock_campanas_en_curso = threading.Lock()
+
+def hash_plantilla(plantilla):
+    """Identifica una plantilla de mensaje: la misma plantilla es la misma campaña."""
+    return hashlib.sha256(plantilla.encode('utf-8')).hexdigest()[:16]
+
+def _clave_destinatario(destinatario):
+    """Numero_Identificacion del destinatario, o su fila si no tiene identificación."""
+    identificacion = str(destinatario.get('identificacion') or '').strip()
+    return identificacion or f"fila:{int(destinatario['fila'])}"
+
+class Campana:
+    """
+    Campaña de envío (una hoja y una plantilla) con una bitácora de salida en disco: un JSONL
+    de solo agregado donde se registra cada intento, cada resultado y cada flag guardado en
+    Google Sheets, por (hoja, Numero_Identificacion, hash de la plantilla). Cada registro se
+    sincroniza a disco antes de seguir, así la bitácora sobrevive a un rerun o a la caída del
+    proceso y la columna J deja de ser el único registro de quién recibió el mensaje.
+
+    Al retomar una campaña: los destinatarios ya enviados no se reenvían (solo se guarda su
+    flag si faltaba) y los que tienen un intento sin resultado quedan "en duda" (el proceso
+    cayó durante el envío), que por defecto tampoco se reenvían.
+    """
+
+    def __init__(self, nombre_hoja, plantilla, ruta=RUTA_CAMPANAS):
+        self.nombre_hoja = nombre_hoja
+        self.hash_plantilla = hash_plantilla(plantilla)
+        nombre_archivo = re.sub(r'[^0-9A-Za-z_-]+', '_', nombre_hoja)[:40]
+        self.ruta_bitacora = os.path.join(ruta, f"{nombre_archivo}_{self.hash_plantilla}.jsonl")
+        self._estado = {} # clave -> {'fila', 'intento', 'enviado', 'flag'}
+        self._lock = threading.Lock()
+        self._cargar()
+
+    def _cargar(self):
+        if not os.path.exists(self.ruta_bitacora):
+            return
+        with open(self.ruta_bitacora, encoding='utf-8') as archivo:
+            for linea in archivo:
+                try:
+                    registro = json.loads(linea)
+                except ValueError:
+                    continue # Última línea a medio escribir si el proceso cayó
+                # El nombre del archivo se normaliza: descartar registros de otra hoja u otra plantilla
+                if registro.get('hoja') != self.nombre_hoja or registro.get('plantilla') != self.hash_plantilla:
+                    continue
+                self._aplicar(registro)
+
+    def _aplicar(self, registro):
+        estado = self._estado.setdefault(registro['clave'], {'fila': None, 'intento': False,
+                                                              'enviado': False, 'flag': False})
+        if registro.get('fila') is not None:
+            estado['fila'] = registro['fila']
+        evento = registro['evento']
+        if evento == EVENTO_INTENTO:
+            estado['intento'] = True
+        elif evento == EVENTO_ENVIADO:
+            estado['intento'], estado['enviado'] = False, True
+        elif evento == EVENTO_FALLIDO:
+            estado['intento'] = False
+        elif evento == EVENTO_FLAG:
+            estado['flag'] = True
+
+    def registrar(self, eventos):
+        """Agrega los eventos [(evento, clave, fila, detalle)] a la bitácora y los sincroniza a disco."""
+        registros = [{'evento': evento, 'hoja': self.nombre_hoja, 'plantilla': self.hash_plantilla,
+                      'clave': clave, 'fila': fila, 'detalle': detalle, 'en': time.time()}
+                     for evento, clave, fila, detalle in eventos]
+        if not registros:
+            return
+        with self._lock:
+            os.makedirs(os.path.dirname(self.ruta_bitacora) or '.', exist_ok=True)
+            with open(self.ruta_bitacora, 'a', encoding='utf-8') as archivo:
+                archivo.write(''.join(json.dumps(registro, ensure_ascii=False) + '\n' for registro in registros))
+                archivo.flush()
+                os.fsync(archivo.fileno())
+            for registro in registros:
+                self._aplicar(registro)
+
+    def clasificar(self, destinatarios, reenviar_en_duda=False):
+        """
+        Separa `destinatarios` (dicts con 'fila' e 'identificacion') en
+        (por_enviar, ya_enviados, en_duda). Los en duda van a por_enviar si `reenviar_en_duda`.
+        Si varias filas son el mismo cliente (misma identificación), solo se considera la primera.
+        """
+        por_enviar, ya_enviados, en_duda = [], [], []
+        vistos = set()
+        with self._lock:
+            for destinatario in destinatarios:
+                clave = _clave_destinatario(destinatario)
+                if clave in vistos:
+                    continue
+                vistos.add(clave)
+                estado = self._estado.get(clave)
+                if estado is None:
+                    por_enviar.append(destinatario)
+                elif estado['enviado']:
+                    ya_enviados.append(destinatario)
+                elif estado['intento']:
+                    (por_enviar if reenviar_en_duda else en_duda).append(destinatario)
+                else:
+                    por_enviar.append(destinatario)
+        return por_enviar, ya_enviados, en_duda
+
+    def sin_flag(self):
+        """[(clave, fila)] de los destinatarios enviados cuyo flag no consta como guardado."""
+        with self._lock:
+            return [(clave, estado['fila']) for clave, estado in self._estado.items()
+                    if estado['enviado'] and not estado['flag']]
+
+    def resumen(self):
+        with self._lock:
+            estados = list(self._estado.values())
+        return {'enviados': sum(e['enviado'] for e in estados),
+                'sin_flag': sum(e['enviado'] and not e['flag'] for e in estados),
+                'en_duda': sum(e['intento'] and not e['enviado'] for e in estados)}
+
+def trabajo_campana_envio(contexto, service, spreadsheet_id, nombre_hoja, whatsapp_client, plantilla,
+                          destinatarios, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                          messages_per_second=DEFAULT_MESSAGES_PER_SECOND, reenviar_en_duda=False):
+    """
+    Función de trabajo en segundo plano (ver utils/background_jobs.py) que envía una campaña
+    de WhatsApp y marca Mensaje_WSP_Enviado en lote para los envíos exitosos.
+    `destinatarios` es una lista de dicts {'fila', 'identificacion', 'nombre', 'telefono',
+    'mensaje'} con los mensajes ya renderizados con `plantilla`. La campaña se retoma desde su
+    bitácora (ver Campana): solo se envía a quienes no la recibieron y se guardan los flags que
+    faltaban. Se puede cancelar entre envíos (contexto.debe_detenerse()).
+    Devuelve {'exitos', 'fallos', 'omitidos', 'en_duda', 'flags_resincronizados', 'flags_fallidos', 'envios'}.
+    """
+    campana = Campana(nombre_hoja, plantilla)
+    with _lock_campanas_en_curso:
+        if campana.ruta_bitacora in _campanas_en_curso:
+            raise RuntimeError(f"Ya hay un envío en curso de esta plantilla para '{nombre_hoja}'.")
+        _campanas_en_curso.add(campana.ruta_bitacora)
+    try:
+        return _enviar_campana(contexto, service, spreadsheet_id, campana, whatsapp_client, destinatarios,
+                               max_concurrency, messages_per_second, reenviar_en_duda)
+    finally:
+        with _lock_campanas_en_curso:
+            _campanas_en_curso.discard(campana.ruta_bitacora)
+
+def _enviar_campana(contexto, service, spreadsheet_id, campana, whatsapp_client, destinatarios,
+                    max_concurrency, messages_per_second, reenviar_en_duda):
+    nombre_hoja = campana.nombre_hoja
+    por_enviar, ya_enviados, en_duda = campana.clasificar(destinatarios, reenviar_en_duda=reenviar_en_duda)
+    if ya_enviados:
+        contexto.reporte.info(f"{len(ya_enviados)} clientes ya recibieron este mensaje según la bitácora de la campaña; no se les reenvía.")
+    if en_duda:
+        contexto.reporte.warning(f"{len(en_duda)} clientes tienen un envío sin confirmar (el proceso se interrumpió durante el envío); "
+                   "no se les reenvía para no duplicar el mensaje.")
+
+    # Todas las filas de cada cliente: al enviarle, se marca el flag en cada una
+    filas_por_clave = {}
+    for destinatario in destinatarios:
+        filas_por_clave.setdefault(_clave_destinatario(destinatario), []).append(int(destinatario['fila']))
+    clave_por_fila = {fila: clave for clave, filas in filas_por_clave.items() for fila in filas}
+    por_fila = {int(destinatario['fila']): destinatario for destinatario in por_enviar}
+
+    def al_confirmar(claves):
+        campana.registrar([(EVENTO_FLAG, clave_por_fila[fila], fila, None)
+                           for _, fila in claves if fila in clave_por_fila])
+
+    buffer_flags = BufferFlagsWSP(service, spreadsheet_id, al_confirmar=al_confirmar, reporte=contexto.reporte)
+
+    # Enviados en una ejecución anterior cuyo flag no llegó a guardarse (con la fila actual si se conoce)
+    sin_flag = campana.sin_flag()
+    for clave, fila in sin_flag:
+        for fila in filas_por_clave.get(clave) or [fila]:
+            clave_por_fila[fila] = clave
+            buffer_flags.agregar(nombre_hoja, fila, True)
+
+    def antes_de_enviar(fila):
+        campana.registrar([(EVENTO_INTENTO, clave_por_fila[fila], fila, None)])
+
+    def despues_de_enviar(resultado):
+        # Se registra en el hilo del envío: queda asentado aunque el trabajo se cancele
+        campana.registrar([(EVENTO_ENVIADO if resultado['ok'] else EVENTO_FALLIDO,
+                            clave_por_fila[resultado['key']], resultado['key'], resultado['detail'])])
+
+    total = len(por_fila)
+    contexto.progreso(0, total)
+    envios = []
+    exitos = fallos = 0
+
+    resultados_envio = dispatch_messages(
+        whatsapp_client,
+        ((fila, destinatario['telefono'], destinatario['mensaje']) for fila, destinatario in por_fila.items()),
+        max_concurrency=max_concurrency, messages_per_second=messages_per_second,
+        before_send=antes_de_enviar, after_send=despues_de_enviar, reporter=contexto.reporte
+    )
+    try:
+        for i, resultado in enumerate(resultados_envio):
+            destinatario = por_fila[resultado['key']]
+            if resultado['ok']:
+                for fila in filas_por_clave[clave_por_fila[resultado['key']]]:
+                    buffer_flags.agregar(nombre_hoja, fila, True)
+                exitos += 1
+            else:
+                fallos += 1
+            envios.append({'Fila': resultado['key'], 'Nombre_Apellido': destinatario['nombre'],
+                           'Telefono': resultado['phone'], 'Enviado': resultado['ok'],
+                           'Detalle': resultado['detail'], 'Latencia_s': round(resultado['latency'], 3),
+                           'Mensaje': destinatario['mensaje']})
+            contexto.progreso(i + 1, texto=f"Completados {i + 1}/{total}: {destinatario['nombre']}")
+            if contexto.debe_detenerse():
+                break
+    finally:
+        resultados_envio.close() # Si se canceló, no arrancar los envíos pendientes
+        # Los flags de lo ya enviado se guardan aunque el trabajo se cancele o falle
+        buffer_flags.vaciar()
+
+    nombres = {int(destinatario['fila']): destinatario['nombre'] for destinatario in destinatarios}
+    flags_fallidos = [{'Fila': fila, 'Nombre_Apellido': nombres.get(fila, '')}
+                      for _, fila in buffer_flags.filas_fallidas()]
+    if flags_fallidos:
+        contexto.reporte.warning(f"{len(flags_fallidos)} mensajes se enviaron (simulado) pero su flag no se pudo actualizar en Google Sheets. "
+                   "Se guardarán al retomar la campaña.")
+    elif buffer_flags.resultados:
+        contexto.reporte.caption(f"Flags actualizados a TRUE en Google Sheets para {len(buffer_flags.resultados)} clientes.")
+    return {'exitos': exitos, 'fallos': fallos, 'omitidos': len(ya_enviados),
+            'en_duda': [{'Fila': int(d['fila']), 'Nombre_Apellido': d['nombre']} for d in en_duda],
+            'flags_resincronizados': len(sin_flag), 'flags_fallidos': flags_fallidos, 'envios': envios}
@@ -0,0 +1,122 @@
+import unicodedata
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from .sheet_data import obtener_datos_hoja, mascaras_estado_wsp
+
+ESTADO_WSP_PENDIENTE = 'pendiente'
+ESTADO_WSP_ENVIADO = 'enviado'
+
+# Marcas diacríticas que deja NFKD ('á' -> 'a' + U+0301)
+_PATRON_DIACRITICOS = '[\u0300-\u036f]'
+
+def normalizar_texto(texto):
+    """Minúsculas y sin acentos, para comparar nombres: 'Peña Ávila' -> 'pena avila'."""
+    descompuesto = unicodedata.normalize('NFKD', str(texto))
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c)).casefold()
+
+def _normalizar_serie(serie):
+    """normalizar_texto vectorizado sobre una Serie de texto (los nulos quedan como '')."""
+    return (serie.fillna('').astype(str).str.normalize('NFKD')
+            .str.replace(_PATRON_DIACRITICOS, '', regex=True).str.casefold())
+
+def resumir_companias(dataframes):
+    """
+    Totales por compañía a partir de {nombre_hoja: DataFrame} (como devuelve
+    leer_varias_hojas): clientes, mensajes WSP pendientes y enviados.
+    """
+    filas = []
+    for nombre_hoja, df in dataframes.items():
+        pendiente, enviado = mascaras_estado_wsp(df)
+        filas.append({'Compañía': nombre_hoja, 'Clientes': len(df),
+                      'WSP_Pendientes': int(pendiente.sum()), 'WSP_Enviados': int(enviado.sum())})
+    return pd.DataFrame(filas, columns=['Compañía', 'Clientes', 'WSP_Pendientes', 'WSP_Enviados'])
+
+class IndiceClientes:
+    """
+    Índice de los clientes de una hoja, construido una vez sobre sus DatosHoja (y compartido,
+    como ellos, por todas las sesiones; ver obtener_indice_clientes):
+
+    - `df`: el DataFrame tipado de la hoja, con la columna auxiliar '__row_number__'.
+    - nombres normalizados (sin acentos ni mayúsculas) para la búsqueda por texto;
+      la búsqueda que extiende la anterior (al seguir escribiendo) solo recorre sus resultados.
+    - el estado WhatsApp como dos máscaras booleanas (pendiente / enviado).
+    - los Numero_Identificacion factorizados y ordenados, para ubicar la fila de un cliente
+      sin recorrer la tabla.
+
+    Los filtros devuelven posiciones (np.ndarray) sobre `df`; usar df.iloc[posiciones].
+    """
+
+    def __init__(self, datos_hoja):
+        self.datos_hoja = datos_hoja
+        self.df = datos_hoja.df
+
+        vacia = pd.Series('', index=self.df.index)
+        self._nombres = self.df['Nombre_Apellido'] if 'Nombre_Apellido' in self.df else vacia
+        self._ids = self.df['Numero_Identificacion'] if 'Numero_Identificacion' in self.df else vacia
+        self._nombres_normalizados = _normalizar_serie(self._nombres)
+        self._pendiente, self._enviado = datos_hoja.pendiente, datos_hoja.enviado
+
+        codigos, unicos = pd.factorize(self._ids)
+        self._ids_unicos = pd.Index(unicos)
+        self._orden_por_id = np.argsort(codigos, kind='stable')
+        self._codigos_ordenados = codigos[self._orden_por_id]
+        self._todas = np.arange(len(self.df))
+        self._ultima_busqueda = ('', self._todas)
+
+    def etiquetas(self, posiciones):
+        """Opciones del selector de clientes ('Numero_Identificacion - Nombre_Apellido') de `posiciones`."""
+        return (self._ids.iloc[posiciones] + " - " + self._nombres.iloc[posiciones]).tolist()
+
+    def buscar_nombre(self, texto):
+        """Posiciones cuyo Nombre_Apellido contiene `texto` (sin distinguir mayúsculas ni acentos)."""
+        texto = normalizar_texto(texto)
+        if not texto:
+            return self._todas
+        texto_anterior, posiciones_anteriores = self._ultima_busqueda
+        if texto == texto_anterior:
+            return posiciones_anteriores
+        # Si la búsqueda extiende la anterior, sus resultados son un subconjunto de los anteriores
+        candidatas = posiciones_anteriores if texto_anterior and texto_anterior in texto else self._todas
+        coincide = self._nombres_normalizados.iloc[candidatas].str.contains(texto, regex=False).to_numpy()
+        posiciones = candidatas[coincide]
+        self._ultima_busqueda = (texto, posiciones)
+        return posiciones
+
+    def filtrar(self, texto_nombre='', estado_wsp=None):
+        """Posiciones que cumplen la búsqueda por nombre y el estado (ESTADO_WSP_PENDIENTE/ENVIADO o None)."""
+        posiciones = self.buscar_nombre(texto_nombre)
+        if estado_wsp == ESTADO_WSP_PENDIENTE:
+            posiciones = posiciones[self._pendiente[posiciones]]
+        elif estado_wsp == ESTADO_WSP_ENVIADO:
+            posiciones = posiciones[self._enviado[posiciones]]
+        return posiciones
+
+    def fila_de(self, num_id, posiciones=None):
+        """
+        Número de fila en la hoja del primer cliente con ese Numero_Identificacion (entre
+        `posiciones`, si se indican), o None si no hay ninguno.
+        """
+        codigo = self._ids_unicos.get_indexer([num_id])[0]
+        if codigo < 0:
+            return None
+        inicio, fin = np.searchsorted(self._codigos_ordenados, [codigo, codigo + 1])
+        candidatas = self._orden_por_id[inicio:fin]
+        if posiciones is not None:
+            candidatas = candidatas[np.isin(candidatas, posiciones)]
+        return int(self.df['__row_number__'].iat[candidatas[0]]) if len(candidatas) else None
+
+_indices_por_datos = weakref.WeakKeyDictionary() # DatosHoja -> IndiceClientes (se va con sus datos)
+
+def obtener_indice_clientes(spreadsheet_id, nombre_hoja, datos_crudos):
+    """
+    Devuelve el IndiceClientes de la hoja, compartido por todas las sesiones: se reconstruye
+    solo si `datos_crudos` no es la misma lista indexada (p.ej. tras una escritura o un refresco).
+    """
+    datos_hoja = obtener_datos_hoja(spreadsheet_id, nombre_hoja, datos_crudos)
+    indice = _indices_por_datos.get(datos_hoja)
+    if indice is None:
+        indice = _indices_por_datos[datos_hoja] = IndiceClientes(datos_hoja)
+    return indice
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from functools import lru_cache
+
+# Perfiles de mapeo confirmados (misma carpeta que el espejo local y los trabajos)
+RUTA_PERFILES = os.path.join('.cache', 'perfiles_mapeo.json')
+VERSION_PERFILES = 1
+
+# Campos estándar que se buscan en el Excel de cada compañía, con su descripción para la interfaz
+ETIQUETAS_CAMPOS = {
+    'nombre': 'Nombre/Tomador',
+    'telefono': 'Teléfono',
+    'id_compania': 'ID de cliente en la compañía',
+    'email': 'Email',
+    'tipo_id': 'Tipo de documento',
+}
+CAMPOS_MAPEO = tuple(ETIQUETAS_CAMPOS)
+CAMPOS_OBLIGATORIOS = ('nombre',)
+
+# Reglas de detección: por campo, las claves en orden de prioridad. Se prueba cada clave contra
+# todas las columnas antes de pasar a la siguiente, así 'tipodoc' gana a un 'Nro Documento'
+# aunque este aparezca antes en el Excel. Una columna se asigna a un solo campo.
+REGLAS_DETECCION = (
+    ('nombre', ('nombre', 'apellido', 'tomador')),
+    ('telefono', ('telefono', 'celular', 'movil', 'tel')),
+    ('id_compania', ('idcliente', 'nrocliente', 'poliza', 'contrato')),
+    ('email', ('email', 'correo', 'mail')),
+    ('tipo_id', ('tipodocumento', 'tipodoc', 'documento')),
+)
+
+def normalizar_columna(columna):
+    """Minúsculas, sin tildes y solo letras y dígitos ('Nº Póliza' -> 'npoliza')."""
+    texto = unicodedata.normalize('NFKD', str(columna)).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^0-9a-z]', '', texto.lower())
+
+def huella_encabezado(columnas, nombre_compania):
+    """Identifica un formato de Excel: encabezado normalizado (en orden) más la compañía."""
+    partes = [nombre_compania.strip().lower()] + [normalizar_columna(columna) for columna in columnas]
+    return hashlib.sha256('\x1f'.join(partes).encode('utf-8')).hexdigest()[:32]
+
+class DetectorColumnas:
+    """Reglas de detección precompiladas (una expresión por clave); detectar() no tiene estado."""
+
+    def __init__(self, reglas=REGLAS_DETECCION):
+        self._reglas = [(campo, [re.compile(re.escape(clave)) for clave in claves]) for campo, claves in reglas]
+
+    def detectar(self, columnas):
+        """Devuelve un dict campo -> nombre de columna (o None si no se encontró)."""
+        columnas = list(columnas)
+        normalizadas = [normalizar_columna(columna) for columna in columnas]
+        mapeo = dict.fromkeys(CAMPOS_MAPEO)
+        asignadas = set()
+        for campo, patrones in self._reglas:
+            mapeo[campo] = next((columnas[i] for patron in patrones for i, normalizada in enumerate(normalizadas)
+                                 if i not in asignadas and patron.search(normalizada)), None)
+            if mapeo[campo] is not None:
+                asignadas.add(columnas.index(mapeo[campo]))
+        # Compatibilidad: una columna llamada literalmente 'DNI' se usa como tipo de documento
+        if mapeo['tipo_id'] is None and 'DNI' in columnas and columnas.index('DNI') not in asignadas:
+            mapeo['tipo_id'] = 'DNI'
+        return mapeo
+
+_detector = DetectorColumnas()
+
+@lru_cache(maxsize=256)
+def _detectar_columnas_cacheado(columnas):
+    return _detector.detectar(columnas)
+
+def detectar_columnas(columnas):
+    """Detecta qué columna real del Excel corresponde a cada campo estándar (ver REGLAS_DETECCION)."""
+    return dict(_detectar_columnas_cacheado(tuple(columnas)))
+
+class AlmacenPerfilesMapeo:
+    """
+    Perfiles de mapeo confirmados por el usuario, en un archivo JSON, por huella del encabezado
+    y compañía (huella_encabezado). El mapeo se guarda por posición de columna, así un Excel
+    del mismo formato se mapea siempre igual, sin volver a detectar. Es seguro usarlo desde
+    varios hilos; el archivo se reescribe de forma atómica.
+    """
+
+    def __init__(self, ruta=RUTA_PERFILES):
+        self.ruta = ruta
+        self._perfiles = None # Se carga al primer uso
+        self._lock = threading.Lock()
+
+    def _cargar(self):
+        if self._perfiles is not None:
+            return
+        self._perfiles = {}
+        try:
+            with open(self.ruta, encoding='utf-8') as archivo:
+                datos = json.load(archivo)
+            if datos.get('version') == VERSION_PERFILES:
+                self._perfiles = datos.get('perfiles', {})
+        except (OSError, ValueError):
+            pass # Sin perfiles guardados (o archivo ilegible): se vuelve a detectar
+
+    def obtener(self, columnas, nombre_compania):
+        """Mapeo campo -> nombre de columna del perfil guardado para este formato, o None."""
+        columnas = list(columnas)
+        with self._lock:
+            self._cargar()
+            perfil = self._perfiles.get(huella_encabezado(columnas, nombre_compania))
+        if perfil is None:
+            return None
+        return {campo: columnas[posicion] if posicion is not None and posicion < len(columnas) else None
+                for campo, posicion in ((campo, perfil['mapeo'].get(campo)) for campo in CAMPOS_MAPEO)}
+
+    def guardar(self, columnas, nombre_compania, mapeo):
+        """Guarda (o reemplaza) el perfil de este formato. Devuelve True si se pudo escribir."""
+        columnas = list(columnas)
+        perfil = {
+            'compania': nombre_compania.strip(),
+            'columnas': [str(columna) for columna in columnas],
+            'mapeo': {campo: columnas.index(mapeo[campo]) if mapeo.get(campo) in columnas else None
+                      for campo in CAMPOS_MAPEO},
+            'guardado_en': time.time(),
+        }
+        with self._lock:
+            self._cargar()
+            huella = huella_encabezado(columnas, nombre_compania)
+            anterior = self._perfiles.get(huella)
+            if anterior is not None and anterior['mapeo'] == perfil['mapeo']:
+                return True
+            self._perfiles[huella] = perfil
+            return self._escribir()
+
+    def _escribir(self):
+        try:
+            os.makedirs(os.path.dirname(self.ruta) or '.', exist_ok=True)
+            temporal = f"{self.ruta}.tmp"
+            with open(temporal, 'w', encoding='utf-8') as archivo:
+                json.dump({'version': VERSION_PERFILES, 'perfiles': self._perfiles}, archivo,
+                          ensure_ascii=False, indent=2)
+            os.replace(temporal, self.ruta)
+            return True
+        except OSError:
+            return False
+
+# Almacén global del proceso
+almacen_perfiles = AlmacenPerfilesMapeo()
+
+def resolver_mapeo(columnas, nombre_compania=None, almacen=None):
+    """
+    Mapeo del perfil guardado para este formato si existe; si no, el detectado.
+    Devuelve (mapeo, desde_perfil).
+    """
+    almacen = almacen or almacen_perfiles
+    if nombre_compania:
+        mapeo = almacen.obtener(columnas, nombre_compania)
+        if mapeo is not None:
+            return mapeo, True
+    return detectar_columnas(columnas), False
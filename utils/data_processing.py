@@ -1,11 +1,22 @@
+import time
+
 import pandas as pd
 import streamlit as st
+import openpyxl
 from io import BytesIO # Para leer archivos subidos en memoria
 
   # Importar encabezados desde el módulo de sheets para consistencia
 from .google_sheets import ENCABEZADOS 
+from .column_mapping import resolver_mapeo
+from .instrumentation import instrumentar, registro, METRICA_ETAPA
+
+# Máximo de números de fila listados en los avisos agregados de filas omitidas
+MAX_FILAS_EN_AVISO = 20
+# Filas por bloque en la lectura streaming de Excel
+TAMANO_BLOQUE_EXCEL = 5000
 
-def leer_excel_subido(uploaded_file):
+@instrumentar('leer_excel_subido')
+def leer_excel_subido(uploaded_file, reporte=st):
       """Lee un archivo Excel subido vía Streamlit y lo devuelve como DataFrame."""
       try:
           # Usar BytesIO para que pandas pueda leer el objeto UploadedFile
@@ -13,132 +24,280 @@ def leer_excel_subido(uploaded_file):
           # Intentar con openpyxl primero (xlsx)
           try:
               df = pd.read_excel(BytesIO(bytes_data), engine='openpyxl')
-              st.info(f"Archivo '{uploaded_file.name}' leído correctamente (xlsx).")
+              reporte.info(f"Archivo '{uploaded_file.name}' leído correctamente (xlsx).")
               return df
           except Exception as e_xlsx:
-              st.warning(f"No se pudo leer '{uploaded_file.name}' como xlsx ({e_xlsx}), intentando como xls...")
+              reporte.warning(f"No se pudo leer '{uploaded_file.name}' como xlsx ({e_xlsx}), intentando como xls...")
               # Si falla, intentar con el motor por defecto (puede usar xlrd si está instalado)
               try:
                   df = pd.read_excel(BytesIO(bytes_data))
-                  st.info(f"Archivo '{uploaded_file.name}' leído correctamente (xls/otro).")
+                  reporte.info(f"Archivo '{uploaded_file.name}' leído correctamente (xls/otro).")
                   return df
               except Exception as e_xls:
-                  st.error(f"Error al leer el archivo Excel '{uploaded_file.name}' con ambos motores: {e_xls}")
+                  reporte.error(f"Error al leer el archivo Excel '{uploaded_file.name}' con ambos motores: {e_xls}")
                   return None
       except Exception as e:
-          st.error(f"Error general al procesar el archivo subido '{uploaded_file.name}': {e}")
+          reporte.error(f"Error general al procesar el archivo subido '{uploaded_file.name}': {e}")
           return None
 
-def preparar_datos_para_hoja(df_compania, nombre_compania):
+def leer_encabezado_excel(uploaded_file, reporte=st):
+      """
+      Devuelve los nombres de columna del Excel subido (como los nombraría pd.read_excel) sin
+      leer sus filas, o None si no se pudo leer. Deja el archivo al principio.
+      """
+      try:
+          uploaded_file.seek(0)
+          libro = openpyxl.load_workbook(uploaded_file, read_only=True, data_only=True)
+          try:
+              encabezado = next(libro.worksheets[0].iter_rows(max_row=1, values_only=True), ())
+          finally:
+              libro.close()
+          return _nombres_columnas(encabezado)
+      except Exception:
+          try: # Formatos que openpyxl no soporta (.xls)
+              uploaded_file.seek(0)
+              return pd.read_excel(BytesIO(uploaded_file.getvalue()), nrows=0).columns.tolist()
+          except Exception as e:
+              reporte.error(f"No se pudo leer el encabezado del archivo Excel '{uploaded_file.name}': {e}")
+              return None
+      finally:
+          uploaded_file.seek(0)
+
+def leer_excel_por_bloques(uploaded_file, tamano_bloque=TAMANO_BLOQUE_EXCEL, mapeo=None, reporte=st,
+                           nombre_compania=None):
+      """
+      Lee un Excel (.xlsx) subido en modo streaming (openpyxl read_only) sin copiar sus bytes.
+      Devuelve un iterador de DataFrames de como máximo `tamano_bloque` filas que contienen solo
+      las columnas que usa el mapeo (`mapeo`; si no se indica, el del perfil guardado de
+      `nombre_compania` o el detectado, que queda en bloque.attrs['mapeo']), o None si el
+      archivo no se pudo leer. Los avisos van a `reporte` (st, o el reporte de un trabajo).
+      Los formatos que openpyxl no soporta (.xls) se leen completos con leer_excel_subido.
+      """
+      try:
+          uploaded_file.seek(0)
+          libro = openpyxl.load_workbook(uploaded_file, read_only=True, data_only=True)
+      except Exception as e_xlsx:
+          reporte.warning(f"No se pudo leer '{uploaded_file.name}' en modo streaming ({e_xlsx}), se leerá completo...")
+          uploaded_file.seek(0)
+          df = leer_excel_subido(uploaded_file, reporte=reporte)
+          return iter([df]) if df is not None else None
+
+      reporte.info(f"Archivo '{uploaded_file.name}' abierto en modo streaming (xlsx).")
+      return _iterar_bloques_excel(libro, uploaded_file.name, tamano_bloque, mapeo, reporte, nombre_compania)
+
+def _iterar_bloques_excel(libro, nombre_archivo, tamano_bloque, mapeo=None, reporte=st, nombre_compania=None):
+      """Generador de bloques de la primera hoja de un libro abierto en modo read_only."""
+      try:
+          filas = libro.worksheets[0].iter_rows(values_only=True)
+          encabezado = next(filas, None)
+          if encabezado is None:
+              reporte.warning(f"El archivo '{nombre_archivo}' está vacío.")
+              return
+
+          columnas = _nombres_columnas(encabezado)
+          if mapeo is None:
+              mapeo, _ = resolver_mapeo(columnas, nombre_compania)
+          if not mapeo['nombre']:
+              reporte.error(f"¡Error crítico! No se encontró columna de Nombre/Tomador en el Excel '{nombre_archivo}'. Columnas encontradas: {columnas}")
+              return
+
+          # Leer solo las columnas mapeadas, en su orden original
+          posiciones = [i for i, col in enumerate(columnas) if col in mapeo.values()]
+          nombres = [columnas[i] for i in posiciones]
+
+          bloque = []
+          inicio_bloque = 0 # Índice (fila de datos 0-based) de la primera fila del bloque
+          blancas_pendientes = 0 # Filas vacías que solo se emiten si les sigue una fila con datos
+          for fila in filas:
+              valores = [fila[i] if i < len(fila) else None for i in posiciones]
+              if all(v is None for v in valores):
+                  blancas_pendientes += 1
+                  continue
+              # Como pd.read_excel: las filas vacías intermedias se conservan, las finales no
+              bloque.extend([[None] * len(posiciones)] * blancas_pendientes)
+              blancas_pendientes = 0
+              bloque.append(valores)
+              if len(bloque) >= tamano_bloque:
+                  yield _bloque_a_dataframe(bloque, nombres, inicio_bloque, mapeo)
+                  inicio_bloque += len(bloque)
+                  bloque = []
+          if bloque:
+              yield _bloque_a_dataframe(bloque, nombres, inicio_bloque, mapeo)
+      finally:
+          libro.close()
+
+def _nombres_columnas(encabezado):
+      """Nombra las columnas del encabezado como lo haría pd.read_excel ('Unnamed: n', duplicados con '.1')."""
+      nombres = []
+      vistos = {}
+      for i, valor in enumerate(encabezado):
+          nombre = f"Unnamed: {i}" if valor is None else valor
+          if nombre in vistos:
+              vistos[nombre] += 1
+              nombre = f"{nombre}.{vistos[nombre]}"
+          else:
+              vistos[nombre] = 0
+          nombres.append(nombre)
+      return nombres
+
+def _bloque_a_dataframe(filas, columnas, inicio, mapeo):
+      # dtype=object conserva los valores tal cual vienen de la celda (un entero no pasa a float por un vacío)
+      df = pd.DataFrame(filas, columns=columnas, index=pd.RangeIndex(inicio, inicio + len(filas)), dtype=object)
+      df.attrs['mapeo'] = mapeo # El bloque solo trae estas columnas: quien lo prepara usa el mismo mapeo
+      return df
+
+def _columna_como_texto(df, columna, valor_defecto=''):
+      """Convierte una columna completa a texto; los nulos (o la columna ausente) pasan a valor_defecto."""
+      if columna is None:
+          return pd.Series(valor_defecto, index=df.index, dtype=object)
+      serie = df[columna]
+      nulos = serie.isna()
+      if pd.api.types.is_datetime64_any_dtype(serie) or pd.api.types.is_timedelta64_dtype(serie):
+          # astype(str) recorta la hora de las fechas a medianoche; str() por valor no
+          texto = serie.map(str, na_action='ignore')
+      else:
+          texto = serie.astype(str)
+      return texto.astype(object).where(~nulos, valor_defecto)
+
+@instrumentar('preparar_datos')
+def preparar_datos_para_hoja(df_compania, nombre_compania, mapeo=None, reporte=st):
       """
       Procesa el DataFrame de la compañía para adaptarlo a la estructura estándar.
       *** ESTA ES LA PARTE MÁS IMPORTANTE A PERSONALIZAR POR COMPAÑÍA ***
-      Devuelve una lista de listas, donde cada lista interna es una fila.
+      `mapeo` (campo -> columna) por defecto es el del perfil guardado de este formato y
+      compañía, o el detectado (ver utils/column_mapping.py).
+      Construye cada columna de ENCABEZADOS de forma vectorizada (columna a columna)
+      y devuelve una lista de listas, donde cada lista interna es una fila.
       """
-      datos_procesados = []
-      progreso = st.progress(0)
       total_filas = len(df_compania)
-      
-      st.write(f"Procesando {total_filas} filas para {nombre_compania}...")
+      reporte.write(f"Procesando {total_filas} filas para {nombre_compania}...")
 
       # --- ¡¡¡PERSONALIZACIÓN CRÍTICA AQUÍ!!! ---
-      # Detectar estructura basada en nombre_compania o columnas presentes
-      # EJEMPLO MUY BÁSICO - DEBES ADAPTARLO A TUS EXCEL REALES
-      
-      # Convertimos a minúsculas y quitamos espacios/puntos para comparar
-      columnas_normalizadas = [col.lower().replace(' ', '').replace('.', '') for col in df_compania.columns]
-      
-      # Mapeo de columnas esperado usando nombres normalizados
-      map_dni = None
-      colonna_reales = list(df_compania.columns)  
-      
-      # Buscar solo columna de nombre (único campo requerido)
-      map_nombre = next((col for i, col in enumerate(colonna_reales) 
-                       if ('nombre' in columnas_normalizadas[i] or 
-                           'apellido' in columnas_normalizadas[i] or
-                           'tomador' in columnas_normalizadas[i])), None)
-
-      # Buscar teléfono usando nombres normalizados
-      map_tel = next((col for i, col in enumerate(colonna_reales) 
-                    if 'telefono' in columnas_normalizadas[i] or 
-                       'tel' in columnas_normalizadas[i] or
-                       'celular' in columnas_normalizadas[i] or
-                       'movil' in columnas_normalizadas[i]), None)
-
-      # Buscar ID de compañía usando nombres normalizados
-      map_id_comp = next((col for i, col in enumerate(colonna_reales) 
-                        if 'idcliente' in columnas_normalizadas[i] or
-                           'nrocliente' in columnas_normalizadas[i] or
-                           'poliza' in columnas_normalizadas[i] or
-                           'contrato' in columnas_normalizadas[i]), None)
-
-      # Buscar email usando nombres normalizados
-      map_email = next((col for i, col in enumerate(colonna_reales) 
-                      if 'email' in columnas_normalizadas[i] or
-                         'correo' in columnas_normalizadas[i] or
-                         'mail' in columnas_normalizadas[i]), None)
-
-      # Buscar tipo de documento usando nombres normalizados
-      map_tipo_id = next((col for i, col in enumerate(colonna_reales) 
-                        if 'tipodoc' in columnas_normalizadas[i] or
-                           'tipodocumento' in columnas_normalizadas[i] or
-                           'documento' in columnas_normalizadas[i]), 'DNI') # Valor por defecto
+      # Estructura según el perfil guardado de la compañía o, si es un formato nuevo, detectada
+      if mapeo is None:
+          mapeo, _ = resolver_mapeo(df_compania.columns, nombre_compania)
 
       # Validar que la columna de nombre exista (único campo requerido)
-      if not map_nombre:
-           st.error(f"¡Error crítico! No se encontró columna de Nombre/Tomador en el Excel de {nombre_compania}. Columnas encontradas: {df_compania.columns.tolist()}")
+      if not mapeo['nombre']:
+           reporte.error(f"¡Error crítico! No se encontró columna de Nombre/Tomador en el Excel de {nombre_compania}. Columnas encontradas: {df_compania.columns.tolist()}")
            return [] # Devolver vacío si no hay nombre
 
-      for index, row in df_compania.iterrows():
-          try:
-              # Generar ID consistente con formato: ID_COMP_0001 
-              num_id = f"ID_{nombre_compania[:3].upper()}_{index+1:04d}"  # 4-digit zero-padded
-              nombre = str(row[map_nombre]) if map_nombre and pd.notna(row[map_nombre]) else ''
-              telefono1 = str(row[map_tel]) if map_tel and pd.notna(row[map_tel]) else ''
-              id_cliente_compania = str(row[map_id_comp]) if map_id_comp and pd.notna(row[map_id_comp]) else ''
-              email = str(row[map_email]) if map_email and pd.notna(row[map_email]) else ''
-              tipo_id = str(row[map_tipo_id]) if map_tipo_id and pd.notna(row[map_tipo_id]) else 'DNI' # Valor por defecto
-              
-              # Limpieza básica
-              num_id = num_id.replace('.', '').replace('-', '').strip()
-              telefono1 = ''.join(filter(str.isdigit, telefono1)) # Dejar solo dígitos en teléfono
-
-              # Validar solo el nombre como campo requerido
-              if not nombre:
-                  st.warning(f"Fila {index+2} omitida por falta de nombre.")
-                  continue
+      datos_procesados, filas_omitidas = _preparar_bloque(df_compania, mapeo, nombre_compania,
+                                                          pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S'))
+      _reportar_filas_omitidas(filas_omitidas, nombre_compania, reporte)
 
-              # Si no hay ID, generamos uno basado en el índice
-              if not num_id:
-                  num_id = f"ID_{nombre_compania[:3]}_{index}"
-
-              # --- Crear la fila con la estructura estándar ---
-              fila_nueva = [
-                  '',             # ID_Cliente_Unico (se podría generar aquí o en Sheets)
-                  nombre,
-                  num_id,
-                  tipo_id,
-                  telefono1,
-                  '',             # Numero_Telefono_2 (buscar si hay otra columna de tel)
-                  email,
-                  id_cliente_compania,
-                  pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S'), # Fecha_Ultima_Actualizacion
-                  'FALSE',        # Mensaje_WSP_Enviado (valor inicial)
-                  ''              # Notas
-              ]
-              
-              if len(fila_nueva) == len(ENCABEZADOS):
-                  datos_procesados.append(fila_nueva)
-              else:
-                   st.warning(f"Advertencia: Fila {index+2} de {nombre_compania} generó {len(fila_nueva)} columnas, se esperaban {len(ENCABEZADOS)}. Fila omitida.")
-
-          except KeyError as e:
-              st.warning(f"Advertencia: Falta columna esperada {e} en fila {index+2} de {nombre_compania}. Fila omitida.")
-          except Exception as e:
-              st.error(f"Error procesando fila {index+2} de {nombre_compania}: {e}. Fila omitida.")
-          
-          # Actualizar barra de progreso
-          progreso.progress((index + 1) / total_filas)
+      reporte.success(f"Se prepararon {len(datos_procesados)} registros válidos de {nombre_compania}.")
+      return datos_procesados
+
+def iterar_datos_desde_bloques(bloques, nombre_compania, mapeo=None, reporte=st, debe_detenerse=None):
+      """
+      Igual que preparar_datos_para_hoja, pero consume uno a uno los bloques de
+      leer_excel_por_bloques y entrega las filas preparadas de cada bloque a medida que las
+      arma (generador de listas no vacías), así ni el Excel ni sus filas preparadas están
+      enteros en memoria: quien lo consume puede escribir cada lote antes de pedir el
+      siguiente. Hay que pasarle el mismo `mapeo` que a leer_excel_por_bloques (los bloques
+      solo traen las columnas mapeadas); si no se indica, se usa el que resolvió la lectura
+      (o el perfil guardado de `nombre_compania`, o el detectado). Si `debe_detenerse()`
+      devuelve True entre dos bloques, deja de leer. Cada bloque (lectura más preparación) se
+      mide como la etapa 'leer_y_preparar_datos'.
+      """
+      reporte.write(f"Procesando {nombre_compania} por bloques...")
+      fecha_actualizacion = pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')
+      total_filas = 0
+      muestra_omitidas = [] # Solo las que se listan en el aviso
+      total_omitidas = 0
 
-      st.success(f"Se prepararon {len(datos_procesados)} registros válidos de {nombre_compania}.")
+      iterador = iter(bloques)
+      try:
+          while not (debe_detenerse is not None and debe_detenerse()):
+              inicio = time.perf_counter()
+              bloque = next(iterador, None)
+              if bloque is None:
+                  break
+              if mapeo is None:
+                  mapeo = bloque.attrs.get('mapeo') or resolver_mapeo(bloque.columns, nombre_compania)[0]
+                  if not mapeo['nombre']:
+                      reporte.error(f"¡Error crítico! No se encontró columna de Nombre/Tomador en el Excel de {nombre_compania}. Columnas encontradas: {bloque.columns.tolist()}")
+                      return
+              filas, omitidas = _preparar_bloque(bloque, mapeo, nombre_compania, fecha_actualizacion)
+              del bloque
+              registro.registrar(METRICA_ETAPA, 'leer_y_preparar_datos', time.perf_counter() - inicio)
+              muestra_omitidas.extend(omitidas[:MAX_FILAS_EN_AVISO - len(muestra_omitidas)])
+              total_omitidas += len(omitidas)
+              if filas:
+                  total_filas += len(filas)
+                  yield filas
+          else:
+              return # Cancelado: sin resumen de filas preparadas
+      finally:
+          if hasattr(iterador, 'close'):
+              iterador.close() # Cierra el libro del Excel si se dejó de leer antes del final
+
+      _reportar_filas_omitidas(muestra_omitidas, nombre_compania, reporte, total=total_omitidas)
+      reporte.success(f"Se prepararon {total_filas} registros válidos de {nombre_compania}.")
+
+def preparar_datos_desde_bloques(bloques, nombre_compania, mapeo=None, reporte=st, debe_detenerse=None):
+      """
+      Como iterar_datos_desde_bloques, pero devuelve todas las filas preparadas en una lista
+      (memoria proporcional al archivo; procesar_archivo escribe lote a lote en su lugar).
+      Devuelve None si se detuvo por `debe_detenerse()`.
+      """
+      datos_procesados = []
+      for filas in iterar_datos_desde_bloques(bloques, nombre_compania, mapeo=mapeo, reporte=reporte,
+                                              debe_detenerse=debe_detenerse):
+          datos_procesados.extend(filas)
+      if debe_detenerse is not None and debe_detenerse():
+          return None
       return datos_procesados
+
+def _preparar_bloque(df, mapeo, nombre_compania, fecha_actualizacion):
+      """
+      Transforma un DataFrame (o un bloque de él) a filas con la estructura de ENCABEZADOS.
+      El índice del DataFrame determina el número de fila del Excel (índice + 2) y el ID generado.
+      Devuelve (filas, numeros_de_fila_omitidos).
+      """
+      if df.empty:
+          return [], []
+
+      # Generar ID consistente con formato: ID_COMP_0001 (4 dígitos con ceros a la izquierda)
+      prefijo_id = f"ID_{nombre_compania[:3].upper()}_".replace('.', '').replace('-', '').strip()
+      num_id = prefijo_id + pd.Series(df.index + 1, index=df.index).astype(str).str.zfill(4)
+
+      nombre = _columna_como_texto(df, mapeo['nombre'])
+      telefono1 = _columna_como_texto(df, mapeo['telefono'])
+      # Limpieza básica: dejar solo dígitos en teléfono
+      telefono1 = telefono1.astype(str).str.replace(r'\D', '', regex=True)
+
+      # --- Crear las columnas con la estructura estándar ---
+      columnas = {
+          'ID_Cliente_Unico': '',   # (se podría generar aquí o en Sheets)
+          'Nombre_Apellido': nombre,
+          'Numero_Identificacion': num_id,
+          'Tipo_Identificacion': _columna_como_texto(df, mapeo['tipo_id'], 'DNI'), # Valor por defecto
+          'Numero_Telefono_1': telefono1,
+          'Numero_Telefono_2': '',  # (buscar si hay otra columna de tel)
+          'Email_Principal': _columna_como_texto(df, mapeo['email']),
+          'ID_Cliente_Compania': _columna_como_texto(df, mapeo['id_compania']),
+          'Fecha_Ultima_Actualizacion': fecha_actualizacion,
+          'Mensaje_WSP_Enviado': 'FALSE', # (valor inicial)
+          'Notas': '',
+      }
+      salida = pd.DataFrame(columnas, index=df.index)[ENCABEZADOS]
+
+      # Validar solo el nombre como campo requerido
+      tiene_nombre = nombre != ''
+      filas_omitidas = (df.index[~tiene_nombre.to_numpy()] + 2).tolist()
+      filas = salida[tiene_nombre].to_numpy(dtype=object).tolist()
+      return filas, filas_omitidas
+
+def _reportar_filas_omitidas(filas_omitidas, nombre_compania, reporte=st, total=None):
+      """
+      Emite un único aviso con las filas omitidas por falta de nombre. `total` es la cantidad
+      de omitidas si `filas_omitidas` es solo una muestra.
+      """
+      total = len(filas_omitidas) if total is None else total
+      if not total:
+          return
+      muestra = ', '.join(str(f) for f in filas_omitidas[:MAX_FILAS_EN_AVISO])
+      resto = f" y {total - MAX_FILAS_EN_AVISO} más" if total > MAX_FILAS_EN_AVISO else ''
+      reporte.warning(f"{total} filas de {nombre_compania} omitidas por falta de nombre (filas {muestra}{resto}).")
@@ -1,17 +1,29 @@
 import streamlit as st
 import os
 import time
-import csv # Needed for CSV conversion
 from google.oauth2.service_account import Credentials
-import io # Needed for CSV upload
+import re
+import hashlib
+import importlib.util
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+import pandas as pd
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaIoBaseUpload # Needed for CSV upload
+from .cache import CacheTTL
+from .http_transport import TransporteCompartido
+from .instrumentation import instrumentar, medir, METRICA_API, METRICA_ETAPA
+from .request_scheduler import ejecutar_lectura, ejecutar_escritura, PRIORIDAD_LOTE, MAX_REINTENTOS
+from .revisions import VerificadorRevisiones
+from .streaming_upload import SubidaEnStreaming, generar_csv, comprimir_gzip, generar_parquet # Exportación a Drive
 
 # Add Drive scope for file uploads
 SCOPES = [
     'https://www.googleapis.com/auth/spreadsheets',
-    'https://www.googleapis.com/auth/drive.file' # Scope to create files (needed for upload)
+    'https://www.googleapis.com/auth/drive.file', # Scope to create files (needed for upload)
+    'https://www.googleapis.com/auth/drive.metadata.readonly' # Revisión del spreadsheet (caché de lecturas)
 ]
 
 # Encabezados estándar para cada nueva hoja de compañía
@@ -22,29 +34,77 @@ ENCABEZADOS = [
     'Mensaje_WSP_Enviado', 'Notas'
 ]
 
-@st.cache_resource # Cachear el recurso para no reconstruirlo en cada interacción
-def get_google_sheets_service():
-    """Autentica y devuelve el objeto de servicio de Google Sheets."""
+# Caché de lecturas de hojas, compartida por todas las sesiones del proceso:
+# clave (spreadsheet_id, nombre_hoja, rango) -> (generación, instante, valores).
+# Una entrada vale mientras no cambie la revisión del spreadsheet en Drive (ver
+# VerificadorRevisiones), con un tope de CACHE_LECTURAS_TTL_MAXIMO_SEGUNDOS; si la revisión
+# no se puede consultar, vuelve a valer solo CACHE_LECTURAS_TTL_SEGUNDOS.
+CACHE_LECTURAS_TTL_SEGUNDOS = 300
+CACHE_LECTURAS_TTL_MAXIMO_SEGUNDOS = 900
+CACHE_LECTURAS_MAX_ENTRADAS = 64
+_cache_lecturas = CacheTTL(max_entradas=CACHE_LECTURAS_MAX_ENTRADAS, ttl_segundos=CACHE_LECTURAS_TTL_MAXIMO_SEGUNDOS)
+_revisiones = VerificadorRevisiones()
+
+# Índice de metadatos por spreadsheet: {titulo: {'sheetId', 'index', 'gridProperties'}}
+INDICE_HOJAS_TTL_SEGUNDOS = 600
+_indice_hojas = CacheTTL(max_entradas=16, ttl_segundos=INDICE_HOJAS_TTL_SEGUNDOS)
+
+# Lectura paginada: filas de datos por página y lecturas anticipadas en segundo plano
+FILAS_POR_PAGINA = 500
+MAX_PRECARGAS_SIMULTANEAS = 2
+_pool_precargas = ThreadPoolExecutor(max_workers=MAX_PRECARGAS_SIMULTANEAS, thread_name_prefix='precarga-hojas')
+_precargas_en_curso = {} # clave de caché -> (marca, Future)
+_lock_precargas = threading.Lock()
+
+# Lectura de varias hojas: rangos por llamada a values().batchGet (acota el largo de la URL)
+MAX_RANGOS_POR_LOTE = 100
+
+# Columna excluida de la detección de cambios: cada carga trae una fecha nueva
+INDICE_FECHA_ACTUALIZACION = ENCABEZADOS.index('Fecha_Ultima_Actualizacion')
+
+_PATRON_RANGO_A1 = re.compile(r'^([A-Z]*)(\d*)(?::([A-Z]*)(\d*))?$')
+
+# Funciones que se llaman después de cada escritura exitosa (p.ej. el espejo local, o el
+# diagnóstico de cambios externos de las revisiones)
+_observadores_escritura = [_revisiones.observar_escritura]
+
+@st.cache_resource # Una sola carga de credenciales para Sheets y Drive
+def _obtener_credenciales():
+    """Carga las credenciales de la cuenta de servicio (secrets o credentials.json). None si fallan."""
     try:
         # Intenta cargar desde Streamlit secrets (para despliegue)
         creds_dict = st.secrets["google_credentials"]
         creds = Credentials.from_service_account_info(creds_dict, scopes=SCOPES)
-        st.success("Autenticación con Google Sheets (Secrets) exitosa.")
+        st.success("Autenticación con Google (Secrets) exitosa.")
     except KeyError:
         # Si falla, intenta cargar desde el archivo local (para desarrollo)
         local_creds_path = 'credentials.json'
         if os.path.exists(local_creds_path):
             creds = Credentials.from_service_account_file(local_creds_path, scopes=SCOPES)
-            st.info("Autenticación con Google Sheets (Archivo local) exitosa.")
+            st.info("Autenticación con Google (Archivo local) exitosa.")
         else:
-            st.error("Error: No se encontraron credenciales de Google Sheets ni en secrets ni como 'credentials.json'.")
+            st.error("Error: No se encontraron credenciales de Google ni en secrets ni como 'credentials.json'.")
             return None
     except Exception as e:
-        st.error(f"Error inesperado durante la autenticación de Google Sheets: {e}")
+        st.error(f"Error inesperado durante la autenticación con Google: {e}")
         return None
+    return creds
 
+@st.cache_resource
+def _obtener_transporte():
+    """Transporte HTTP compartido (pool keep-alive, token único) para todos los servicios de Google."""
+    creds = _obtener_credenciales()
+    return TransporteCompartido(creds) if creds else None
+
+@st.cache_resource # Cachear el recurso para no reconstruirlo en cada interacción
+def get_google_sheets_service():
+    """Autentica y devuelve el objeto de servicio de Google Sheets."""
+    transporte = _obtener_transporte()
+    if transporte is None:
+        return None
     try:
-        service = build('sheets', 'v4', credentials=creds)
+        # static_discovery: el documento de discovery viene incluido en la librería, sin pedirlo a la red
+        service = build('sheets', 'v4', http=transporte, static_discovery=True)
         return service
     except Exception as e:
         st.error(f"Error al construir el servicio de Google Sheets: {e}")
@@ -54,28 +114,13 @@ def get_google_sheets_service():
 @st.cache_resource
 def get_google_drive_service():
     """Autentica y devuelve el objeto de servicio de Google Drive."""
-    try:
-        # Intenta cargar desde Streamlit secrets
-        creds_dict = st.secrets["google_credentials"]
-        # Usar los mismos SCOPES que incluyen Drive
-        creds = Credentials.from_service_account_info(creds_dict, scopes=SCOPES)
-        st.success("Autenticación con Google Drive (Secrets) exitosa.")
-    except KeyError:
-        # Intenta cargar desde archivo local
-        local_creds_path = 'credentials.json'
-        if os.path.exists(local_creds_path):
-            creds = Credentials.from_service_account_file(local_creds_path, scopes=SCOPES)
-            st.info("Autenticación con Google Drive (Archivo local) exitosa.")
-        else:
-            st.error("Error: No se encontraron credenciales de Google ni en secrets ni como 'credentials.json'.")
-            return None
-    except Exception as e:
-        st.error(f"Error inesperado durante la autenticación de Google Drive: {e}")
+    # Usa el mismo transporte (y los mismos SCOPES, que incluyen Drive) que Sheets
+    transporte = _obtener_transporte()
+    if transporte is None:
         return None
-
     try:
         # Construir el servicio de Drive v3
-        service = build('drive', 'v3', credentials=creds)
+        service = build('drive', 'v3', http=transporte, static_discovery=True)
         return service
     except Exception as e:
         st.error(f"Error al construir el servicio de Google Drive: {e}")
@@ -83,89 +128,386 @@ def get_google_drive_service():
 
 # --- FIN NUEVA FUNCIONALIDAD ---
 
+# --- CACHÉ DE LECTURAS: INVALIDACIÓN POR RANGO ---
+def _columna_a_indice(letras):
+    """'A' -> 0, 'K' -> 10, 'AA' -> 26."""
+    indice = 0
+    for letra in letras:
+        indice = indice * 26 + (ord(letra) - ord('A') + 1)
+    return indice - 1
+
+def _indice_a_columna(indice):
+    """0 -> 'A', 10 -> 'K', 26 -> 'AA'."""
+    letras = ''
+    indice += 1
+    while indice:
+        indice, resto = divmod(indice - 1, 26)
+        letras = chr(ord('A') + resto) + letras
+    return letras
+
+def _limites_rango_a1(rango):
+    """
+    Convierte un rango A1 sin nombre de hoja ('A:K', 'J5', 'A2:K100') en
+    (col_inicio, col_fin, fila_inicio, fila_fin), con columnas 0-based y filas 1-based.
+    Los extremos abiertos se devuelven como infinito. Devuelve None si no se reconoce.
+    """
+    coincidencia = _PATRON_RANGO_A1.match(rango.upper().replace('$', ''))
+    if not coincidencia:
+        return None
+    col_ini, fila_ini, col_fin, fila_fin = coincidencia.groups()
+    if col_fin is None and fila_fin is None: # Celda o columna/fila única
+        col_fin, fila_fin = col_ini, fila_ini
+    infinito = float('inf')
+    return (
+        _columna_a_indice(col_ini) if col_ini else 0,
+        _columna_a_indice(col_fin) if col_fin else infinito,
+        int(fila_ini) if fila_ini else 1,
+        int(fila_fin) if fila_fin else infinito,
+    )
+
+def invalidar_cache_hoja(spreadsheet_id, nombre_hoja, col_inicio=0, col_fin=float('inf'), fila_inicio=1, fila_fin=float('inf')):
+    """
+    Elimina de la caché de lecturas las entradas de la hoja cuyo rango se solapa con
+    el bloque escrito. Sin límites, invalida todos los rangos cacheados de la hoja.
+    """
+    def afectada(clave):
+        clave_spreadsheet, clave_hoja, rango = clave
+        if clave_spreadsheet != spreadsheet_id or clave_hoja != nombre_hoja:
+            return False
+        limites = _limites_rango_a1(rango)
+        if limites is None: # Rango no reconocido: invalidar por precaución
+            return True
+        c0, c1, f0, f1 = limites
+        return c0 <= col_fin and col_inicio <= c1 and f0 <= fila_fin and fila_inicio <= f1
+    with _lock_precargas:
+        # Una precarga en curso de un rango afectado ya no debe guardar su resultado
+        for clave in [clave for clave in _precargas_en_curso if afectada(clave)]:
+            del _precargas_en_curso[clave]
+    return _cache_lecturas.invalidar_si(afectada)
+
+def configurar_revisiones(drive_service):
+    """
+    Activa la validación de la caché de lecturas por revisión del spreadsheet, consultada
+    con `drive_service` (files.get). Con None se vuelve a la expiración por tiempo.
+    """
+    _revisiones.configurar(drive_service)
+
+def estado_revision(spreadsheet_id):
+    """Última revisión conocida del spreadsheet y su generación (ver VerificadorRevisiones)."""
+    return _revisiones.estado(spreadsheet_id)
 
-def verificar_o_crear_hoja(service, spreadsheet_id, nombre_hoja):
+def generacion_spreadsheet(spreadsheet_id):
+    """
+    Generación vigente del spreadsheet (cambia cuando cambia su revisión en Drive), o None
+    si no se puede conocer (sin Drive configurado o con error).
+    """
+    return _revisiones.generacion(spreadsheet_id)
+
+def _generacion_lectura(spreadsheet_id):
+    """Generación a guardar con una lectura: se toma antes de pedirla a la API."""
+    return _revisiones.generacion(spreadsheet_id)
+
+def _obtener_de_cache(clave_cache):
+    """Valores cacheados de (spreadsheet_id, hoja, rango) si siguen vigentes, o None."""
+    entrada = _cache_lecturas.obtener(clave_cache)
+    if entrada is None:
+        return None
+    generacion, guardado, values = entrada
+    actual = _revisiones.generacion(clave_cache[0])
+    if actual is None:
+        vigente = generacion is None and time.monotonic() - guardado <= CACHE_LECTURAS_TTL_SEGUNDOS
+    else:
+        vigente = generacion == actual
+    if not vigente:
+        _cache_lecturas.invalidar(clave_cache)
+        return None
+    return values
+
+def _guardar_en_cache(clave_cache, values, generacion):
+    _cache_lecturas.guardar(clave_cache, (generacion, time.monotonic(), values))
+
+def _invalidar_cache_rango_escrito(spreadsheet_id, rango_con_hoja):
+    """Invalida a partir de un rango de respuesta de la API, p.ej. "'Hoja'!A12:K40"."""
+    nombre_hoja, _, rango = rango_con_hoja.rpartition('!')
+    nombre_hoja = nombre_hoja.strip("'").replace("''", "'")
+    limites = _limites_rango_a1(rango) if nombre_hoja else None
+    if limites is None:
+        _cache_lecturas.invalidar_si(lambda clave: clave[0] == spreadsheet_id)
+        return
+    invalidar_cache_hoja(spreadsheet_id, nombre_hoja, *limites)
+
+# --- OBSERVADORES DE ESCRITURAS ---
+def registrar_observador_escrituras(observador):
+    """
+    Registra observador(spreadsheet_id, nombre_hoja, fila_inicio, col_inicio, valores), que se
+    llama después de cada escritura exitosa de este módulo con el bloque rectangular escrito
+    (fila 1-based, columna 0-based). Si no se conoce el contenido escrito, `valores` es None.
+    """
+    if observador not in _observadores_escritura:
+        _observadores_escritura.append(observador)
+
+def _notificar_escritura(spreadsheet_id, nombre_hoja, fila_inicio=None, col_inicio=0, valores=None, reporte=st):
+    for observador in list(_observadores_escritura):
+        try:
+            observador(spreadsheet_id, nombre_hoja, fila_inicio, col_inicio, valores)
+        except Exception as e:
+            # La escritura en Sheets ya se hizo: un observador que falla no la anula
+            reporte.warning(f"No se pudo propagar la escritura en '{nombre_hoja}' a un observador: {e}")
+
+def _notificar_escritura_rango(spreadsheet_id, rango_con_hoja, valores, reporte=st):
+    """Notifica a partir de un rango de respuesta de la API, p.ej. "'Hoja'!A12:K40"."""
+    nombre_hoja, _, rango = rango_con_hoja.rpartition('!')
+    nombre_hoja = nombre_hoja.strip("'").replace("''", "'")
+    limites = _limites_rango_a1(rango) if nombre_hoja else None
+    if limites is None:
+        if nombre_hoja:
+            _notificar_escritura(spreadsheet_id, nombre_hoja, reporte=reporte) # Posición desconocida
+        return
+    col_inicio, _, fila_inicio, _ = limites
+    _notificar_escritura(spreadsheet_id, nombre_hoja, fila_inicio, col_inicio, valores, reporte=reporte)
+
+# --- ÍNDICE DE METADATOS DE HOJAS ---
+def _entrada_indice(propiedades):
+    return {
+        'sheetId': propiedades.get('sheetId'),
+        'index': propiedades.get('index'),
+        'gridProperties': propiedades.get('gridProperties', {}),
+    }
+
+def obtener_indice_hojas(service, spreadsheet_id, forzar=False):
+    """
+    Devuelve el índice {titulo: {'sheetId', 'index', 'gridProperties'}} de las hojas del spreadsheet.
+    Solo se piden los 'sheets.properties' y el resultado se cachea; las hojas que crea este
+    módulo se agregan al índice sin volver a consultar. Los errores de API se propagan.
+    """
+    indice = None if forzar else _indice_hojas.obtener(spreadsheet_id)
+    if indice is None:
+        sheet_metadata = ejecutar_lectura(service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id, fields='sheets.properties'
+        ))
+        indice = {}
+        for hoja in sheet_metadata.get('sheets', []):
+            propiedades = hoja.get('properties', {})
+            indice[propiedades.get('title', '')] = _entrada_indice(propiedades)
+        _indice_hojas.guardar(spreadsheet_id, indice)
+    return indice
+
+def _registrar_hoja_en_indice(spreadsheet_id, propiedades):
+    """Agrega al índice cacheado una hoja recién creada (con las propiedades que devuelve addSheet)."""
+    indice = _indice_hojas.obtener(spreadsheet_id)
+    if indice is None:
+        return # Se reconstruirá completo en la próxima consulta
+    indice_nuevo = dict(indice) # Copia: otros hilos pueden estar leyendo el índice actual
+    indice_nuevo[propiedades.get('title', '')] = _entrada_indice(propiedades)
+    _indice_hojas.guardar(spreadsheet_id, indice_nuevo)
+
+def _actualizar_filas_en_indice(spreadsheet_id, nombre_hoja, fila_fin):
+    """Amplía el rowCount cacheado de una hoja si una escritura llegó más abajo (p.ej. un append)."""
+    indice = _indice_hojas.obtener(spreadsheet_id)
+    entrada = indice.get(nombre_hoja) if indice else None
+    if entrada is None or entrada['gridProperties'].get('rowCount', 0) >= fila_fin:
+        return
+    indice_nuevo = dict(indice) # Copia: otros hilos pueden estar leyendo el índice actual
+    indice_nuevo[nombre_hoja] = dict(entrada, gridProperties=dict(entrada['gridProperties'], rowCount=fila_fin))
+    _indice_hojas.guardar(spreadsheet_id, indice_nuevo)
+
+def obtener_sheet_id(service, spreadsheet_id, nombre_hoja):
+    """Devuelve el sheetId numérico de una hoja, o None si no existe."""
+    entrada = obtener_indice_hojas(service, spreadsheet_id).get(nombre_hoja)
+    return entrada['sheetId'] if entrada else None
+
+def verificar_o_crear_hoja(service, spreadsheet_id, nombre_hoja, reporte=st):
     """Verifica si una hoja existe, si no, la crea con los encabezados. Devuelve True si éxito."""
     if not service:
-        st.error("Servicio de Google Sheets no disponible.")
+        reporte.error("Servicio de Google Sheets no disponible.")
         return False
     try:
-        sheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-        sheets = sheet_metadata.get('sheets', [])
-        nombres_hojas_existentes = [s.get("properties", {}).get("title", "") for s in sheets]
+        indice = obtener_indice_hojas(service, spreadsheet_id)
+        if nombre_hoja not in indice:
+            # Otra sesión pudo haberla creado después de cachear el índice
+            indice = obtener_indice_hojas(service, spreadsheet_id, forzar=True)
 
-        if nombre_hoja in nombres_hojas_existentes:
-            st.info(f"La hoja '{nombre_hoja}' ya existe.")
+        if nombre_hoja in indice:
+            reporte.info(f"La hoja '{nombre_hoja}' ya existe.")
             return True
         else:
-            st.warning(f"La hoja '{nombre_hoja}' no existe. Creando...")
+            reporte.warning(f"La hoja '{nombre_hoja}' no existe. Creando...")
             body = {'requests': [{'addSheet': {'properties': {'title': nombre_hoja}}}]}
-            service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
-            st.success(f"Hoja '{nombre_hoja}' creada.")
+            try:
+                respuesta = ejecutar_escritura(
+                    service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body), idempotente=False
+                )
+            except HttpError as error:
+                # Otra sesión (o un intento anterior cuya respuesta se perdió) ya la creó
+                if error.resp.status != 400 or 'already exists' not in str(error.content):
+                    raise
+                if nombre_hoja not in obtener_indice_hojas(service, spreadsheet_id, forzar=True):
+                    raise
+                reporte.info(f"La hoja '{nombre_hoja}' ya existe.")
+                return True
+            _registrar_hoja_en_indice(spreadsheet_id, respuesta['replies'][0]['addSheet']['properties'])
+            reporte.success(f"Hoja '{nombre_hoja}' creada.")
             
             # Añadir encabezados
-            time.sleep(1) # Pausa prudencial
             encabezados_body = {'values': [ENCABEZADOS]}
             range_encabezados = f"'{nombre_hoja}'!A1" # Comillas por si nombre tiene espacios
             
-            service.spreadsheets().values().update(
+            ejecutar_escritura(service.spreadsheets().values().update(
                 spreadsheetId=spreadsheet_id, range=range_encabezados,
                 valueInputOption='USER_ENTERED', body=encabezados_body
-            ).execute()
-            st.success(f"Encabezados añadidos a la hoja '{nombre_hoja}'.")
+            ))
+            invalidar_cache_hoja(spreadsheet_id, nombre_hoja)
+            _notificar_escritura(spreadsheet_id, nombre_hoja, 1, 0, [ENCABEZADOS], reporte=reporte)
+            reporte.success(f"Encabezados añadidos a la hoja '{nombre_hoja}'.")
             return True
 
     except HttpError as error:
-        st.error(f"Error de API al verificar/crear hoja '{nombre_hoja}': {error}")
-        st.error(f"Detalles: {error.content}")
+        reporte.error(f"Error de API al verificar/crear hoja '{nombre_hoja}': {error}")
+        reporte.error(f"Detalles: {error.content}")
         return False
     except Exception as e:
-        st.error(f"Error inesperado en verificar_o_crear_hoja para '{nombre_hoja}': {e}")
+        reporte.error(f"Error inesperado en verificar_o_crear_hoja para '{nombre_hoja}': {e}")
         return False
 
-def agregar_datos_a_hoja(service, spreadsheet_id, nombre_hoja, datos):
+def agregar_datos_a_hoja(service, spreadsheet_id, nombre_hoja, datos, reporte=st):
     """Agrega filas de datos al final de la hoja especificada."""
     if not service:
-        st.error("Servicio de Google Sheets no disponible.")
+        reporte.error("Servicio de Google Sheets no disponible.")
         return False
     if not datos:
-        st.warning(f"No hay datos para agregar a la hoja '{nombre_hoja}'.")
+        reporte.warning(f"No hay datos para agregar a la hoja '{nombre_hoja}'.")
         return True # No es un error, solo no hay nada que hacer
 
     try:
         range_to_append = f"'{nombre_hoja}'!A:A" # Comillas por si nombre tiene espacios
         body = {'values': datos}
-        result = service.spreadsheets().values().append(
+        result = ejecutar_escritura(service.spreadsheets().values().append(
             spreadsheetId=spreadsheet_id, range=range_to_append,
             valueInputOption='USER_ENTERED', insertDataOption='INSERT_ROWS', body=body
-        ).execute()
+        ), idempotente=False)
         rows_added = result.get('updates', {}).get('updatedRows', 0)
-        st.success(f"Se agregaron {rows_added} filas a la hoja '{nombre_hoja}'.")
+        rango_agregado = result.get('updates', {}).get('updatedRange')
+        if rango_agregado:
+            _invalidar_cache_rango_escrito(spreadsheet_id, rango_agregado)
+            _notificar_escritura_rango(spreadsheet_id, rango_agregado, datos, reporte=reporte)
+            limites = _limites_rango_a1(rango_agregado.rpartition('!')[2])
+            if limites and limites[3] != float('inf'):
+                _actualizar_filas_en_indice(spreadsheet_id, nombre_hoja, limites[3])
+        else:
+            invalidar_cache_hoja(spreadsheet_id, nombre_hoja)
+            _notificar_escritura(spreadsheet_id, nombre_hoja, reporte=reporte) # Posición desconocida
+        reporte.success(f"Se agregaron {rows_added} filas a la hoja '{nombre_hoja}'.")
         return True
 
     except HttpError as error:
-        st.error(f"Error de API al agregar datos a la hoja '{nombre_hoja}': {error}")
-        st.error(f"Detalles: {error.content}")
+        reporte.error(f"Error de API al agregar datos a la hoja '{nombre_hoja}': {error}")
+        reporte.error(f"Detalles: {error.content}")
         return False
     except Exception as e:
-         st.error(f"Error inesperado al agregar datos a '{nombre_hoja}': {e}")
+         reporte.error(f"Error inesperado al agregar datos a '{nombre_hoja}': {e}")
          return False
          
 # --- NUEVA FUNCIONALIDAD: LEER DATOS DE UNA HOJA ---
-def leer_datos_hoja(service, spreadsheet_id, nombre_hoja, rango='A:K'): # Ajusta el rango si tienes más columnas
-    """Lee datos de una hoja específica y los devuelve como lista de listas."""
-    if not service:
-        st.error("Servicio de Google Sheets no disponible.")
-        return None
+def _leer_valores(service, spreadsheet_id, nombre_hoja, rango, usar_cache=True):
+    """
+    Lee un rango con la caché de lecturas, sin mensajes en pantalla (se puede usar desde
+    otros hilos). Si hay una lectura o precarga en curso del mismo rango, espera su resultado
+    en lugar de repetir la llamada. Una escritura que invalida el rango mientras se lee evita
+    que se cachee el resultado. Los errores de API se propagan.
+    """
+    clave_cache = (spreadsheet_id, nombre_hoja, rango)
+    if usar_cache:
+        values = _obtener_de_cache(clave_cache)
+        if values is not None:
+            return values
+        with _lock_precargas:
+            en_curso = _precargas_en_curso.get(clave_cache)
+        if en_curso is not None:
+            try:
+                values = en_curso[1].result()
+            except Exception:
+                values = None # La lectura falló: leer de nuevo y que el error, si se repite, llegue al llamador
+            # Solo vale si quedó en la caché: si una escritura la invalidó mientras se leía, ya es vieja
+            if values is not None and _obtener_de_cache(clave_cache) is values:
+                return values
+    marca, futuro = object(), Future()
+    with _lock_precargas:
+        # Mientras se lee queda registrada: una escritura que invalide el rango la quita y el
+        # resultado (ya viejo) no se cachea; otras lecturas del mismo rango esperan este futuro
+        _precargas_en_curso[clave_cache] = (marca, futuro)
+    values = error = None
     try:
-        range_to_read = f"'{nombre_hoja}'!{rango}"
-        result = service.spreadsheets().values().get(
+        generacion = _generacion_lectura(spreadsheet_id)
+        result = ejecutar_lectura(service.spreadsheets().values().get(
             spreadsheetId=spreadsheet_id,
-            range=range_to_read
-        ).execute()
+            range=f"'{nombre_hoja}'!{rango}"
+        ))
         values = result.get('values', [])
+        return values
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        with _lock_precargas:
+            if _precargas_en_curso.get(clave_cache, (None,))[0] is marca:
+                if values is not None:
+                    _guardar_en_cache(clave_cache, values, generacion)
+                del _precargas_en_curso[clave_cache]
+        if values is not None:
+            futuro.set_result(values)
+        else:
+            futuro.set_exception(error or RuntimeError(f"Sin datos para '{nombre_hoja}'!{rango}"))
+
+def _precargar_rango(service, spreadsheet_id, nombre_hoja, rango):
+    """Lee el rango en segundo plano y lo deja en la caché, salvo que ya esté o se esté leyendo."""
+    clave_cache = (spreadsheet_id, nombre_hoja, rango)
+    if _obtener_de_cache(clave_cache) is not None:
+        return
+    marca = object()
+
+    def precargar():
+        values = None
+        try:
+            generacion = _generacion_lectura(spreadsheet_id)
+            # Lectura especulativa: no debe quitarle cupo a las que espera el usuario
+            result = ejecutar_lectura(service.spreadsheets().values().get(
+                spreadsheetId=spreadsheet_id, range=f"'{nombre_hoja}'!{rango}"
+            ), prioridad=PRIORIDAD_LOTE)
+            values = result.get('values', [])
+            return values
+        finally:
+            with _lock_precargas:
+                # Si entretanto una escritura invalidó el rango, el resultado ya es viejo: no cachearlo
+                if _precargas_en_curso.get(clave_cache, (None,))[0] is marca:
+                    if values is not None:
+                        _guardar_en_cache(clave_cache, values, generacion)
+                    del _precargas_en_curso[clave_cache]
+
+    with _lock_precargas:
+        if clave_cache in _precargas_en_curso:
+            return
+        _precargas_en_curso[clave_cache] = (marca, _pool_precargas.submit(precargar))
+
+def leer_datos_hoja(service, spreadsheet_id, nombre_hoja, rango='A:K', usar_cache=True, reporte=st): # Ajusta el rango si tienes más columnas
+    """
+    Lee datos de una hoja específica y los devuelve como lista de listas.
+    Las lecturas se guardan en una caché compartida por todas las sesiones, vigente hasta que
+    el spreadsheet cambie en Drive (ver configurar_revisiones) y que las escrituras de este
+    módulo invalidan; con usar_cache=False se fuerza la lectura a la API (y se refresca la caché).
+    La lista devuelta puede ser compartida con la caché: no modificarla.
+    """
+    if not service:
+        reporte.error("Servicio de Google Sheets no disponible.")
+        return None
+    clave_cache = (spreadsheet_id, nombre_hoja, rango)
+    if usar_cache:
+        values = _obtener_de_cache(clave_cache)
+        if values is not None:
+            return values
+    try:
+        values = _leer_valores(service, spreadsheet_id, nombre_hoja, rango, usar_cache=usar_cache)
         if not values:
-            st.info(f"No se encontraron datos en la hoja '{nombre_hoja}' (rango {rango}).")
+            reporte.info(f"No se encontraron datos en la hoja '{nombre_hoja}' (rango {rango}).")
             return [] # Devuelve lista vacía si no hay datos
         else:
             # st.success(f"Datos leídos de '{nombre_hoja}'.")
@@ -173,15 +515,360 @@ def leer_datos_hoja(service, spreadsheet_id, nombre_hoja, rango='A:K'): # Ajusta
     except HttpError as error:
         # Podría ser que la hoja no exista aún, manejarlo como no encontrado
         if error.resp.status == 400 and 'Unable to parse range' in str(error.content):
-             st.warning(f"La hoja '{nombre_hoja}' parece no existir o está vacía.")
+             reporte.warning(f"La hoja '{nombre_hoja}' parece no existir o está vacía.")
              return []
-        st.error(f"Error de API al leer datos de la hoja '{nombre_hoja}': {error}")
-        st.error(f"Detalles: {error.content}")
+        reporte.error(f"Error de API al leer datos de la hoja '{nombre_hoja}': {error}")
+        reporte.error(f"Detalles: {error.content}")
         return None
     except Exception as e:
-        st.error(f"Error inesperado al leer datos de '{nombre_hoja}': {e}")
+        reporte.error(f"Error inesperado al leer datos de '{nombre_hoja}': {e}")
         return None
         
+# --- LECTURA PAGINADA ---
+def contar_filas_hoja(service, spreadsheet_id, nombre_hoja, forzar=False, reporte=st):
+    """
+    Cota superior de filas de datos (sin el encabezado) según el rowCount de la grilla, sin
+    leer valores. La grilla puede tener filas vacías al final. Sale del índice de hojas
+    cacheado, que no ve las filas agregadas fuera de la app: con forzar=True se vuelve a
+    pedir. None si la hoja no existe o hay error.
+    """
+    if not service:
+        reporte.error("Servicio de Google Sheets no disponible.")
+        return None
+    try:
+        entrada = obtener_indice_hojas(service, spreadsheet_id, forzar=forzar).get(nombre_hoja)
+    except HttpError as error:
+        reporte.error(f"Error de API al obtener el tamaño de la hoja '{nombre_hoja}': {error}")
+        reporte.error(f"Detalles: {error.content}")
+        return None
+    except Exception as e:
+        reporte.error(f"Error inesperado al obtener el tamaño de la hoja '{nombre_hoja}': {e}")
+        return None
+    if entrada is None:
+        return None
+    return max(0, entrada['gridProperties'].get('rowCount', 0) - 1)
+
+def leer_pagina_hoja(service, spreadsheet_id, nombre_hoja, pagina, filas_por_pagina=FILAS_POR_PAGINA,
+                     precargar_siguiente=True):
+    """
+    Lee la página `pagina` (0-based) de filas de datos, es decir el rango A{inicio}:K{fin}
+    debajo del encabezado, y devuelve (filas, número de fila de la primera). Con
+    precargar_siguiente, si la página vino completa se lee la siguiente en segundo plano.
+    Devuelve None si hubo un error.
+    """
+    if not service:
+        st.error("Servicio de Google Sheets no disponible.")
+        return None
+    fila_inicio = 2 + pagina * filas_por_pagina
+    rango = f'A{fila_inicio}:K{fila_inicio + filas_por_pagina - 1}'
+    try:
+        filas = _leer_valores(service, spreadsheet_id, nombre_hoja, rango)
+    except HttpError as error:
+        st.error(f"Error de API al leer la página {pagina + 1} de la hoja '{nombre_hoja}': {error}")
+        st.error(f"Detalles: {error.content}")
+        return None
+    except Exception as e:
+        st.error(f"Error inesperado al leer la página {pagina + 1} de '{nombre_hoja}': {e}")
+        return None
+    if precargar_siguiente and len(filas) == filas_por_pagina:
+        fila_siguiente = fila_inicio + filas_por_pagina
+        _precargar_rango(service, spreadsheet_id, nombre_hoja,
+                         f'A{fila_siguiente}:K{fila_siguiente + filas_por_pagina - 1}')
+    return filas, fila_inicio
+
+# --- LECTURA DE VARIAS HOJAS ---
+def _leer_varios_rangos(service, spreadsheet_id, pedidos, usar_cache=True, cachear=True):
+    """
+    Lee varios (hoja, rango) y devuelve {(hoja, rango): valores}. Los que están en la caché
+    salen de ella; el resto se piden juntos con values().batchGet (una llamada cada
+    MAX_RANGOS_POR_LOTE rangos). Mientras se leen quedan registrados como precargas en curso,
+    así una escritura que los invalide evita que se cachee un resultado viejo. Con
+    cachear=False lo leído no se guarda (p.ej. tramos sueltos que desalojarían a las hojas).
+    Sin mensajes en pantalla; los errores de API se propagan.
+    """
+    resultados = {}
+    pendientes = []
+    for nombre_hoja, rango in dict.fromkeys(pedidos):
+        values = _obtener_de_cache((spreadsheet_id, nombre_hoja, rango)) if usar_cache else None
+        if values is not None:
+            resultados[(nombre_hoja, rango)] = values
+        else:
+            pendientes.append((nombre_hoja, rango))
+
+    for inicio in range(0, len(pendientes), MAX_RANGOS_POR_LOTE):
+        lote = pendientes[inicio:inicio + MAX_RANGOS_POR_LOTE]
+        marcas = {}
+        with _lock_precargas:
+            for nombre_hoja, rango in lote:
+                marca, futuro = object(), Future()
+                marcas[(nombre_hoja, rango)] = (marca, futuro)
+                _precargas_en_curso[(spreadsheet_id, nombre_hoja, rango)] = (marca, futuro)
+        lecturas = {}
+        error = None
+        try:
+            generacion = _generacion_lectura(spreadsheet_id)
+            respuesta = ejecutar_lectura(service.spreadsheets().values().batchGet(
+                spreadsheetId=spreadsheet_id,
+                ranges=[f"'{nombre_hoja}'!{rango}" for nombre_hoja, rango in lote]
+            ))
+            # Los valueRanges vuelven en el mismo orden que los rangos pedidos
+            for pedido, rango_leido in zip(lote, respuesta.get('valueRanges', [])):
+                lecturas[pedido] = rango_leido.get('values', [])
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            with _lock_precargas:
+                for (nombre_hoja, rango), (marca, futuro) in marcas.items():
+                    clave_cache = (spreadsheet_id, nombre_hoja, rango)
+                    values = lecturas.get((nombre_hoja, rango))
+                    if _precargas_en_curso.get(clave_cache, (None,))[0] is marca:
+                        if values is not None and cachear:
+                            _guardar_en_cache(clave_cache, values, generacion)
+                        del _precargas_en_curso[clave_cache]
+                    if values is not None:
+                        futuro.set_result(values)
+                    else:
+                        futuro.set_exception(error or RuntimeError(f"Sin datos para '{nombre_hoja}'!{rango}"))
+        resultados.update(lecturas)
+    return resultados
+
+# --- LECTURA PROYECTADA ---
+# Ajuste (benchmark_consulta_pendientes y distribuciones de pendientes al azar, en rachas y
+# alternadas, de 2.000 a 100.000 filas): la proyección de B y J pesa ~21% de la hoja entera, así
+# que el ahorro depende de cuántas filas completas se piden después. Con un 10-12% de
+# pendientes se transfiere un 66% menos (el piso de la proyección, cerca del 70% buscado);
+# con un 20% al azar, un 33% menos; desde ~40% de pendientes intercaladas la consulta cuesta
+# hasta un 21% más que leer la hoja entera. Los dos parámetros siguientes no cambian los casos
+# ralos (probados HUECO_MAXIMO_TRAMOS 0-10 y FRACCION_LECTURA_CONTIGUA 0.3-0.7); en los densos,
+# HUECO 0 baja el sobrecosto del 21% al 6% pero con el doble de llamadas, y se prefirió ahorrar
+# llamadas donde la proyección igual no conviene.
+# Filas vacías entre dos tramos pedidos que se leen igual, para no partir el batchGet en rangos
+# chicos (con 20% de pendientes al azar, 3 da el mismo ahorro que 0; 6 ya pierde 8 puntos)
+HUECO_MAXIMO_TRAMOS = 3
+# Si se piden al menos esta fracción de las filas entre la primera y la última, se leen todas de
+# una vez (por encima, partir la lectura ahorra pocos bytes y suma llamadas)
+FRACCION_LECTURA_CONTIGUA = 0.5
+# Tramos sueltos por lectura (hasta 3 batchGet, para cuidar la cuota de lecturas); con más se
+# unen los más cercanos, y el ahorro cae: con 2% de pendientes sueltas, del 66% al 52% en
+# 20.000 filas y a nada en 100.000
+MAX_TRAMOS_POR_LECTURA = 3 * MAX_RANGOS_POR_LOTE
+# Consulta de pendientes de WSP: columnas proyectadas (nombre y flag) y clave de su resultado en la caché
+COLUMNAS_CONSULTA_PENDIENTES = ('B', 'J')
+CLAVE_PENDIENTES_WSP = '#pendientes_wsp' # No es un rango A1: cualquier escritura en la hoja la invalida
+
+def _leer_columnas(service, spreadsheet_id, nombre_hoja, columnas, fila_inicio=2, usar_cache=True):
+    """
+    Encabezado (A1:K1) y las columnas pedidas desde fila_inicio, en un solo batchGet. Devuelve
+    (encabezado, filas) con una fila por número de fila desde fila_inicio y un valor por columna,
+    '' si la celda está vacía. Sin mensajes en pantalla; los errores de API se propagan.
+    """
+    pedidos = [(nombre_hoja, 'A1:K1')] + [(nombre_hoja, f'{columna}{fila_inicio}:{columna}') for columna in columnas]
+    lecturas = _leer_varios_rangos(service, spreadsheet_id, pedidos, usar_cache=usar_cache)
+    encabezado = lecturas[pedidos[0]][0] if lecturas[pedidos[0]] else []
+    valores_columnas = [lecturas[pedido] for pedido in pedidos[1:]]
+    alto = max((len(valores) for valores in valores_columnas), default=0)
+    # Cada columna viene como filas de una celda ([] si está vacía), sin las filas vacías finales
+    filas = [[valores[i][0] if i < len(valores) and valores[i] else '' for valores in valores_columnas]
+             for i in range(alto)]
+    return encabezado, filas
+
+def leer_columnas_hoja(service, spreadsheet_id, nombre_hoja, columnas, fila_inicio=2, usar_cache=True, reporte=st):
+    """
+    Lectura proyectada: solo las columnas pedidas (letras, p.ej. ['C', 'E', 'J']) desde
+    fila_inicio, más el encabezado, con values().batchGet. Devuelve (encabezado, filas): la
+    fila i corresponde a la fila fila_inicio + i de la hoja y trae un valor por columna pedida.
+    Usa la misma caché que leer_datos_hoja. Devuelve ([], []) si la hoja no existe y None si hubo un error.
+    """
+    if not service:
+        reporte.error("Servicio de Google Sheets no disponible.")
+        return None
+    try:
+        return _leer_columnas(service, spreadsheet_id, nombre_hoja, columnas, fila_inicio, usar_cache)
+    except HttpError as error:
+        if error.resp.status == 400 and 'Unable to parse range' in str(error.content):
+            return [], []
+        reporte.error(f"Error de API al leer columnas de la hoja '{nombre_hoja}': {error}")
+        reporte.error(f"Detalles: {error.content}")
+        return None
+    except Exception as e:
+        reporte.error(f"Error inesperado al leer columnas de '{nombre_hoja}': {e}")
+        return None
+
+def _tramos_de_filas(numeros_fila, max_tramos=MAX_TRAMOS_POR_LECTURA):
+    """
+    Agrupa números de fila (ordenados) en tramos (desde, hasta) para leerlos con batchGet: se unen
+    los huecos de hasta HUECO_MAXIMO_TRAMOS filas y, si aún quedan más de `max_tramos`, los
+    más chicos. Si las filas pedidas son la mayoría del rango que ocupan, un único tramo.
+    """
+    if not numeros_fila:
+        return []
+    if len(numeros_fila) >= FRACCION_LECTURA_CONTIGUA * (numeros_fila[-1] - numeros_fila[0] + 1):
+        return [(numeros_fila[0], numeros_fila[-1])]
+    huecos = sorted((numeros_fila[k + 1] - numeros_fila[k], k) for k in range(len(numeros_fila) - 1)
+                    if numeros_fila[k + 1] - numeros_fila[k] > HUECO_MAXIMO_TRAMOS + 1)
+    cortes = sorted(k for _, k in huecos[max(len(huecos) - (max_tramos - 1), 0):]) if max_tramos > 1 else []
+    tramos = []
+    desde = numeros_fila[0]
+    for k in cortes:
+        tramos.append((desde, numeros_fila[k]))
+        desde = numeros_fila[k + 1]
+    tramos.append((desde, numeros_fila[-1]))
+    return tramos
+
+def _leer_filas(service, spreadsheet_id, nombre_hoja, numeros_fila, usar_cache=True):
+    """
+    Filas completas (A:K) de los números de fila pedidos: {numero_fila: fila}, con un batchGet
+    de los tramos que las contienen. Los tramos no se guardan en la caché. Los errores de API se propagan.
+    """
+    numeros_fila = sorted(set(numeros_fila))
+    pedidos = [(nombre_hoja, f'A{desde}:K{hasta}') for desde, hasta in _tramos_de_filas(numeros_fila)]
+    lecturas = _leer_varios_rangos(service, spreadsheet_id, pedidos, usar_cache=usar_cache, cachear=False)
+    pedidas = set(numeros_fila)
+    filas = {}
+    for (desde, _), pedido in zip(_tramos_de_filas(numeros_fila), pedidos):
+        for numero, fila in enumerate(lecturas[pedido], start=desde):
+            if numero in pedidas:
+                filas[numero] = fila
+    for numero in pedidas - filas.keys(): # Filas vacías al final de un tramo (la API no las devuelve)
+        filas[numero] = []
+    return filas
+
+def leer_pendientes_wsp(service, spreadsheet_id, nombre_hoja, usar_cache=True):
+    """
+    Clientes con Mensaje_WSP_Enviado en FALSE o vacío, sin leer la hoja entera: primero se leen
+    solo las COLUMNAS_CONSULTA_PENDIENTES y después las filas completas de los pendientes.
+    Devuelve {'valores', 'numeros_fila', 'total'} o None si hubo un error: 'valores' es el
+    encabezado más las filas pendientes (como leer_datos_hoja), 'numeros_fila' el número de
+    fila en la hoja de cada una y 'total' la cantidad de filas con datos. El resultado queda
+    en la caché hasta la próxima escritura en la hoja y se comparte entre sesiones: no
+    modificarlo. Como _leer_valores, si la misma consulta ya está en curso espera su resultado.
+    """
+    if not service:
+        st.error("Servicio de Google Sheets no disponible.")
+        return None
+    clave_cache = (spreadsheet_id, nombre_hoja, CLAVE_PENDIENTES_WSP)
+    if usar_cache:
+        resultado = _obtener_de_cache(clave_cache)
+        if resultado is not None:
+            return resultado
+        with _lock_precargas:
+            en_curso = _precargas_en_curso.get(clave_cache)
+        if en_curso is not None:
+            try:
+                resultado = en_curso[1].result()
+            except Exception:
+                resultado = None # Falló: se consulta de nuevo y el error, si se repite, se informa aquí
+            # Solo vale si quedó en la caché: si una escritura la invalidó mientras se armaba, ya es vieja
+            if resultado is not None and _obtener_de_cache(clave_cache) is resultado:
+                return resultado
+    marca, futuro = object(), Future()
+    with _lock_precargas:
+        # Si una escritura en la hoja la invalida mientras se arma, el resultado no se cachea
+        _precargas_en_curso[clave_cache] = (marca, futuro)
+    resultado = error = None
+    try:
+        generacion = _generacion_lectura(spreadsheet_id)
+        # Si la hoja completa ya está en la caché, se filtra de ahí sin pedir nada a la API
+        completa = _obtener_de_cache((spreadsheet_id, nombre_hoja, 'A:K')) if usar_cache else None
+        if completa:
+            encabezado = completa[0]
+            proyeccion = [[fila[1] if len(fila) > 1 else '', fila[9] if len(fila) > 9 else ''] for fila in completa[1:]]
+        else:
+            encabezado, proyeccion = _leer_columnas(service, spreadsheet_id, nombre_hoja,
+                                                    COLUMNAS_CONSULTA_PENDIENTES, usar_cache=usar_cache)
+        numeros_fila = [numero for numero, (nombre, flag) in enumerate(proyeccion, start=2)
+                        if (nombre or flag) and flag.upper() in ('FALSE', '')]
+        if completa:
+            filas = [completa[numero - 1] for numero in numeros_fila]
+        else:
+            leidas = _leer_filas(service, spreadsheet_id, nombre_hoja, numeros_fila, usar_cache=usar_cache)
+            filas = [leidas[numero] for numero in numeros_fila]
+        resultado = {'valores': [encabezado or list(ENCABEZADOS)] + filas, 'numeros_fila': numeros_fila,
+                     'total': sum(1 for nombre, flag in proyeccion if nombre or flag)}
+        return resultado
+    except HttpError as e:
+        error = e
+        if e.resp.status == 400 and 'Unable to parse range' in str(e.content):
+            st.warning(f"La hoja '{nombre_hoja}' parece no existir o está vacía.")
+            return {'valores': [list(ENCABEZADOS)], 'numeros_fila': [], 'total': 0}
+        st.error(f"Error de API al buscar pendientes en la hoja '{nombre_hoja}': {e}")
+        st.error(f"Detalles: {e.content}")
+        return None
+    except Exception as e:
+        error = e
+        st.error(f"Error inesperado al buscar pendientes en '{nombre_hoja}': {e}")
+        return None
+    finally:
+        with _lock_precargas:
+            if _precargas_en_curso.get(clave_cache, (None,))[0] is marca:
+                if resultado is not None:
+                    _guardar_en_cache(clave_cache, resultado, generacion)
+                del _precargas_en_curso[clave_cache]
+        if resultado is not None:
+            futuro.set_result(resultado)
+        else:
+            futuro.set_exception(error or RuntimeError(f"Sin pendientes de '{nombre_hoja}'"))
+
+# Columnas con pocos valores distintos: categóricas en los DataFrames de las hojas
+COLUMNAS_CATEGORICAS = ('Tipo_Identificacion', 'Mensaje_WSP_Enviado')
+# El resto del texto va en columnas de Arrow (sin un objeto Python por celda) si hay pyarrow;
+# si no, en arrays de objetos con los strings internados (los repetidos se guardan una vez)
+TIPO_TEXTO = 'string[pyarrow]' if importlib.util.find_spec('pyarrow') is not None else object
+
+def _columna_tipada(nombre_columna, valores):
+    if nombre_columna in COLUMNAS_CATEGORICAS:
+        return pd.Categorical(valores)
+    if TIPO_TEXTO is object:
+        return np.array([sys.intern(valor) if type(valor) is str else valor for valor in valores], dtype=object)
+    try:
+        return pd.array(valores, dtype=TIPO_TEXTO)
+    except (TypeError, ValueError): # Algún valor que no es texto (p.ej. de una caché antigua)
+        return pd.array([str(valor) for valor in valores], dtype=TIPO_TEXTO)
+
+def valores_a_dataframe(values):
+    """
+    DataFrame tipado de las filas leídas de una hoja (la primera es el encabezado). Sheets
+    omite las celdas vacías al final de cada fila: se completan con '' al construir las
+    columnas, una sola vez por lectura. El texto usa TIPO_TEXTO y las COLUMNAS_CATEGORICAS son categóricas.
+    Una hoja vacía da un DataFrame sin filas con las columnas de ENCABEZADOS.
+    """
+    if not values:
+        return valores_a_dataframe([ENCABEZADOS])
+    header = values[0]
+    ancho = len(header)
+    filas = values[1:]
+    # Columna a columna, sin copiar las filas (copiarlas dispara el recolector de basura)
+    df = pd.DataFrame({posicion: _columna_tipada(nombre, [fila[posicion] if posicion < len(fila) else ''
+                                                          for fila in filas])
+                       for posicion, nombre in enumerate(header)}, copy=False)
+    df.columns = header
+    return df
+
+def leer_varias_hojas(service, spreadsheet_id, nombres_hojas=None, rango='A:K', usar_cache=True):
+    """
+    Lee el mismo rango de varias hojas (por defecto, todas) en una sola ida y vuelta con
+    values().batchGet y devuelve {nombre_hoja: DataFrame}, en el orden de las hojas.
+    Usa y alimenta la misma caché que leer_datos_hoja. Devuelve None si hubo un error.
+    """
+    if not service:
+        st.error("Servicio de Google Sheets no disponible.")
+        return None
+    try:
+        if nombres_hojas is None:
+            nombres_hojas = list(obtener_indice_hojas(service, spreadsheet_id))
+        lecturas = _leer_varios_rangos(service, spreadsheet_id,
+                                       [(nombre_hoja, rango) for nombre_hoja in nombres_hojas],
+                                       usar_cache=usar_cache)
+    except HttpError as error:
+        st.error(f"Error de API al leer varias hojas: {error}")
+        st.error(f"Detalles: {error.content}")
+        return None
+    except Exception as e:
+        st.error(f"Error inesperado al leer varias hojas: {e}")
+        return None
+    return {nombre_hoja: valores_a_dataframe(lecturas[(nombre_hoja, rango)]) for nombre_hoja in nombres_hojas}
+
 # --- NUEVA FUNCIONALIDAD: ACTUALIZAR FLAG WSP ---
 def actualizar_flag_wsp(service, spreadsheet_id, nombre_hoja, fila_numero, nuevo_valor):
     """Actualiza la columna 'Mensaje_WSP_Enviado' (columna J) para una fila específica."""
@@ -195,10 +882,12 @@ def actualizar_flag_wsp(service, spreadsheet_id, nombre_hoja, fila_numero, nuevo
         
         body = {'values': [[str(nuevo_valor).upper()]]} # Sheets espera TRUE/FALSE en mayúsculas
 
-        result = service.spreadsheets().values().update(
+        result = ejecutar_escritura(service.spreadsheets().values().update(
             spreadsheetId=spreadsheet_id, range=rango_actualizar,
             valueInputOption='USER_ENTERED', body=body
-        ).execute()
+        ))
+        invalidar_cache_hoja(spreadsheet_id, nombre_hoja, col_inicio=9, col_fin=9, fila_inicio=fila_numero, fila_fin=fila_numero)
+        _notificar_escritura(spreadsheet_id, nombre_hoja, int(fila_numero), 9, body['values'])
         st.success(f"Flag WSP actualizado a {nuevo_valor} para la fila {fila_numero} en '{nombre_hoja}'.")
         return True
         
@@ -210,6 +899,95 @@ def actualizar_flag_wsp(service, spreadsheet_id, nombre_hoja, fila_numero, nuevo
         st.error(f"Error inesperado al actualizar flag WSP: {e}")
         return False
         
+# --- ESCRITURA DIFERIDA DE FLAGS WSP ---
+class BufferFlagsWSP:
+    """
+    Acumula actualizaciones de 'Mensaje_WSP_Enviado' (columna J) y las escribe todas juntas
+    con un único values().batchUpdate cuando se juntan `max_pendientes` filas o pasan
+    `max_espera_segundos` desde la primera pendiente. Hay que llamar a vaciar() al terminar.
+
+    `resultados` guarda, por (nombre_hoja, fila), True si el flag quedó escrito o False si
+    el último intento falló. Las filas de un vaciado fallido siguen pendientes y se
+    reintentan en el siguiente, así un estado "enviado" nunca se pierde en silencio.
+    `al_confirmar(claves)`, si se indica, se llama tras cada vaciado exitoso con la lista de
+    (nombre_hoja, fila) escritas. Los errores se informan con `reporte` (st, o el reporte
+    del trabajo que envía la campaña).
+    """
+
+    def __init__(self, service, spreadsheet_id, max_pendientes=100, max_espera_segundos=5.0,
+                 al_confirmar=None, reporte=st):
+        self.service = service
+        self.reporte = reporte
+        self.spreadsheet_id = spreadsheet_id
+        self.max_pendientes = max_pendientes
+        self.max_espera_segundos = max_espera_segundos
+        self.al_confirmar = al_confirmar
+        self.resultados = {}
+        self._pendientes = {} # (nombre_hoja, fila) -> valor; la última actualización de una fila gana
+        self._primera_pendiente = None
+        self._lock = threading.Lock()
+
+    @property
+    def pendientes(self):
+        with self._lock:
+            return len(self._pendientes)
+
+    def agregar(self, nombre_hoja, fila_numero, nuevo_valor):
+        """Encola el flag de una fila y vacía el buffer si se alcanzó algún umbral."""
+        with self._lock:
+            self._pendientes[(nombre_hoja, int(fila_numero))] = str(nuevo_valor).upper() # Sheets espera TRUE/FALSE
+            if self._primera_pendiente is None:
+                self._primera_pendiente = time.monotonic()
+            debe_vaciar = (len(self._pendientes) >= self.max_pendientes or
+                           time.monotonic() - self._primera_pendiente >= self.max_espera_segundos)
+        if debe_vaciar:
+            self.vaciar()
+
+    def vaciar(self):
+        """Escribe todos los flags pendientes. Devuelve True si no queda ninguno pendiente."""
+        with self._lock:
+            lote = dict(self._pendientes)
+        if not lote:
+            return True
+
+        data = [{'range': f"'{nombre_hoja}'!J{fila}", 'values': [[valor]]}
+                for (nombre_hoja, fila), valor in lote.items()]
+        try:
+            body = {'valueInputOption': 'USER_ENTERED', 'data': data}
+            ejecutar_escritura(self.service.spreadsheets().values().batchUpdate(spreadsheetId=self.spreadsheet_id, body=body))
+        except Exception as error:
+            detalles = f" Detalles: {error.content}" if isinstance(error, HttpError) else ''
+            self.reporte.error(f"Error al actualizar {len(lote)} flags WSP en lote: {error}.{detalles} Se reintentará.")
+            with self._lock:
+                self.resultados.update({clave: False for clave in lote})
+                self._primera_pendiente = time.monotonic() # Esperar otro intervalo antes de reintentar
+            return False
+
+        with self._lock:
+            for clave, valor in lote.items():
+                self.resultados[clave] = True
+                if self._pendientes.get(clave) == valor: # No descartar un valor más nuevo encolado mientras tanto
+                    del self._pendientes[clave]
+            if not self._pendientes:
+                self._primera_pendiente = None
+
+        filas_por_hoja = {}
+        for nombre_hoja, fila in lote:
+            filas_por_hoja.setdefault(nombre_hoja, []).append(fila)
+        for nombre_hoja, filas in filas_por_hoja.items():
+            invalidar_cache_hoja(self.spreadsheet_id, nombre_hoja, col_inicio=9, col_fin=9,
+                                 fila_inicio=min(filas), fila_fin=max(filas))
+        for (nombre_hoja, fila), valor in lote.items():
+            _notificar_escritura(self.spreadsheet_id, nombre_hoja, fila, 9, [[valor]], reporte=self.reporte)
+        if self.al_confirmar is not None:
+            self.al_confirmar(list(lote))
+        return self.pendientes == 0
+
+    def filas_fallidas(self):
+        """Devuelve las (nombre_hoja, fila) cuyo flag no se pudo escribir."""
+        with self._lock:
+            return [clave for clave, ok in self.resultados.items() if not ok]
+
 # --- NUEVA FUNCIONALIDAD: OBTENER NOMBRES DE HOJAS ---
 def obtener_nombres_hojas(service, spreadsheet_id):
     """Obtiene la lista de nombres de todas las hojas en el spreadsheet."""
@@ -217,10 +995,7 @@ def obtener_nombres_hojas(service, spreadsheet_id):
         st.error("Servicio de Google Sheets no disponible.")
         return []
     try:
-        sheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-        sheets = sheet_metadata.get('sheets', [])
-        nombres = [s.get("properties", {}).get("title", "") for s in sheets]
-        return nombres
+        return list(obtener_indice_hojas(service, spreadsheet_id))
     except HttpError as error:
         st.error(f"Error de API al obtener nombres de hojas: {error}")
         st.error(f"Detalles: {error.content}")
@@ -230,44 +1005,107 @@ def obtener_nombres_hojas(service, spreadsheet_id):
         return []
 
 # --- FUNCIONALIDAD MEJORADA: AGREGAR O ACTUALIZAR DATOS ---
-def agregar_o_actualizar_datos(service, spreadsheet_id, nombre_hoja, datos_nuevos):
+def _hash_fila(fila):
+    """Hash del contenido de una fila, sin la columna Fecha_Ultima_Actualizacion."""
+    contenido = '\x1f'.join(str(valor) for i, valor in enumerate(fila) if i != INDICE_FECHA_ACTUALIZACION)
+    return hashlib.blake2b(contenido.encode('utf-8'), digest_size=16).digest()
+
+def _bloques_de_cambios(fila_existente, fila_nueva):
+    """
+    Compara dos filas celda a celda (ignorando la fecha) y devuelve los bloques contiguos
+    de columnas a escribir como [(col_inicio, [valores...])]. Si hay cambios, la fecha de
+    actualización se escribe también; si no, devuelve [].
+    """
+    columnas = [i for i, (anterior, nuevo) in enumerate(zip(fila_existente, fila_nueva))
+                if i != INDICE_FECHA_ACTUALIZACION and str(anterior) != str(nuevo)]
+    if not columnas:
+        return []
+    columnas = sorted(columnas + [INDICE_FECHA_ACTUALIZACION])
+    bloques = []
+    for col in columnas:
+        if bloques and bloques[-1][0] + len(bloques[-1][1]) == col:
+            bloques[-1][1].append(fila_nueva[col])
+        else:
+            bloques.append((col, [fila_nueva[col]]))
+    return bloques
+
+def _leer_clientes_existentes(service, spreadsheet_id, nombre_hoja, datos_nuevos, reporte=st):
+    """
+    {Numero_Identificacion: {'row_data': fila, 'row_number': número de fila}} de los clientes
+    de la hoja que también vienen en datos_nuevos, leído sin caché. Si el archivo trae tantas
+    filas como la hoja se lee entera; si no, solo la columna C y las filas que coinciden.
+    Omite el encabezado si existe. Devuelve None si hubo un error (ya informado).
+    """
+    ids_nuevos = {fila[2] for fila in datos_nuevos if fila[2]}
+    # Tamaño actual (no el del índice cacheado): otra sesión o una edición manual pudo agregar filas
+    filas_en_hoja = contar_filas_hoja(service, spreadsheet_id, nombre_hoja, forzar=True, reporte=reporte)
+    if filas_en_hoja is not None and len(datos_nuevos) >= FRACCION_LECTURA_CONTIGUA * filas_en_hoja:
+        datos_actuales = leer_datos_hoja(service, spreadsheet_id, nombre_hoja, rango='A:K', usar_cache=False,
+                                         reporte=reporte)
+        if datos_actuales is None:
+            return None
+        encabezado = datos_actuales[0] if datos_actuales else []
+        inicio_datos = 1 if encabezado == ENCABEZADOS else 0 # Empezar desde la fila 1 si hay encabezado válido
+        fila_por_id = {fila[2]: i for i, fila in enumerate(datos_actuales[inicio_datos:], start=inicio_datos + 1)
+                       if len(fila) > 2 and fila[2]}
+        filas_existentes = {i: datos_actuales[i - 1] for i in fila_por_id.values()}
+    else:
+        lectura = leer_columnas_hoja(service, spreadsheet_id, nombre_hoja, ['C'], fila_inicio=1, usar_cache=False,
+                                     reporte=reporte)
+        if lectura is None:
+            return None
+        encabezado, columna_ids = lectura
+        inicio_datos = 1 if encabezado == ENCABEZADOS else 0
+        fila_por_id = {num_id: i for i, (num_id,) in enumerate(columna_ids[inicio_datos:], start=inicio_datos + 1)
+                       if num_id}
+        try:
+            filas_existentes = _leer_filas(service, spreadsheet_id, nombre_hoja,
+                                           [i for num_id, i in fila_por_id.items() if num_id in ids_nuevos],
+                                           usar_cache=False)
+        except HttpError as error:
+            reporte.error(f"Error de API al leer los clientes existentes de '{nombre_hoja}': {error}")
+            reporte.error(f"Detalles: {error.content}")
+            return None
+        except Exception as e:
+            reporte.error(f"Error inesperado al leer los clientes existentes de '{nombre_hoja}': {e}")
+            return None
+    # Si un Numero_Identificacion se repite en la hoja, vale la última fila
+    return {num_id: {'row_data': filas_existentes[i], 'row_number': i}
+            for num_id, i in fila_por_id.items() if num_id in ids_nuevos and i in filas_existentes}
+
+@instrumentar('upsert')
+def agregar_o_actualizar_datos(service, spreadsheet_id, nombre_hoja, datos_nuevos, solo_cambios=True, reporte=st):
     """
     Agrega nuevos clientes o actualiza los existentes basados en Numero_Identificacion.
     'datos_nuevos' es la lista de listas procesadas del Excel.
     Asume que Numero_Identificacion está en el índice 2 y Fecha_Actualizacion en el 8.
+    Con solo_cambios=True compara cada fila con la guardada (por hash, sin la fecha) y
+    solo escribe las celdas que cambiaron; si no, reescribe completas todas las coincidentes.
+    Los mensajes van a `reporte`: st en la página, contexto.reporte dentro de un trabajo.
+    Devuelve (filas agregadas, filas actualizadas, filas sin cambios).
     """
     if not service:
-        st.error("Servicio de Google Sheets no disponible.")
-        return 0, 0 # Filas agregadas, filas actualizadas
+        reporte.error("Servicio de Google Sheets no disponible.")
+        return 0, 0, 0 # Filas agregadas, filas actualizadas, filas sin cambios
 
-    # 1. Leer datos existentes de la hoja
-    datos_actuales = leer_datos_hoja(service, spreadsheet_id, nombre_hoja, rango='A:K') # Leer todas las columnas relevantes
-    if datos_actuales is None: # Hubo un error al leer
-        return 0, 0
-        
-    # 2. Crear un diccionario de los datos actuales para búsqueda rápida por Numero_Identificacion
-    #    Guardamos la fila completa y el número de fila original (índice + 1 porque sheets es 1-based)
-    #    Omitimos el encabezado si existe
-    mapa_datos_actuales = {}
-    encabezado = datos_actuales[0] if datos_actuales else []
-    inicio_datos = 1 if encabezado == ENCABEZADOS else 0 # Empezar desde la fila 1 si hay encabezado válido
-    
-    for i, fila in enumerate(datos_actuales[inicio_datos:], start=inicio_datos + 1):
-         if len(fila) > 2: # Asegurarse que la fila tiene al menos Numero_Identificacion
-             num_id = fila[2] 
-             if num_id: # Solo mapear si hay un número de identificación
-                 mapa_datos_actuales[num_id] = {'row_data': fila, 'row_number': i}
+    # 1. y 2. Diccionario de los datos actuales para búsqueda rápida por Numero_Identificacion,
+    #    con la fila completa y su número de fila (sin caché: la deduplicación necesita el estado real)
+    with medir(METRICA_ETAPA, 'upsert_lectura'): # Parte de la etapa 'upsert', medida aparte
+        mapa_datos_actuales = _leer_clientes_existentes(service, spreadsheet_id, nombre_hoja, datos_nuevos, reporte=reporte)
+    if mapa_datos_actuales is None: # Hubo un error al leer
+        return 0, 0, 0
 
     # 3. Procesar los datos nuevos
     filas_para_agregar = []
-    filas_para_actualizar = [] # Guardará (numero_fila, nueva_fila_completa)
+    filas_para_actualizar = [] # Guardará (numero_fila, [(col_inicio, valores), ...])
     cont_agregadas = 0
     cont_actualizadas = 0
+    cont_sin_cambios = 0
 
     for fila_nueva in datos_nuevos:
         num_id_nuevo = fila_nueva[2]
         if not num_id_nuevo:
-            st.warning(f"Registro omitido por no tener Numero_Identificacion: {fila_nueva[1]}")
+            reporte.warning(f"Registro omitido por no tener Numero_Identificacion: {fila_nueva[1]}")
             continue # Omitir si no hay identificador
 
         if num_id_nuevo in mapa_datos_actuales:
@@ -281,10 +1119,18 @@ def agregar_o_actualizar_datos(service, spreadsheet_id, nombre_hoja, datos_nuevo
             fila_actualizada[0] = id_unico_existente # Conservar ID único
            # Actualizar fecha
             fila_actualizada[9] = flag_wsp_existente # Conservar flag WSP
-            
-            # Podríamos añadir una lógica más compleja para decidir si realmente actualizar
-            # (p.ej., si los datos son diferentes) pero por ahora actualizamos siempre
-            filas_para_actualizar.append((fila_existente_info['row_number'], fila_actualizada))
+
+            if solo_cambios:
+                # Sheets omite las celdas vacías al final: completar antes de comparar
+                fila_existente = fila_existente_info['row_data']
+                fila_existente = fila_existente + [''] * (len(fila_actualizada) - len(fila_existente))
+                if _hash_fila(fila_existente) == _hash_fila(fila_actualizada):
+                    cont_sin_cambios += 1
+                    continue
+                bloques = _bloques_de_cambios(fila_existente, fila_actualizada)
+            else:
+                bloques = [(0, fila_actualizada)] # La fila completa
+            filas_para_actualizar.append((fila_existente_info['row_number'], bloques))
             cont_actualizadas += 1
         else:
             # Cliente nuevo, preparar para agregar
@@ -297,83 +1143,119 @@ def agregar_o_actualizar_datos(service, spreadsheet_id, nombre_hoja, datos_nuevo
     # a) Actualizar filas existentes (hacer esto ANTES de agregar para evitar problemas de índices)
     if filas_para_actualizar:
         updates_body = []
-        for row_num, row_data in filas_para_actualizar:
-             updates_body.append({
-                 'range': f"'{nombre_hoja}'!A{row_num}", # Rango de la fila a actualizar
-                 'values': [row_data] # La fila completa con los nuevos valores
-             })
+        for row_num, bloques in filas_para_actualizar:
+             for col_inicio, valores in bloques:
+                 updates_body.append({
+                     'range': f"'{nombre_hoja}'!{_indice_a_columna(col_inicio)}{row_num}", # Celdas a actualizar
+                     'values': [valores] # Solo los nuevos valores del bloque
+                 })
         
         try:
              body = {'valueInputOption': 'USER_ENTERED', 'data': updates_body}
-             service.spreadsheets().values().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
-             st.success(f"{len(filas_para_actualizar)} filas actualizadas en '{nombre_hoja}'.")
+             ejecutar_escritura(service.spreadsheets().values().batchUpdate(spreadsheetId=spreadsheet_id, body=body))
+             filas_actualizadas = [row_num for row_num, _ in filas_para_actualizar]
+             invalidar_cache_hoja(spreadsheet_id, nombre_hoja, col_inicio=0, col_fin=len(ENCABEZADOS) - 1,
+                                  fila_inicio=min(filas_actualizadas), fila_fin=max(filas_actualizadas))
+             for row_num, bloques in filas_para_actualizar:
+                 for col_inicio, valores in bloques:
+                     _notificar_escritura(spreadsheet_id, nombre_hoja, row_num, col_inicio, [valores], reporte=reporte)
+             reporte.success(f"{len(filas_para_actualizar)} filas actualizadas en '{nombre_hoja}' ({len(updates_body)} rangos escritos).")
         except HttpError as error:
-             st.error(f"Error de API al actualizar filas en '{nombre_hoja}': {error}")
-             st.error(f"Detalles: {error.content}")
+             reporte.error(f"Error de API al actualizar filas en '{nombre_hoja}': {error}")
+             reporte.error(f"Detalles: {error.content}")
              # Podríamos revertir o marcar estas filas como no actualizadas
              cont_actualizadas = 0 # Asumimos fallo total por simplicidad
 
     # b) Agregar nuevas filas
     if filas_para_agregar:
-        agregar_datos_a_hoja(service, spreadsheet_id, nombre_hoja, filas_para_agregar)
+        agregar_datos_a_hoja(service, spreadsheet_id, nombre_hoja, filas_para_agregar, reporte=reporte)
         # La función agregar_datos_a_hoja ya imprime el mensaje de éxito/error
     
-    return cont_agregadas, cont_actualizadas # Devuelve cuentas reales
+    if cont_sin_cambios:
+        reporte.info(f"{cont_sin_cambios} filas de '{nombre_hoja}' no tenían cambios y no se reescribieron.")
+
+    return cont_agregadas, cont_actualizadas, cont_sin_cambios # Devuelve cuentas reales
 
 
 # --- NUEVA FUNCIONALIDAD: SUBIR CSV A DRIVE ---
-def upload_csv_to_drive(drive_service, sheet_data, filename, folder_id=None):
+# Formatos de exportación: extensión y mimeType de cada uno
+FORMATOS_EXPORTACION = {
+    'csv': ('.csv', 'text/csv'),
+    'csv.gz': ('.csv.gz', 'application/gzip'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+}
+
+@instrumentar('exportacion')
+def exportar_hoja_a_drive(drive_service, sheet_data, filename, folder_id=None, formato='csv'):
     """
-    Convierte los datos de la hoja (lista de listas) a CSV y los sube a Google Drive.
+    Sube los datos de la hoja (lista de listas, con el encabezado primero) a Google Drive como
+    CSV, CSV comprimido con gzip ('csv.gz') o Parquet ('parquet', requiere pyarrow).
+    El archivo se genera por bloques a medida que se sube, sin armarlo completo en memoria.
     Devuelve el ID del archivo creado o None si falla.
     """
     if not drive_service:
         st.error("Servicio de Google Drive no disponible.")
         return None
     if not sheet_data:
-        st.warning("No hay datos para exportar a CSV.")
+        st.warning("No hay datos para exportar.")
+        return None
+    if formato not in FORMATOS_EXPORTACION:
+        st.error(f"Formato de exportación desconocido: '{formato}'.")
         return None
+    extension, mimetype = FORMATOS_EXPORTACION[formato]
+    nombre_archivo = f"{filename}{extension}"
 
     try:
-        # Convertir lista de listas a CSV en memoria
-        output = io.StringIO()
-        writer = csv.writer(output, quoting=csv.QUOTE_MINIMAL)
-        writer.writerows(sheet_data)
-        csv_content = output.getvalue()
-        output.close()
+        if formato == 'parquet':
+            if importlib.util.find_spec('pyarrow') is None:
+                st.error("La exportación a Parquet requiere la biblioteca 'pyarrow' (pip install pyarrow).")
+                return None
+            bloques = generar_parquet(sheet_data)
+        elif formato == 'csv.gz':
+            bloques = comprimir_gzip(generar_csv(sheet_data))
+        else:
+            bloques = generar_csv(sheet_data)
 
         # Preparar metadatos del archivo
         file_metadata = {
-            'name': f"{filename}.csv",
-            'mimeType': 'text/csv'
+            'name': nombre_archivo,
+            'mimeType': mimetype
         }
         # Si se proporciona un folder_id, añadirlo a los parents
         if folder_id:
             file_metadata['parents'] = [folder_id]
 
-        # Preparar el contenido multimedia
-        media = io.BytesIO(csv_content.encode('utf-8')) # Drive API espera bytes
-        media_body = MediaIoBaseUpload(media, mimetype='text/csv', resumable=True)
+        # Los bytes se generan a medida que la subida reanudable pide cada parte
+        media_body = SubidaEnStreaming(bloques, mimetype)
 
         # Crear el archivo en Drive
-        file = drive_service.files().create(
-            body=file_metadata,
-            media_body=media_body,
-            fields='id' # Pedir solo el ID del archivo creado
-        ).execute()
+        with medir(METRICA_API, 'drive.files.create') as medicion:
+            file = drive_service.files().create(
+                body=file_metadata,
+                media_body=media_body,
+                fields='id' # Pedir solo el ID del archivo creado
+            ).execute(num_retries=MAX_REINTENTOS) # googleapiclient reintenta cada parte; la subida en streaming no se puede reiniciar
+            medicion.bytes_enviados = media_body.size() or 0
 
         file_id = file.get('id')
-        st.success(f"Archivo '{filename}.csv' subido a Google Drive con ID: {file_id}")
+        st.success(f"Archivo '{nombre_archivo}' subido a Google Drive con ID: {file_id}")
         # Podríamos devolver un enlace al archivo si quisiéramos más info
         # file_link = f"https://drive.google.com/file/d/{file_id}/view"
         # st.info(f"Enlace: {file_link}")
         return file_id
 
     except HttpError as error:
-        st.error(f"Error de API al subir CSV a Drive: {error}")
+        st.error(f"Error de API al subir '{nombre_archivo}' a Drive: {error}")
         st.error(f"Detalles: {error.content}")
         return None
     except Exception as e:
-        st.error(f"Error inesperado al subir CSV a Drive: {e}")
+        st.error(f"Error inesperado al subir '{nombre_archivo}' a Drive: {e}")
         return None
+
+def upload_csv_to_drive(drive_service, sheet_data, filename, folder_id=None):
+    """
+    Convierte los datos de la hoja (lista de listas) a CSV y los sube a Google Drive.
+    Devuelve el ID del archivo creado o None si falla.
+    """
+    return exportar_hoja_a_drive(drive_service, sheet_data, filename, folder_id, formato='csv')
 # --- FIN NUEVA FUNCIONALIDAD ---
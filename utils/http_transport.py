@@ -0,0 +1,54 @@
+import threading
+
+import httplib2
+import requests
+from google.auth.transport.requests import AuthorizedSession, Request
+
+# Conexiones keep-alive por host que se mantienen abiertas (una por hilo de trabajo activo)
+TAMANO_POOL_HTTP = 16
+TIMEOUT_HTTP_SEGUNDOS = 120
+
+class TransporteCompartido:
+    """
+    Transporte HTTP con la interfaz de httplib2.Http (request/close) que espera googleapiclient,
+    implementado sobre una requests.Session autorizada con un pool de conexiones keep-alive.
+
+    Una sola instancia se comparte entre los servicios de Sheets y Drive: todas las llamadas
+    reutilizan las mismas conexiones TLS y el mismo token, que se refresca una única vez
+    aunque varios hilos lo encuentren vencido. A diferencia de httplib2, es seguro usarlo
+    desde varios hilos a la vez.
+    """
+
+    def __init__(self, credentials, tamano_pool=TAMANO_POOL_HTTP, timeout=TIMEOUT_HTTP_SEGUNDOS):
+        self.credentials = credentials # googleapiclient lo consulta para validar el dominio
+        self.timeout = timeout
+        self._sesion = AuthorizedSession(credentials)
+        self._sesion.mount('https://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=tamano_pool))
+        self._peticion_token = Request()
+        self._lock_token = threading.Lock()
+
+    def _asegurar_token(self):
+        if self.credentials.valid:
+            return
+        with self._lock_token:
+            if not self.credentials.valid: # Otro hilo pudo refrescarlo mientras esperábamos
+                self.credentials.refresh(self._peticion_token)
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=None, connection_type=None):
+        """Misma firma y retorno (respuesta, contenido) que httplib2.Http.request."""
+        self._asegurar_token()
+        respuesta = self._sesion.request(
+            method, uri, data=body, headers=headers, timeout=self.timeout,
+            # googleapiclient maneja los códigos 3xx (p.ej. 308 de subidas reanudables)
+            allow_redirects=False
+        )
+        cabeceras = {clave.lower(): valor for clave, valor in respuesta.headers.items()}
+        # requests ya descomprimió el cuerpo, como hace httplib2
+        cabeceras.pop('content-encoding', None)
+        cabeceras['status'] = str(respuesta.status_code)
+        resp = httplib2.Response(cabeceras)
+        resp.reason = respuesta.reason
+        return resp, respuesta.content
+
+    def close(self):
+        self._sesion.close()
@@ -0,0 +1,198 @@
+import re
+import threading
+import time
+
+import streamlit as st
+
+from .google_sheets import (
+    ENCABEZADOS,
+    obtener_indice_hojas,
+    registrar_observador_escrituras
+)
+from .request_scheduler import ejecutar_lectura
+
+# Columnas B:G de cada hoja: nombre, número y tipo de identificación, teléfonos y email
+RANGO_IDENTIDADES = 'B:G'
+_COLUMNA_INICIO = 1 # B
+_ENCABEZADO_RANGO = ENCABEZADOS[1:7]
+_I_NOMBRE, _I_ID, _I_TEL_1, _I_TEL_2, _I_EMAIL = 0, 1, 3, 4, 5 # Posiciones dentro de B:G
+
+INDICE_IDENTIDADES_TTL_SEGUNDOS = 600
+# Teléfonos con menos dígitos no se usan para cruzar clientes (internos, datos incompletos)
+MIN_DIGITOS_TELEFONO = 8
+
+_NO_ALFANUMERICO = re.compile(r'[^0-9A-Za-z]')
+_NO_DIGITO = re.compile(r'\D')
+
+def _claves_identidad(valores):
+    """Claves normalizadas ('id'|'telefono'|'email', valor) de una fila B:G."""
+    def celda(i):
+        return str(valores[i]).strip() if i < len(valores) and valores[i] is not None else ''
+    claves = set()
+    num_id = _NO_ALFANUMERICO.sub('', celda(_I_ID)).upper()
+    if num_id:
+        claves.add(('id', num_id))
+    for i in (_I_TEL_1, _I_TEL_2):
+        telefono = _NO_DIGITO.sub('', celda(i))
+        if len(telefono) >= MIN_DIGITOS_TELEFONO:
+            claves.add(('telefono', telefono))
+    email = celda(_I_EMAIL).lower()
+    if '@' in email:
+        claves.add(('email', email))
+    return claves
+
+class IndiceIdentidades:
+    """
+    Índice global de clientes de todas las hojas del spreadsheet: número de identificación,
+    teléfonos y email (normalizados) -> {(hoja, fila)}. Se construye con un único
+    values().batchGet del rango B:G de todas las hojas y se mantiene al día con las escrituras
+    de utils/google_sheets.py (aplicar_escritura, registrado como observador). Se reconstruye
+    al vencer `ttl_segundos`, para incorporar cambios hechos fuera de la app.
+    Es seguro usarlo desde varios hilos.
+    """
+
+    def __init__(self, service, spreadsheet_id, ttl_segundos=INDICE_IDENTIDADES_TTL_SEGUNDOS):
+        self.service = service
+        self.spreadsheet_id = spreadsheet_id
+        self.ttl_segundos = ttl_segundos
+        self.construido_en = None
+        self._lock = threading.Lock()
+        self._lock_construccion = threading.Lock()
+        self._por_clave = {} # (tipo, valor) -> {(hoja, fila)}
+        self._filas = {} # (hoja, fila) -> valores B:G
+        self._escrituras_durante_construccion = None
+
+    # --- Construcción ---
+    def construir(self):
+        """Lee B:G de todas las hojas (una sola llamada) y reemplaza el índice. Propaga errores de API."""
+        with self._lock_construccion:
+            with self._lock:
+                self._escrituras_durante_construccion = []
+            try:
+                nombres = list(obtener_indice_hojas(self.service, self.spreadsheet_id, forzar=True))
+                rangos = []
+                if nombres:
+                    respuesta = ejecutar_lectura(self.service.spreadsheets().values().batchGet(
+                        spreadsheetId=self.spreadsheet_id,
+                        ranges=[f"'{nombre}'!{RANGO_IDENTIDADES}" for nombre in nombres]
+                    ))
+                    rangos = respuesta.get('valueRanges', [])
+                filas = {}
+                # Los valueRanges vuelven en el mismo orden que los rangos pedidos
+                for nombre, rango in zip(nombres, rangos):
+                    for numero_fila, valores in enumerate(rango.get('values', []), start=1):
+                        if numero_fila == 1 and valores == _ENCABEZADO_RANGO:
+                            continue
+                        if valores:
+                            filas[(nombre, numero_fila)] = valores
+                por_clave = {}
+                for ubicacion, valores in filas.items():
+                    for clave in _claves_identidad(valores):
+                        por_clave.setdefault(clave, set()).add(ubicacion)
+                with self._lock:
+                    self._filas, self._por_clave = filas, por_clave
+                    # Las escrituras ocurridas durante la lectura pueden no estar en ella: reaplicarlas
+                    for escritura in self._escrituras_durante_construccion:
+                        self._aplicar(*escritura)
+                    self.construido_en = time.monotonic()
+            finally:
+                with self._lock:
+                    self._escrituras_durante_construccion = None
+
+    def asegurar_vigente(self):
+        """Construye el índice si nunca se construyó o si venció su TTL."""
+        if self.construido_en is None or time.monotonic() - self.construido_en > self.ttl_segundos:
+            self.construir()
+
+    # --- Actualización incremental ---
+    def aplicar_escritura(self, spreadsheet_id, nombre_hoja, fila_inicio, col_inicio, valores):
+        """Observador de escrituras de utils/google_sheets.py."""
+        if spreadsheet_id != self.spreadsheet_id:
+            return
+        with self._lock:
+            if self._escrituras_durante_construccion is not None:
+                self._escrituras_durante_construccion.append((nombre_hoja, fila_inicio, col_inicio, valores))
+            if self.construido_en is None:
+                return
+            if valores is None or fila_inicio is None:
+                self.construido_en = None # Contenido desconocido: reconstruir en el próximo uso
+                return
+            self._aplicar(nombre_hoja, fila_inicio, col_inicio, valores)
+
+    def _aplicar(self, nombre_hoja, fila_inicio, col_inicio, valores):
+        """Aplica un bloque escrito (columnas 0-based de la hoja). Llamar con el lock tomado."""
+        if valores is None or fila_inicio is None:
+            return
+        inicio_en_rango = col_inicio - _COLUMNA_INICIO
+        for desplazamiento, valores_fila in enumerate(valores):
+            # Solo interesan las celdas del bloque que caen dentro de B:G
+            celdas = [(inicio_en_rango + i, valor) for i, valor in enumerate(valores_fila)
+                      if 0 <= inicio_en_rango + i < len(_ENCABEZADO_RANGO)]
+            if not celdas:
+                continue
+            ubicacion = (nombre_hoja, fila_inicio + desplazamiento)
+            anteriores = self._filas.get(ubicacion, [])
+            nuevos = list(anteriores) + [''] * (len(_ENCABEZADO_RANGO) - len(anteriores))
+            for i, valor in celdas:
+                nuevos[i] = '' if valor is None else str(valor)
+            for clave in _claves_identidad(anteriores):
+                ubicaciones = self._por_clave.get(clave)
+                if ubicaciones:
+                    ubicaciones.discard(ubicacion)
+                    if not ubicaciones:
+                        del self._por_clave[clave]
+            self._filas[ubicacion] = nuevos
+            for clave in _claves_identidad(nuevos):
+                self._por_clave.setdefault(clave, set()).add(ubicacion)
+
+    # --- Consultas ---
+    def _resultado(self, ubicacion, coincide_por):
+        valores = self._filas.get(ubicacion, [])
+        def celda(i):
+            return valores[i] if i < len(valores) else ''
+        return {'Hoja': ubicacion[0], 'Fila': ubicacion[1], 'Nombre_Apellido': celda(_I_NOMBRE),
+                'Numero_Identificacion': celda(_I_ID), 'Numero_Telefono_1': celda(_I_TEL_1),
+                'Email_Principal': celda(_I_EMAIL), 'Coincide_Por': coincide_por}
+
+    def buscar(self, texto):
+        """
+        Clientes de cualquier hoja cuyo número de identificación, teléfono o email coincide
+        con `texto`. Devuelve una lista de dicts (Hoja, Fila, Nombre_Apellido, ..., Coincide_Por).
+        """
+        texto = str(texto).strip()
+        claves = {('id', _NO_ALFANUMERICO.sub('', texto).upper()), ('email', texto.lower()),
+                  ('telefono', _NO_DIGITO.sub('', texto))}
+        with self._lock:
+            coincidencias = {}
+            for clave in claves:
+                for ubicacion in self._por_clave.get(clave, ()):
+                    coincidencias.setdefault(ubicacion, []).append(clave[0])
+            return [self._resultado(ubicacion, ', '.join(sorted(tipos)))
+                    for ubicacion, tipos in sorted(coincidencias.items())]
+
+    def buscar_en_otras_hojas(self, nombre_hoja, filas):
+        """
+        Para filas con la estructura de ENCABEZADOS (p.ej. las de un Excel a cargar en
+        `nombre_hoja`), devuelve los clientes de otras hojas que comparten identificación,
+        teléfono o email, con 'Numero_Identificacion_Nuevo' indicando la fila que coincidió.
+        """
+        resultados = []
+        with self._lock:
+            for fila in filas:
+                coincidencias = {}
+                for clave in _claves_identidad(fila[_COLUMNA_INICIO:_COLUMNA_INICIO + len(_ENCABEZADO_RANGO)]):
+                    for ubicacion in self._por_clave.get(clave, ()):
+                        if ubicacion[0] != nombre_hoja:
+                            coincidencias.setdefault(ubicacion, []).append(clave[0])
+                for ubicacion, tipos in sorted(coincidencias.items()):
+                    resultado = self._resultado(ubicacion, ', '.join(sorted(tipos)))
+                    resultado['Numero_Identificacion_Nuevo'] = fila[2]
+                    resultados.append(resultado)
+        return resultados
+
+@st.cache_resource
+def obtener_indice_identidades(_service, spreadsheet_id):
+    """Índice global compartido por las sesiones (uno por spreadsheet), suscripto a las escrituras."""
+    indice = IndiceIdentidades(_service, spreadsheet_id)
+    registrar_observador_escrituras(indice.aplicar_escritura)
+    return indice
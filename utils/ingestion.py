@@ -0,0 +1,225 @@
+import io
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from .background_jobs import contexto_trabajo_actual, en_contexto_trabajo
+from .column_mapping import resolver_mapeo
+from .data_processing import leer_encabezado_excel, leer_excel_por_bloques, iterar_datos_desde_bloques
+from .request_scheduler import prioridad_peticiones, PRIORIDAD_LOTE
+from .google_sheets import (
+    verificar_o_crear_hoja,
+    agregar_o_actualizar_datos
+)
+
+# Archivos que se leen/preparan a la vez y escrituras a Sheets simultáneas (de hojas distintas)
+MAX_TRABAJADORES_PREPARACION = 4
+MAX_ESCRITURAS_SIMULTANEAS = 3
+
+# Un lock por hoja compartido por todas las cargas del proceso (también entre trabajos de
+# distintas sesiones): dos upserts de la misma hoja a la vez leerían el mismo estado previo
+_locks_hojas = {}
+_lock_locks_hojas = threading.Lock()
+
+def _lock_de_hoja(spreadsheet_id, nombre_hoja):
+    with _lock_locks_hojas:
+        return _locks_hojas.setdefault((spreadsheet_id, nombre_hoja), threading.Lock())
+
+class ArchivoEnMemoria(io.BytesIO):
+    """Copia de un archivo subido (con su `name`), independiente del widget que lo subió."""
+
+    def __init__(self, datos, name):
+        super().__init__(datos)
+        self.name = name
+
+def copiar_archivo_subido(uploaded_file):
+    """Copia el contenido de un UploadedFile para procesarlo en un trabajo en segundo plano."""
+    return ArchivoEnMemoria(uploaded_file.getvalue(), uploaded_file.name)
+
+def procesar_archivo(service, spreadsheet_id, uploaded_file, nombre_hoja, solo_cambios=True,
+                     semaforo_escrituras=None, lock_hoja=None, indice_identidades=None, mapeo=None,
+                     reporte=st, debe_detenerse=None):
+    """
+    Ejecuta el pipeline completo de un archivo: leer -> preparar -> verificar/crear hoja -> agregar/actualizar.
+    `mapeo` (campo -> columna del Excel, ver utils/column_mapping.py) es el confirmado en la
+    interfaz; si no se indica, se usa el perfil guardado de este formato o el detectado.
+    El Excel se lee, prepara y escribe por bloques (ver iterar_datos_desde_bloques), así la
+    memoria no crece con el tamaño del archivo; cada bloque es un upsert propio.
+    Si se pasan `semaforo_escrituras` y `lock_hoja`, la escritura de cada bloque en Sheets se
+    hace con ambos tomados (primero el de la hoja, luego el semáforo global). Las peticiones a
+    Sheets van por el carril de lote: con la cuota agotada la carga se frena en lugar de
+    fallar, sin demorar las lecturas interactivas.
+    Si se pasa `indice_identidades` (IndiceIdentidades ya construido), informa los clientes
+    del archivo que ya figuran en otras compañías.
+    Los mensajes van a `reporte`: st en la página, contexto.reporte dentro de un trabajo.
+    `debe_detenerse()` (p.ej. ContextoTrabajo.debe_detenerse), si se indica, se consulta entre
+    bloques del Excel y antes de escribir cada uno (también después de esperar los locks): si
+    devuelve True no se escribe nada más y el estado es 'cancelado' (con las cantidades de lo
+    ya escrito).
+    Devuelve un dict con 'archivo', 'hoja', 'estado' ('ok', 'error_lectura', 'sin_datos',
+    'error_hoja', 'cancelado'), 'agregados', 'actualizados', 'sin_cambios' y 'en_otras_companias'.
+    """
+    resultado = {'archivo': uploaded_file.name, 'hoja': nombre_hoja, 'estado': 'ok',
+                 'agregados': 0, 'actualizados': 0, 'sin_cambios': 0, 'en_otras_companias': 0}
+    reporte.markdown(f"**Procesando: {uploaded_file.name} para la hoja '{nombre_hoja}'**")
+
+    if mapeo is None:
+        columnas = leer_encabezado_excel(uploaded_file, reporte=reporte)
+        if columnas is None:
+            resultado['estado'] = 'error_lectura'
+            return resultado
+        mapeo, desde_perfil = resolver_mapeo(columnas, nombre_hoja)
+        if not desde_perfil:
+            reporte.caption(f"Formato de '{uploaded_file.name}' sin perfil guardado para '{nombre_hoja}': columnas detectadas automáticamente.")
+
+    # Lectura streaming: el Excel se adapta y se escribe bloque a bloque (memoria acotada a un bloque)
+    bloques_compania = leer_excel_por_bloques(uploaded_file, mapeo=mapeo, reporte=reporte, nombre_compania=nombre_hoja)
+    if bloques_compania is None:
+        reporte.error(f"No se pudo leer el archivo Excel: '{uploaded_file.name}'.")
+        resultado['estado'] = 'error_lectura'
+        return resultado
+
+    lotes = iterar_datos_desde_bloques(bloques_compania, nombre_hoja, mapeo=mapeo, reporte=reporte,
+                                       debe_detenerse=debe_detenerse)
+    filas_preparadas = 0
+    hoja_verificada = False
+    try:
+        for filas in lotes:
+            filas_preparadas += len(filas)
+            if indice_identidades is not None:
+                resultado['en_otras_companias'] += informar_clientes_en_otras_companias(
+                    indice_identidades, nombre_hoja, filas, reporte=reporte
+                )
+            # Los locks se toman por lote: la lectura del bloque siguiente no demora a otras cargas
+            with lock_hoja or nullcontext(), semaforo_escrituras or nullcontext(), prioridad_peticiones(PRIORIDAD_LOTE):
+                if debe_detenerse is not None and debe_detenerse(): # Se pudo cancelar mientras esperaba su turno
+                    break
+                if not hoja_verificada:
+                    if not verificar_o_crear_hoja(service, spreadsheet_id, nombre_hoja, reporte=reporte):
+                        reporte.error(f"No se pudieron procesar los datos para '{nombre_hoja}' porque la hoja no pudo ser creada/verificada.")
+                        resultado['estado'] = 'error_hoja'
+                        return resultado
+                    hoja_verificada = True
+                agregados, actualizados, sin_cambios = agregar_o_actualizar_datos(
+                    service, spreadsheet_id, nombre_hoja, filas, solo_cambios=solo_cambios, reporte=reporte
+                )
+            resultado['agregados'] += agregados
+            resultado['actualizados'] += actualizados
+            resultado['sin_cambios'] += sin_cambios
+    finally:
+        lotes.close() # Cierra el Excel si se dejó de leer antes del final
+
+    if debe_detenerse is not None and debe_detenerse():
+        escritas = resultado['agregados'] + resultado['actualizados'] + resultado['sin_cambios']
+        detalle = f"después de procesar {escritas} filas" if escritas else "antes de escribir"
+        reporte.warning(f"Carga de '{uploaded_file.name}' cancelada {detalle} en '{nombre_hoja}'.")
+        resultado['estado'] = 'cancelado'
+    elif not filas_preparadas:
+        reporte.warning(f"No se prepararon datos válidos del archivo '{uploaded_file.name}' para '{nombre_hoja}'.")
+        resultado['estado'] = 'sin_datos'
+    return resultado
+
+def informar_clientes_en_otras_companias(indice_identidades, nombre_hoja, filas, reporte=st):
+    """
+    Muestra los clientes de `filas` que comparten identificación, teléfono o email con
+    clientes de otras hojas. Devuelve cuántos clientes de `filas` coincidieron.
+    """
+    coincidencias = indice_identidades.buscar_en_otras_hojas(nombre_hoja, filas)
+    if not coincidencias:
+        return 0
+    df = pd.DataFrame(coincidencias)
+    clientes = df['Numero_Identificacion_Nuevo'].nunique()
+    reporte.info(f"{clientes} cliente(s) del archivo para '{nombre_hoja}' ya figuran en otras compañías.")
+    reporte.dataframe(df[['Numero_Identificacion_Nuevo', 'Hoja', 'Fila', 'Nombre_Apellido',
+                     'Numero_Identificacion', 'Coincide_Por']], hide_index=True)
+    return clientes
+
+def procesar_archivos_en_paralelo(service, spreadsheet_id, archivos, solo_cambios=True,
+                                  max_trabajadores=MAX_TRABAJADORES_PREPARACION,
+                                  max_escrituras=MAX_ESCRITURAS_SIMULTANEAS,
+                                  indice_identidades=None, al_terminar_archivo=None):
+    """
+    Procesa varios archivos a la vez. `archivos` es una lista de dicts {'name', 'file'} y,
+    opcionalmente, 'mapeo' (como la arma app.py). La lectura y preparación corren en un pool de hilos; las escrituras en
+    hojas distintas se solapan hasta `max_escrituras` y las de una misma hoja se serializan.
+    Los mensajes de cada archivo aparecen en su propio contenedor, en el orden de `archivos`
+    (dentro de un trabajo en segundo plano, en la bitácora del trabajo).
+    `al_terminar_archivo(resultado)`, si se indica, se llama desde el hilo de cada archivo al terminarlo.
+    Devuelve la lista de resultados de procesar_archivo en ese mismo orden.
+    """
+    contexto_script = get_script_run_ctx(suppress_warning=True)
+    contexto_trabajo = contexto_trabajo_actual()
+    reporte = contexto_trabajo.reporte if contexto_trabajo is not None else st
+    semaforo_escrituras = threading.Semaphore(max_escrituras)
+    contenedores = [st.container() if contexto_script else nullcontext() for _ in archivos]
+
+    def trabajar(data, contenedor):
+        # Permite que el hilo escriba en la página de la sesión que lanzó el proceso
+        if contexto_script:
+            add_script_run_ctx(threading.current_thread(), contexto_script)
+        resultado = None
+        if contexto_trabajo is not None and contexto_trabajo.debe_detenerse():
+            # Trabajo cancelado: los archivos que aún no empezaron no se escriben
+            resultado = {'archivo': data['file'].name, 'hoja': data['name'], 'estado': 'cancelado',
+                         'agregados': 0, 'actualizados': 0, 'sin_cambios': 0, 'en_otras_companias': 0}
+            if al_terminar_archivo is not None:
+                al_terminar_archivo(resultado)
+            return resultado
+        with contenedor, en_contexto_trabajo(contexto_trabajo):
+            try:
+                resultado = procesar_archivo(
+                    service, spreadsheet_id, data['file'], data['name'],
+                    solo_cambios=solo_cambios, semaforo_escrituras=semaforo_escrituras,
+                    lock_hoja=_lock_de_hoja(spreadsheet_id, data['name']),
+                    indice_identidades=indice_identidades, mapeo=data.get('mapeo'), reporte=reporte,
+                    debe_detenerse=contexto_trabajo.debe_detenerse if contexto_trabajo is not None else None
+                )
+            except Exception as e:
+                reporte.error(f"Error inesperado procesando '{data['file'].name}': {e}")
+                resultado = {'archivo': data['file'].name, 'hoja': data['name'], 'estado': 'error',
+                             'agregados': 0, 'actualizados': 0, 'sin_cambios': 0, 'en_otras_companias': 0}
+            finally:
+                reporte.markdown("---") # Separador entre archivos
+        if al_terminar_archivo is not None:
+            al_terminar_archivo(resultado)
+        return resultado
+
+    with ThreadPoolExecutor(max_workers=max_trabajadores) as pool:
+        futuros = [pool.submit(trabajar, data, contenedor) for data, contenedor in zip(archivos, contenedores)]
+        return [futuro.result() for futuro in futuros]
+
+def trabajo_procesar_archivos(contexto, service, spreadsheet_id, archivos, solo_cambios=True,
+                              en_paralelo=True, indice_identidades=None):
+    """
+    Función de trabajo en segundo plano (ver utils/background_jobs.py) para 'Procesar Archivos
+    Cargados'. `archivos` es como en procesar_archivos_en_paralelo, con copias de los archivos
+    subidos (copiar_archivo_subido). Informa el progreso por archivo y devuelve la lista de resultados.
+    Si se cancela, los archivos sin terminar quedan con estado 'cancelado' y las cantidades de
+    lo que alcanzaron a escribir (se detienen entre bloques).
+    """
+    if indice_identidades is not None:
+        try:
+            indice_identidades.asegurar_vigente()
+        except Exception as e:
+            contexto.reporte.warning(f"No se pudo construir el índice de clientes de todas las compañías: {e}")
+            indice_identidades = None
+
+    terminados = []
+    lock_terminados = threading.Lock()
+    contexto.progreso(0, len(archivos))
+
+    def al_terminar_archivo(resultado):
+        with lock_terminados:
+            terminados.append(resultado)
+            contexto.progreso(len(terminados), texto=f"Terminado '{resultado['archivo']}' ({resultado['estado']})")
+
+    return procesar_archivos_en_paralelo(
+        service, spreadsheet_id, archivos, solo_cambios=solo_cambios,
+        max_trabajadores=MAX_TRABAJADORES_PREPARACION if en_paralelo else 1,
+        max_escrituras=MAX_ESCRITURAS_SIMULTANEAS if en_paralelo else 1,
+        indice_identidades=indice_identidades, al_terminar_archivo=al_terminar_archivo
+    )
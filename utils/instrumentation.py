@@ -0,0 +1,196 @@
+import bisect
+import contextlib
+import functools
+import json
+import threading
+import time
+
+import pandas as pd
+import streamlit as st
+
+# Límites superiores (segundos) de los tramos del histograma de latencias
+LIMITES_HISTOGRAMA_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PREFIJO_PROMETHEUS = 'broker_app'
+
+# Métricas que se registran
+METRICA_API = 'api' # Cada intento de llamada a Google (operación: methodId de la API)
+METRICA_ESPERA_CUOTA = 'espera_cuota' # Espera en el token bucket antes de una llamada (operación: lecturas/escrituras)
+METRICA_ETAPA = 'etapa' # Etapas del pipeline (operación: nombre de la etapa)
+
+class _Serie:
+    """Acumulados de una (métrica, operación)."""
+
+    def __init__(self):
+        self.cantidad = 0
+        self.errores = 0
+        self.suma_segundos = 0.0
+        self.tramos = [0] * (len(LIMITES_HISTOGRAMA_SEGUNDOS) + 1) # El último es +Inf
+        self.bytes_enviados = 0
+        self.bytes_recibidos = 0
+
+    def percentil(self, fraccion):
+        """Límite superior del tramo que contiene el percentil (None si no hay datos o cae en +Inf)."""
+        if not self.cantidad:
+            return None
+        objetivo, acumulado = fraccion * self.cantidad, 0
+        for limite, cantidad in zip(LIMITES_HISTOGRAMA_SEGUNDOS, self.tramos):
+            acumulado += cantidad
+            if acumulado >= objetivo:
+                return limite
+        return None
+
+class _Medicion:
+    """Lo que el código medido puede completar dentro de un bloque medir()."""
+
+    def __init__(self):
+        self.bytes_enviados = 0
+        self.bytes_recibidos = 0
+        self.error = False
+
+class RegistroMetricas:
+    """
+    Contadores, histogramas de latencia y bytes por (métrica, operación), en memoria del
+    proceso (suma todas las sesiones). Es seguro usarlo desde varios hilos. Se exporta
+    como JSON o en el formato de texto de Prometheus.
+    """
+
+    def __init__(self):
+        self._series = {}
+        self._lock = threading.Lock()
+        self.desde = time.time()
+
+    def _serie(self, metrica, operacion):
+        clave = (metrica, operacion)
+        serie = self._series.get(clave)
+        if serie is None:
+            serie = self._series[clave] = _Serie()
+        return serie
+
+    def registrar(self, metrica, operacion, segundos, error=False, bytes_enviados=0, bytes_recibidos=0):
+        with self._lock:
+            serie = self._serie(metrica, operacion)
+            serie.cantidad += 1
+            serie.errores += int(bool(error))
+            serie.suma_segundos += segundos
+            serie.tramos[bisect.bisect_left(LIMITES_HISTOGRAMA_SEGUNDOS, segundos)] += 1
+            serie.bytes_enviados += bytes_enviados
+            serie.bytes_recibidos += bytes_recibidos
+
+    def sumar_bytes(self, metrica, operacion, enviados=0, recibidos=0):
+        """Suma bytes a una serie sin contar una operación (p.ej. la respuesta ya medida)."""
+        with self._lock:
+            serie = self._serie(metrica, operacion)
+            serie.bytes_enviados += enviados
+            serie.bytes_recibidos += recibidos
+
+    @contextlib.contextmanager
+    def medir(self, metrica, operacion):
+        """Mide la duración del bloque; una excepción (o medicion.error = True) cuenta como error."""
+        medicion = _Medicion()
+        inicio = time.perf_counter()
+        try:
+            yield medicion
+        except BaseException:
+            medicion.error = True
+            raise
+        finally:
+            self.registrar(metrica, operacion, time.perf_counter() - inicio, error=medicion.error,
+                           bytes_enviados=medicion.bytes_enviados, bytes_recibidos=medicion.bytes_recibidos)
+
+    def total(self, metrica):
+        """Cantidad de operaciones registradas de la métrica (todas las operaciones)."""
+        with self._lock:
+            return sum(serie.cantidad for (m, _), serie in self._series.items() if m == metrica)
+
+    def instantanea(self):
+        """Lista de dicts (una por serie) con cantidades, latencias y bytes."""
+        with self._lock:
+            filas = []
+            for (metrica, operacion), serie in sorted(self._series.items()):
+                filas.append({
+                    'metrica': metrica, 'operacion': operacion, 'cantidad': serie.cantidad,
+                    'errores': serie.errores, 'segundos_total': round(serie.suma_segundos, 6),
+                    'segundos_promedio': round(serie.suma_segundos / serie.cantidad, 6) if serie.cantidad else None,
+                    'p50_segundos': serie.percentil(0.5), 'p95_segundos': serie.percentil(0.95),
+                    'bytes_enviados': serie.bytes_enviados, 'bytes_recibidos': serie.bytes_recibidos,
+                    'histograma': dict(zip([str(l) for l in LIMITES_HISTOGRAMA_SEGUNDOS] + ['+Inf'], serie.tramos))
+                })
+            return filas
+
+    def a_json(self):
+        return json.dumps({'desde': self.desde, 'series': self.instantanea()}, indent=2, ensure_ascii=False)
+
+    def a_prometheus(self):
+        """Formato de exposición de texto de Prometheus (histogramas y contadores)."""
+        lineas = []
+        with self._lock:
+            metricas = sorted({metrica for metrica, _ in self._series})
+            for metrica in metricas:
+                series = sorted((operacion, serie) for (m, operacion), serie in self._series.items() if m == metrica)
+                base = f'{PREFIJO_PROMETHEUS}_{metrica}'
+                lineas.append(f'# HELP {base}_segundos Latencia de {metrica} por operación.')
+                lineas.append(f'# TYPE {base}_segundos histogram')
+                for operacion, serie in series:
+                    etiqueta = _etiqueta_prometheus(operacion)
+                    acumulado = 0
+                    for limite, cantidad in zip(LIMITES_HISTOGRAMA_SEGUNDOS, serie.tramos):
+                        acumulado += cantidad
+                        lineas.append(f'{base}_segundos_bucket{{operacion="{etiqueta}",le="{limite}"}} {acumulado}')
+                    lineas.append(f'{base}_segundos_bucket{{operacion="{etiqueta}",le="+Inf"}} {serie.cantidad}')
+                    lineas.append(f'{base}_segundos_sum{{operacion="{etiqueta}"}} {serie.suma_segundos}')
+                    lineas.append(f'{base}_segundos_count{{operacion="{etiqueta}"}} {serie.cantidad}')
+                for sufijo, atributo in (('errores', 'errores'), ('bytes_enviados', 'bytes_enviados'),
+                                         ('bytes_recibidos', 'bytes_recibidos')):
+                    lineas.append(f'# TYPE {base}_{sufijo}_total counter')
+                    for operacion, serie in series:
+                        lineas.append(f'{base}_{sufijo}_total{{operacion="{_etiqueta_prometheus(operacion)}"}} '
+                                      f'{getattr(serie, atributo)}')
+        return '\n'.join(lineas) + '\n'
+
+    def reiniciar(self):
+        with self._lock:
+            self._series.clear()
+            self.desde = time.time()
+
+def _etiqueta_prometheus(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# Registro global del proceso
+registro = RegistroMetricas()
+
+def medir(metrica, operacion):
+    """Atajo a registro.medir()."""
+    return registro.medir(metrica, operacion)
+
+def instrumentar(operacion, metrica=METRICA_ETAPA):
+    """Decorador: registra cada llamada a la función como una operación de `metrica`."""
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with registro.medir(metrica, operacion):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
+
+def mostrar_panel_diagnostico():
+    """Panel de diagnóstico en la barra lateral: llamadas a la API, latencias y exportación."""
+    total_api = registro.total(METRICA_API)
+    anterior = st.session_state.get('llamadas_api_al_inicio')
+    st.session_state['llamadas_api_al_inicio'] = total_api
+    with st.sidebar.expander("Diagnóstico"):
+        if anterior is not None and anterior <= total_api:
+            st.caption(f"Llamadas a Google desde la ejecución anterior: {total_api - anterior}")
+        filas = registro.instantanea()
+        if not filas:
+            st.caption("Todavía no hay mediciones.")
+            return
+        st.dataframe(
+            pd.DataFrame(filas)[['metrica', 'operacion', 'cantidad', 'errores', 'segundos_promedio',
+                                 'p95_segundos', 'bytes_recibidos', 'bytes_enviados']],
+            hide_index=True
+        )
+        st.download_button("Descargar JSON", registro.a_json(), file_name="metricas.json", mime="application/json")
+        st.download_button("Descargar Prometheus", registro.a_prometheus(), file_name="metricas.prom", mime="text/plain")
+        if st.button("Reiniciar métricas"):
+            registro.reiniciar()
+            st.session_state['llamadas_api_al_inicio'] = 0
@@ -0,0 +1,346 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import streamlit as st
+
+from .google_sheets import (
+    ENCABEZADOS,
+    generacion_spreadsheet,
+    leer_datos_hoja,
+    obtener_indice_hojas,
+    registrar_observador_escrituras
+)
+from .request_scheduler import ejecutar_lectura, prioridad_peticiones, PRIORIDAD_LOTE
+
+# Copia local de las hojas (rango A:K); se crea al primer uso
+RUTA_ESPEJO_LOCAL = os.path.join('.cache', 'espejo_hojas.sqlite3')
+RANGO_ESPEJO = 'A:K'
+INTERVALO_SINCRONIZACION_SEGUNDOS = 60
+# El hilo de sincronización se detiene si ninguna sesión usó el espejo durante este tiempo
+TIEMPO_SIN_USO_SEGUNDOS = 600
+
+# Una columna SQLite por columna de la hoja, con los nombres de ENCABEZADOS
+COLUMNAS_ESPEJO = list(ENCABEZADOS)
+
+def _hash_celdas(celdas):
+    contenido = '\x1f'.join(str(valor) for valor in celdas)
+    return hashlib.blake2b(contenido.encode('utf-8'), digest_size=16).digest()
+
+def _ancho_sin_vacias(celdas):
+    """Largo de la fila sin las celdas vacías finales (Sheets no las devuelve)."""
+    ancho = len(celdas)
+    while ancho and celdas[ancho - 1] in ('', None):
+        ancho -= 1
+    return ancho
+
+class EspejoLocal:
+    """
+    Copia local en SQLite de las hojas del spreadsheet, en el mismo formato que devuelve
+    leer_datos_hoja (lista de filas, sin celdas vacías finales). Se mantiene al día de dos
+    formas: las escrituras de utils/google_sheets.py se aplican al instante (aplicar_escritura,
+    registrado como observador) y SincronizadorEspejo trae periódicamente los cambios hechos
+    fuera de la app, reescribiendo solo las filas cuyo contenido cambió.
+
+    Una hoja solo se lee del espejo si está "vigente": al abrir el archivo (otro proceso pudo
+    escribir mientras tanto) o ante una escritura de contenido desconocido deja de estarlo
+    hasta la próxima sincronización. Es seguro usarlo desde varios hilos.
+    """
+
+    def __init__(self, ruta=RUTA_ESPEJO_LOCAL):
+        if os.path.dirname(ruta):
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        self.ruta = ruta
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._generaciones = {} # (spreadsheet_id, hoja) -> contador de escrituras locales
+        self._lecturas = {} # (spreadsheet_id, hoja) -> última lista devuelta por leer_hoja, hasta que cambie
+        columnas = ', '.join(f'"{columna}" TEXT' for columna in COLUMNAS_ESPEJO)
+        with self._lock, self._conexion:
+            self._conexion.execute("PRAGMA journal_mode=WAL")
+            self._conexion.execute(
+                f"CREATE TABLE IF NOT EXISTS filas (spreadsheet_id TEXT, hoja TEXT, fila INTEGER, "
+                f"ancho INTEGER, hash BLOB, {columnas}, PRIMARY KEY (spreadsheet_id, hoja, fila)) WITHOUT ROWID"
+            )
+            self._conexion.execute(
+                "CREATE TABLE IF NOT EXISTS hojas (spreadsheet_id TEXT, hoja TEXT, sincronizada_en REAL, "
+                "vigente INTEGER, PRIMARY KEY (spreadsheet_id, hoja))"
+            )
+            self._conexion.execute("UPDATE hojas SET vigente = 0")
+
+    def generacion(self, spreadsheet_id, nombre_hoja):
+        """Contador que aumenta con cada escritura local aplicada a la hoja."""
+        with self._lock:
+            return self._generaciones.get((spreadsheet_id, nombre_hoja), 0)
+
+    def estado_hoja(self, spreadsheet_id, nombre_hoja):
+        """{'sincronizada_en', 'vigente', 'filas'} de la hoja, o None si nunca se sincronizó."""
+        with self._lock:
+            estado = self._conexion.execute(
+                "SELECT sincronizada_en, vigente FROM hojas WHERE spreadsheet_id = ? AND hoja = ?",
+                (spreadsheet_id, nombre_hoja)
+            ).fetchone()
+            if estado is None:
+                return None
+            filas, = self._conexion.execute(
+                "SELECT COUNT(*) FROM filas WHERE spreadsheet_id = ? AND hoja = ?", (spreadsheet_id, nombre_hoja)
+            ).fetchone()
+        return {'sincronizada_en': estado[0], 'vigente': bool(estado[1]), 'filas': filas}
+
+    def leer_hoja(self, spreadsheet_id, nombre_hoja):
+        """
+        Devuelve las filas de la hoja como leer_datos_hoja, o None si no está vigente.
+        Mientras la hoja no cambie se devuelve la misma lista: no modificarla.
+        """
+        lista_columnas = ', '.join(f'"{columna}"' for columna in COLUMNAS_ESPEJO)
+        clave = (spreadsheet_id, nombre_hoja)
+        with self._lock:
+            vigente = self._conexion.execute(
+                "SELECT vigente FROM hojas WHERE spreadsheet_id = ? AND hoja = ?", clave
+            ).fetchone()
+            if not vigente or not vigente[0]:
+                return None
+            if clave in self._lecturas:
+                return self._lecturas[clave]
+            registros = self._conexion.execute(
+                f"SELECT fila, ancho, {lista_columnas} FROM filas "
+                f"WHERE spreadsheet_id = ? AND hoja = ? ORDER BY fila", clave
+            ).fetchall()
+            generacion = self._generaciones.get(clave, 0)
+        valores = []
+        for registro in registros:
+            fila, ancho = registro[0], registro[1]
+            while len(valores) < fila - 1: # Filas vacías intermedias, como las devuelve la API
+                valores.append([])
+            valores.append(['' if celda is None else celda for celda in registro[2:2 + ancho]])
+        with self._lock:
+            if self._generaciones.get(clave, 0) == generacion:
+                self._lecturas[clave] = valores
+        return valores
+
+    def reemplazar_hoja(self, spreadsheet_id, nombre_hoja, valores, generacion=None):
+        """
+        Sincroniza la hoja con `valores` (lo leído de Sheets), escribiendo solo las filas que
+        cambiaron y borrando las que ya no existen. Si se pasa `generacion` y desde entonces se
+        aplicó una escritura local, no hace nada (los valores leídos ya son viejos) y devuelve
+        None; si no, devuelve la cantidad de filas escritas o borradas.
+        """
+        ancho_maximo = len(COLUMNAS_ESPEJO)
+        nuevas = {}
+        for numero_fila, celdas in enumerate(valores, start=1):
+            celdas = [str(celda) for celda in celdas[:ancho_maximo]]
+            celdas = celdas[:_ancho_sin_vacias(celdas)]
+            if celdas:
+                nuevas[numero_fila] = celdas
+        with self._lock, self._conexion:
+            clave = (spreadsheet_id, nombre_hoja)
+            if generacion is not None and self._generaciones.get(clave, 0) != generacion:
+                return None
+            hashes = dict(self._conexion.execute(
+                "SELECT fila, hash FROM filas WHERE spreadsheet_id = ? AND hoja = ?", clave
+            ).fetchall())
+            cambiadas = [(numero_fila, celdas) for numero_fila, celdas in nuevas.items()
+                         if hashes.get(numero_fila) != _hash_celdas(celdas)]
+            borradas = [(spreadsheet_id, nombre_hoja, numero_fila) for numero_fila in hashes if numero_fila not in nuevas]
+            if cambiadas or borradas:
+                self._lecturas.pop(clave, None)
+            self._guardar_filas(spreadsheet_id, nombre_hoja, cambiadas)
+            self._conexion.executemany(
+                "DELETE FROM filas WHERE spreadsheet_id = ? AND hoja = ? AND fila = ?", borradas
+            )
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO hojas (spreadsheet_id, hoja, sincronizada_en, vigente) VALUES (?, ?, ?, 1)",
+                (spreadsheet_id, nombre_hoja, time.time())
+            )
+        return len(cambiadas) + len(borradas)
+
+    def _guardar_filas(self, spreadsheet_id, nombre_hoja, filas):
+        """Inserta o reemplaza [(numero_fila, celdas)]. Llamar con el lock y la transacción tomados."""
+        lista_columnas = ', '.join(f'"{columna}"' for columna in COLUMNAS_ESPEJO)
+        marcadores = ', '.join('?' * (5 + len(COLUMNAS_ESPEJO)))
+        registros = []
+        for numero_fila, celdas in filas:
+            celdas = celdas[:_ancho_sin_vacias(celdas)]
+            completas = celdas + [None] * (len(COLUMNAS_ESPEJO) - len(celdas))
+            registros.append((spreadsheet_id, nombre_hoja, numero_fila, len(celdas), _hash_celdas(celdas), *completas))
+        self._conexion.executemany(
+            f"INSERT OR REPLACE INTO filas (spreadsheet_id, hoja, fila, ancho, hash, {lista_columnas}) "
+            f"VALUES ({marcadores})", registros
+        )
+
+    def aplicar_escritura(self, spreadsheet_id, nombre_hoja, fila_inicio, col_inicio, valores):
+        """
+        Observador de escrituras de utils/google_sheets.py: copia el bloque escrito en Sheets.
+        Si no se conoce el bloque (valores None), la hoja deja de estar vigente.
+        """
+        if valores is None or fila_inicio is None:
+            self.marcar_desactualizada(spreadsheet_id, nombre_hoja)
+            return
+        lista_columnas = ', '.join(f'"{columna}"' for columna in COLUMNAS_ESPEJO)
+        with self._lock, self._conexion:
+            clave = (spreadsheet_id, nombre_hoja)
+            self._generaciones[clave] = self._generaciones.get(clave, 0) + 1
+            self._lecturas.pop(clave, None)
+            if self._conexion.execute(
+                "SELECT 1 FROM hojas WHERE spreadsheet_id = ? AND hoja = ?", clave
+            ).fetchone() is None:
+                return # Hoja todavía no copiada: se traerá completa al sincronizar
+            filas = []
+            for desplazamiento, valores_fila in enumerate(valores):
+                numero_fila = fila_inicio + desplazamiento
+                registro = self._conexion.execute(
+                    f"SELECT ancho, {lista_columnas} FROM filas WHERE spreadsheet_id = ? AND hoja = ? AND fila = ?",
+                    (spreadsheet_id, nombre_hoja, numero_fila)
+                ).fetchone()
+                celdas = ['' if celda is None else celda for celda in registro[1:1 + registro[0]]] if registro else []
+                fin = min(col_inicio + len(valores_fila), len(COLUMNAS_ESPEJO))
+                if len(celdas) < fin:
+                    celdas += [''] * (fin - len(celdas))
+                celdas[col_inicio:fin] = [_a_celda(valor) for valor in valores_fila[:fin - col_inicio]]
+                filas.append((numero_fila, celdas))
+            self._guardar_filas(spreadsheet_id, nombre_hoja, filas)
+
+    def marcar_desactualizada(self, spreadsheet_id, nombre_hoja=None):
+        """Fuerza a releer de Sheets la hoja (o todas las del spreadsheet si no se indica)."""
+        with self._lock, self._conexion:
+            if nombre_hoja is None:
+                self._conexion.execute("UPDATE hojas SET vigente = 0 WHERE spreadsheet_id = ?", (spreadsheet_id,))
+                self._lecturas = {clave: valores for clave, valores in self._lecturas.items() if clave[0] != spreadsheet_id}
+                return
+            clave = (spreadsheet_id, nombre_hoja)
+            self._generaciones[clave] = self._generaciones.get(clave, 0) + 1
+            self._lecturas.pop(clave, None)
+            self._conexion.execute("UPDATE hojas SET vigente = 0 WHERE spreadsheet_id = ? AND hoja = ?", clave)
+
+    def cerrar(self):
+        with self._lock:
+            self._conexion.close()
+
+def _a_celda(valor):
+    """Texto tal como lo devuelve Sheets con USER_ENTERED para los valores que escribe la app."""
+    if isinstance(valor, bool):
+        return 'TRUE' if valor else 'FALSE'
+    return '' if valor is None else str(valor)
+
+class SincronizadorEspejo:
+    """
+    Hilo en segundo plano que cada `intervalo_segundos` trae todas las hojas del spreadsheet
+    con un único values().batchGet (más la consulta de metadatos) y actualiza el espejo solo
+    donde hubo cambios. Si la revisión del spreadsheet en Drive no cambió desde la última
+    sincronización (ver generacion_spreadsheet) no trae nada; sin Drive trae siempre.
+
+    Cada sesión que usa el espejo llama a iniciar() en cada ejecución; si pasan
+    `tiempo_sin_uso_segundos` sin ninguna, el hilo se detiene y el espejo del spreadsheet
+    deja de estar vigente (las lecturas vuelven a Sheets hasta que se reanude). No usa st.*
+    (corre fuera de la sesión): el último error queda en `ultimo_error`.
+    """
+
+    def __init__(self, service, spreadsheet_id, espejo, intervalo_segundos=INTERVALO_SINCRONIZACION_SEGUNDOS,
+                 tiempo_sin_uso_segundos=TIEMPO_SIN_USO_SEGUNDOS):
+        self.service = service
+        self.spreadsheet_id = spreadsheet_id
+        self.espejo = espejo
+        self.intervalo_segundos = intervalo_segundos
+        self.tiempo_sin_uso_segundos = tiempo_sin_uso_segundos
+        self.ultima_sincronizacion = None
+        self.ultimo_error = None
+        self._generacion_sincronizada = None # Generación del spreadsheet en la última sincronización
+        self._ultimo_uso = time.monotonic()
+        self._detener = threading.Event()
+        self._lock = threading.Lock()
+        self._hilo = None
+
+    def sincronizar_ahora(self, forzar=False):
+        """
+        Sincroniza todas las hojas. Devuelve {hoja: filas cambiadas}, o None si se omitió porque
+        la revisión del spreadsheet no cambió (forzar=True sincroniza igual). Propaga errores de API.
+        """
+        generacion = generacion_spreadsheet(self.spreadsheet_id) # Antes de leer: un cambio posterior se trae en la próxima
+        if not forzar and generacion is not None and generacion == self._generacion_sincronizada:
+            return None
+        # Índice fresco: así aparecen también las hojas creadas fuera de la app
+        nombres = list(obtener_indice_hojas(self.service, self.spreadsheet_id, forzar=True))
+        if not nombres:
+            self._generacion_sincronizada = generacion
+            return {}
+        generaciones = {nombre: self.espejo.generacion(self.spreadsheet_id, nombre) for nombre in nombres}
+        respuesta = ejecutar_lectura(self.service.spreadsheets().values().batchGet(
+            spreadsheetId=self.spreadsheet_id, ranges=[f"'{nombre}'!{RANGO_ESPEJO}" for nombre in nombres]
+        ))
+        cambios = {}
+        # Los valueRanges vuelven en el mismo orden que los rangos pedidos
+        for nombre, rango in zip(nombres, respuesta.get('valueRanges', [])):
+            cambios[nombre] = self.espejo.reemplazar_hoja(
+                self.spreadsheet_id, nombre, rango.get('values', []), generacion=generaciones[nombre]
+            )
+        self._generacion_sincronizada = generacion
+        self.ultima_sincronizacion = time.time()
+        return cambios
+
+    def _ejecutar(self):
+        while True:
+            with self._lock:
+                if time.monotonic() - self._ultimo_uso > self.tiempo_sin_uso_segundos:
+                    # Nadie usa el espejo: detenerse y no servir copias que dejarán de actualizarse
+                    self._hilo = None
+                    self._generacion_sincronizada = None
+                    self.espejo.marcar_desactualizada(self.spreadsheet_id)
+                    return
+            try:
+                # Sincronización de fondo: cede la cuota a las peticiones interactivas
+                with prioridad_peticiones(PRIORIDAD_LOTE):
+                    self.sincronizar_ahora()
+                self.ultimo_error = None
+            except Exception as e:
+                self.ultimo_error = e
+            if self._detener.wait(self.intervalo_segundos):
+                return
+
+    def iniciar(self):
+        """Registra un uso del espejo y arranca el hilo si no está corriendo."""
+        with self._lock:
+            self._ultimo_uso = time.monotonic()
+            if self._hilo is None or not self._hilo.is_alive():
+                self._detener.clear()
+                self._hilo = threading.Thread(target=self._ejecutar, name='sincronizador-espejo', daemon=True)
+                self._hilo.start()
+        return self
+
+    def detener(self):
+        self._detener.set()
+
+@st.cache_resource
+def obtener_espejo_local():
+    """Espejo compartido por todas las sesiones, suscripto a las escrituras de google_sheets."""
+    espejo = EspejoLocal()
+    registrar_observador_escrituras(espejo.aplicar_escritura)
+    return espejo
+
+@st.cache_resource
+def _obtener_sincronizador(_service, spreadsheet_id):
+    return SincronizadorEspejo(_service, spreadsheet_id, obtener_espejo_local())
+
+def iniciar_sincronizacion_espejo(service, spreadsheet_id):
+    """
+    Registra que la sesión usa el espejo y arranca, si hace falta, el hilo (uno por
+    spreadsheet) que lo mantiene al día. Llamarla en cada ejecución en que se use el espejo.
+    """
+    return _obtener_sincronizador(service, spreadsheet_id).iniciar()
+
+def leer_datos_hoja_espejo(service, spreadsheet_id, nombre_hoja, forzar=False):
+    """
+    Como leer_datos_hoja, pero leyendo del espejo local. Si la hoja no está vigente en el
+    espejo (o forzar=True) se lee de Sheets y se copia al espejo. None si hubo un error.
+    """
+    espejo = obtener_espejo_local()
+    if not forzar:
+        valores = espejo.leer_hoja(spreadsheet_id, nombre_hoja)
+        if valores is not None:
+            return valores
+    generacion = espejo.generacion(spreadsheet_id, nombre_hoja)
+    valores = leer_datos_hoja(service, spreadsheet_id, nombre_hoja, rango=RANGO_ESPEJO, usar_cache=not forzar)
+    if valores is not None:
+        espejo.reemplazar_hoja(spreadsheet_id, nombre_hoja, valores, generacion=generacion)
+    return valores
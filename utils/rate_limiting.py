@@ -0,0 +1,68 @@
+import threading
+import time
+
+class LimitadorTasa:
+    """
+    Token bucket: permite en promedio `tasa_por_segundo` operaciones por segundo, con
+    ráfagas de hasta `capacidad`. Es seguro para usar desde varios hilos; cada llamada a
+    adquirir() reserva su turno y espera fuera del lock, así los hilos no se bloquean entre sí.
+    """
+
+    def __init__(self, tasa_por_segundo, capacidad=None):
+        if tasa_por_segundo <= 0:
+            raise ValueError("tasa_por_segundo debe ser mayor que 0")
+        self.tasa_por_segundo = float(tasa_por_segundo)
+        self.capacidad = float(capacidad if capacidad is not None else max(1.0, tasa_por_segundo))
+        self._tokens = self.capacidad
+        self._ultima_recarga = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _recargar(self, ahora):
+        transcurrido = ahora - self._ultima_recarga
+        self._tokens = min(self.capacidad, self._tokens + transcurrido * self.tasa_por_segundo)
+        self._ultima_recarga = ahora
+
+    def adquirir(self, tokens=1):
+        """Bloquea hasta que haya `tokens` disponibles. Devuelve los segundos esperados."""
+        with self._lock:
+            self._recargar(time.monotonic())
+            # Los tokens pueden quedar negativos: es la cola de turnos ya reservados
+            self._tokens -= tokens
+            espera = max(0.0, -self._tokens / self.tasa_por_segundo)
+        if espera:
+            time.sleep(espera)
+        return espera
+
+class LimitadorTasaConPrioridad(LimitadorTasa):
+    """
+    Token bucket con carriles de prioridad (0 = la más alta). Un token se entrega primero a
+    quien espera con mayor prioridad, y los carriles de menor prioridad no pueden bajar el
+    balde de `reserva` tokens: así una lectura interactiva que llega durante una carga masiva
+    encuentra cupo enseguida en lugar de hacer cola detrás de todas las escrituras.
+    """
+
+    def __init__(self, tasa_por_segundo, capacidad=None, reserva=0):
+        super().__init__(tasa_por_segundo, capacidad)
+        self.reserva = float(reserva)
+        self._condicion = threading.Condition(self._lock)
+        self._esperando = {} # prioridad -> cantidad de hilos esperando
+
+    def adquirir(self, tokens=1, prioridad=0):
+        """Bloquea hasta obtener `tokens` en el carril `prioridad`. Devuelve los segundos esperados."""
+        inicio = time.monotonic()
+        minimo = tokens + (self.reserva if prioridad > 0 else 0)
+        with self._condicion:
+            self._esperando[prioridad] = self._esperando.get(prioridad, 0) + 1
+            try:
+                while True:
+                    self._recargar(time.monotonic())
+                    hay_prioritarios = any(cantidad for p, cantidad in self._esperando.items() if p < prioridad)
+                    if not hay_prioritarios and self._tokens >= min(minimo, self.capacidad):
+                        self._tokens -= tokens
+                        return time.monotonic() - inicio
+                    faltante = max(min(minimo, self.capacidad) - self._tokens, 0.0)
+                    # Si esperan otros más prioritarios, se vuelve a mirar cuando ellos avancen
+                    self._condicion.wait(timeout=max(faltante / self.tasa_por_segundo, 0.001))
+            finally:
+                self._esperando[prioridad] -= 1
+                self._condicion.notify_all()
@@ -0,0 +1,155 @@
+import contextlib
+import contextvars
+import random
+import time
+
+import requests
+from googleapiclient.errors import HttpError
+
+from .instrumentation import registro, METRICA_API, METRICA_ESPERA_CUOTA
+from .rate_limiting import LimitadorTasaConPrioridad
+
+# Cuotas de la API de Sheets por usuario (la cuenta de servicio) y por minuto
+CUOTA_LECTURAS_POR_MINUTO = 60
+CUOTA_ESCRITURAS_POR_MINUTO = 60
+# Fracción de cada cuota que las peticiones masivas dejan libre para las interactivas
+FRACCION_RESERVA_INTERACTIVA = 0.2
+
+# Carriles de prioridad: lo que espera el usuario en pantalla va antes que las cargas masivas
+PRIORIDAD_INTERACTIVA = 0
+PRIORIDAD_LOTE = 1
+
+MAX_REINTENTOS = 6
+ESPERA_BASE_SEGUNDOS = 1.0
+ESPERA_MAXIMA_SEGUNDOS = 64.0
+CODIGOS_REINTENTABLES = {429, 500, 502, 503, 504}
+# Un 429 garantiza que la petición no se aplicó; tras un 5xx o una falla de red, no
+CODIGOS_REINTENTABLES_NO_IDEMPOTENTES = {429}
+ERRORES_RED_REINTENTABLES = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                             ConnectionError, TimeoutError)
+
+_prioridad_actual = contextvars.ContextVar('prioridad_peticiones', default=PRIORIDAD_INTERACTIVA)
+
+@contextlib.contextmanager
+def prioridad_peticiones(prioridad):
+    """Las peticiones ejecutadas dentro del bloque (en este hilo) usan el carril `prioridad`."""
+    token = _prioridad_actual.set(prioridad)
+    try:
+        yield
+    finally:
+        _prioridad_actual.reset(token)
+
+def _codigo_http(error):
+    try:
+        return int(error.resp.status)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def _retry_after(error):
+    """Segundos indicados por la cabecera Retry-After de la respuesta, si vino."""
+    try:
+        return float(error.resp.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def _medir_bytes_respuesta(peticion, operacion):
+    """Suma a la métrica de la API el tamaño de cada respuesta cruda de la petición."""
+    postproc = getattr(peticion, 'postproc', None)
+    if postproc is None:
+        return
+    def postproc_medido(resp, content):
+        registro.sumar_bytes(METRICA_API, operacion, recibidos=len(content or b''))
+        return postproc(resp, content)
+    peticion.postproc = postproc_medido
+
+class EjecutorPeticiones:
+    """
+    Punto único por el que pasan las llamadas .execute() a la API de Sheets:
+
+    - un token bucket por cuota (lecturas y escrituras por minuto), con carriles de prioridad
+      para que las lecturas interactivas no queden detrás de las escrituras masivas;
+    - reintentos de los errores transitorios (429, 5xx, fallas de red) con espera exponencial
+      y jitter completo, respetando Retry-After si la API lo indica.
+
+    Bajo carga, las cargas masivas se frenan en lugar de fallar. Con una cuota None no se
+    limita ese tipo de petición (solo se reintenta).
+    """
+
+    def __init__(self, cuota_lecturas_por_minuto=CUOTA_LECTURAS_POR_MINUTO,
+                 cuota_escrituras_por_minuto=CUOTA_ESCRITURAS_POR_MINUTO,
+                 max_reintentos=MAX_REINTENTOS, espera_base=ESPERA_BASE_SEGUNDOS,
+                 espera_maxima=ESPERA_MAXIMA_SEGUNDOS):
+        self.max_reintentos = max_reintentos
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self._limitadores = {
+            False: self._crear_limitador(cuota_lecturas_por_minuto),
+            True: self._crear_limitador(cuota_escrituras_por_minuto)
+        }
+        self.reintentos = 0 # Total de reintentos hechos (diagnóstico)
+
+    @staticmethod
+    def _crear_limitador(cuota_por_minuto):
+        if not cuota_por_minuto:
+            return None
+        # Capacidad de un minuto entero: las ráfagas cortas no esperan
+        return LimitadorTasaConPrioridad(cuota_por_minuto / 60.0, capacidad=cuota_por_minuto,
+                                         reserva=cuota_por_minuto * FRACCION_RESERVA_INTERACTIVA)
+
+    def _espera(self, intento, error=None):
+        """Backoff exponencial con jitter completo; Retry-After manda si es mayor."""
+        espera = random.uniform(0, min(self.espera_maxima, self.espera_base * 2 ** intento))
+        indicada = _retry_after(error) if error is not None else None
+        return max(espera, indicada or 0.0)
+
+    def ejecutar(self, peticion, escritura=False, prioridad=None, idempotente=True):
+        """
+        Ejecuta `peticion` (un HttpRequest de googleapiclient) respetando la cuota y
+        reintentando los errores transitorios. `prioridad` por defecto es la del contexto
+        (ver prioridad_peticiones). Las peticiones no idempotentes (append, addSheet) solo se
+        reintentan ante un 429, para no duplicar filas u hojas.
+        Propaga el error si no es reintentable o se agotan los intentos.
+        """
+        if prioridad is None:
+            prioridad = _prioridad_actual.get()
+        limitador = self._limitadores[bool(escritura)]
+        reintentables = CODIGOS_REINTENTABLES if idempotente else CODIGOS_REINTENTABLES_NO_IDEMPOTENTES
+        operacion = getattr(peticion, 'methodId', None) or 'desconocida'
+        _medir_bytes_respuesta(peticion, operacion)
+        for intento in range(self.max_reintentos + 1):
+            if limitador is not None:
+                esperado = limitador.adquirir(prioridad=prioridad)
+                registro.registrar(METRICA_ESPERA_CUOTA, 'escrituras' if escritura else 'lecturas', esperado)
+            try:
+                # Cada intento cuenta como una llamada a la API
+                with registro.medir(METRICA_API, operacion) as medicion:
+                    medicion.bytes_enviados = len(getattr(peticion, 'body', None) or b'')
+                    return peticion.execute()
+            except HttpError as error:
+                if _codigo_http(error) not in reintentables or intento == self.max_reintentos:
+                    raise
+                espera = self._espera(intento, error)
+            except ERRORES_RED_REINTENTABLES:
+                if not idempotente or intento == self.max_reintentos:
+                    raise
+                espera = self._espera(intento)
+            self.reintentos += 1
+            time.sleep(espera)
+
+_ejecutor = EjecutorPeticiones()
+
+def configurar_ejecutor(ejecutor):
+    """Reemplaza el ejecutor global (p.ej. otras cuotas, o sin límite en los benchmarks)."""
+    global _ejecutor
+    _ejecutor = ejecutor
+
+def obtener_ejecutor():
+    return _ejecutor
+
+def ejecutar_lectura(peticion, prioridad=None):
+    """Ejecuta una petición de lectura de Sheets con el ejecutor global."""
+    return _ejecutor.ejecutar(peticion, escritura=False, prioridad=prioridad)
+
+def ejecutar_escritura(peticion, prioridad=None, idempotente=True):
+    """Ejecuta una petición de escritura de Sheets con el ejecutor global."""
+    return _ejecutor.ejecutar(peticion, escritura=True, prioridad=prioridad, idempotente=idempotente)
@@ -0,0 +1,114 @@
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+from .instrumentation import medir, METRICA_API
+from .request_scheduler import MAX_REINTENTOS
+
+# Cada cuánto se pregunta a Drive si el spreadsheet cambió (files.get solo con estos campos)
+INTERVALO_VERIFICACION_SEGUNDOS = 10
+CAMPOS_REVISION = 'version,modifiedTime'
+# Si Drive no responde (o el scope no alcanza) se vuelve a intentar recién pasado este tiempo
+INTERVALO_REINTENTO_ERROR_SEGUNDOS = 300
+
+class VerificadorRevisiones:
+    """
+    Sigue la revisión (version/modifiedTime de Drive) de cada spreadsheet y la traduce a una
+    generación: un contador que aumenta cuando el archivo cambió por fuera de la app. Lo
+    leído en una generación sigue valiendo mientras la generación no cambie, así todas las
+    sesiones comparten una copia hasta que alguien edite el spreadsheet.
+
+    Cualquier cambio de versión cambia la generación, también los que siguen a escrituras
+    propias: Drive no garantiza un salto de versión por escritura, así que no hay forma
+    fiable de distinguir lo propio de lo ajeno si llegan dentro del mismo intervalo. Las
+    escrituras propias igual invalidan con precisión lo que tocaron (así quien escribe ve
+    su cambio sin esperar), y el cambio de generación solo agrega una relectura más tarde.
+    Se pregunta a Drive como mucho una vez cada `intervalo_segundos` por spreadsheet, desde
+    un solo hilo a la vez: los demás siguen con la generación conocida. Sin servicio de
+    Drive o si la consulta falla, generacion() devuelve None. Es seguro usarlo desde varios
+    hilos.
+    """
+
+    def __init__(self, intervalo_segundos=INTERVALO_VERIFICACION_SEGUNDOS):
+        self.intervalo_segundos = intervalo_segundos
+        self._drive_service = None
+        self._lock = threading.Lock()
+        self._estados = {} # spreadsheet_id -> estado (ver _estado)
+        self.ultimo_error = None
+
+    def configurar(self, drive_service):
+        """Servicio de Drive con el que se consultan las revisiones (None la desactiva)."""
+        with self._lock:
+            if drive_service is not self._drive_service:
+                self._drive_service = drive_service
+                self._estados.clear()
+
+    def _estado(self, spreadsheet_id):
+        estado = self._estados.get(spreadsheet_id)
+        if estado is None:
+            estado = {'revision': None, 'modificado': None, 'generacion': 0, 'verificado_en': None,
+                      'proxima_en': 0.0, 'escrituras': 0, 'escrituras_verificadas': 0,
+                      'en_curso': False, 'cambios_externos': 0}
+            self._estados[spreadsheet_id] = estado
+        return estado
+
+    def observar_escritura(self, spreadsheet_id, nombre_hoja=None, fila_inicio=None, col_inicio=0, valores=None):
+        """Avisa de una escritura propia (firma de observador de escrituras de google_sheets)."""
+        with self._lock:
+            self._estado(spreadsheet_id)['escrituras'] += 1
+
+    def generacion(self, spreadsheet_id):
+        """
+        Generación vigente del spreadsheet, verificando antes con Drive si toca.
+        None si la revisión no se puede conocer (sin Drive o con error).
+        """
+        with self._lock:
+            if self._drive_service is None:
+                return None
+            drive_service = self._drive_service
+            estado = self._estado(spreadsheet_id)
+            ahora = time.monotonic()
+            if ahora < estado['proxima_en'] or estado['en_curso']:
+                return estado['generacion'] if estado['revision'] is not None else None
+            estado['en_curso'] = True
+            escrituras = estado['escrituras'] # Solo para distinguir cambios externos en el diagnóstico
+        revision = error = None
+        try:
+            with medir(METRICA_API, 'drive.files.get'):
+                revision = drive_service.files().get(
+                    fileId=spreadsheet_id, fields=CAMPOS_REVISION, supportsAllDrives=True
+                ).execute(num_retries=MAX_REINTENTOS)
+        except HttpError as e:
+            error = e # p.ej. 403/404 si el scope no permite ver el archivo
+        except Exception as e:
+            error = e
+        with self._lock:
+            estado['en_curso'] = False
+            if drive_service is not self._drive_service: # Se reconfiguró mientras tanto
+                return None
+            ahora = time.monotonic()
+            if error is not None or not revision.get('version'):
+                self.ultimo_error = str(error) if error is not None else "Drive no devolvió la versión del archivo"
+                estado['revision'] = None
+                estado['proxima_en'] = ahora + INTERVALO_REINTENTO_ERROR_SEGUNDOS
+                return None
+            nueva = str(revision['version'])
+            if nueva != estado['revision']:
+                # Primera verificación (o tras un error) o el archivo cambió desde la última
+                if estado['revision'] is not None and escrituras == estado['escrituras_verificadas']:
+                    estado['cambios_externos'] += 1 # Sin escrituras propias en el medio
+                estado['generacion'] += 1
+            estado['revision'] = nueva
+            estado['modificado'] = revision.get('modifiedTime')
+            estado['escrituras_verificadas'] = escrituras
+            estado['verificado_en'] = time.time()
+            estado['proxima_en'] = ahora + self.intervalo_segundos
+            return estado['generacion']
+
+    def estado(self, spreadsheet_id):
+        """{'revision', 'modificado', 'generacion', 'verificado_en', 'cambios_externos'} (diagnóstico)."""
+        with self._lock:
+            estado = self._estado(spreadsheet_id)
+            return {clave: estado[clave] for clave in
+                    ('revision', 'modificado', 'generacion', 'verificado_en', 'cambios_externos')}
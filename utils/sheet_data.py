@@ -0,0 +1,78 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from .google_sheets import ENCABEZADOS, valores_a_dataframe
+
+# Hojas cuyos datos tipados se conservan (las más recientes); cada sesión que mira una hoja usa el mismo
+MAX_HOJAS_COMPARTIDAS = 32
+
+def mascaras_estado_wsp(df):
+    """Máscaras (pendiente, enviado) de Mensaje_WSP_Enviado; sin la columna o vacía cuenta como pendiente."""
+    if 'Mensaje_WSP_Enviado' not in df:
+        return np.ones(len(df), dtype=bool), np.zeros(len(df), dtype=bool)
+    serie = df['Mensaje_WSP_Enviado']
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        # Se evalúa cada categoría una vez; el código -1 (nulo) toma el último elemento agregado
+        categorias = pd.Index(serie.cat.categories.astype(str)).str.upper()
+        codigos = serie.cat.codes.to_numpy()
+        pendiente = np.append(np.asarray(categorias.isin(['FALSE', ''])), True)[codigos]
+        enviado = np.append(np.asarray(categorias == 'TRUE'), False)[codigos]
+        return pendiente, enviado
+    estado = serie.astype(str).str.upper()
+    return estado.isin(['FALSE', '']).to_numpy(), (estado == 'TRUE').to_numpy()
+
+class DatosHoja:
+    """
+    Los datos de una hoja en columnas tipadas, construidas una vez por lectura:
+
+    - `df`: texto en columnas de Arrow, Tipo_Identificacion y Mensaje_WSP_Enviado categóricas
+      (ver valores_a_dataframe) y '__row_number__' con el número de fila en la hoja;
+    - `enviado` / `pendiente`: el flag WSP como máscaras booleanas.
+
+    Lo comparten todas las sesiones (obtener_datos_hoja): no modificar `df` (usar .copy()).
+    `valores` es la lista leída (empieza con el encabezado) e identifica la lectura;
+    `primera_fila` es el número de fila en la hoja de la primera fila de datos, o
+    `numeros_fila` el de cada una si no son consecutivas (p.ej. leer_pendientes_wsp).
+    """
+
+    def __init__(self, valores, primera_fila=2, numeros_fila=None):
+        self.valores = valores
+        self.encabezado = list(valores[0]) if valores else list(ENCABEZADOS)
+        self.df = valores_a_dataframe(valores)
+        if numeros_fila is not None:
+            self.df['__row_number__'] = np.asarray(numeros_fila, dtype=np.int64)
+        else:
+            self.df['__row_number__'] = np.arange(primera_fila, primera_fila + len(self.df), dtype=np.int64)
+        self.pendiente, self.enviado = mascaras_estado_wsp(self.df)
+
+    def __len__(self):
+        return len(self.df)
+
+    def memoria_bytes(self):
+        """Bytes que ocupan las columnas y las máscaras (diagnóstico)."""
+        return int(self.df.memory_usage(deep=True).sum()) + self.pendiente.nbytes + self.enviado.nbytes
+
+_datos_compartidos = {} # (spreadsheet_id, nombre_hoja, parcial) -> DatosHoja, del menos al más reciente
+_lock_datos_compartidos = threading.Lock()
+
+def obtener_datos_hoja(spreadsheet_id, nombre_hoja, valores, numeros_fila=None):
+    """
+    DatosHoja de `valores` compartido por todas las sesiones del proceso. Se reconstruye solo
+    si `valores` no es la misma lista que la última vez (una nueva lectura, p.ej. tras una
+    escritura o un refresco). Con `numeros_fila` (solo algunas filas de la hoja) se guarda
+    aparte de la hoja completa.
+    """
+    clave = (spreadsheet_id, nombre_hoja, numeros_fila is not None)
+    with _lock_datos_compartidos:
+        datos = _datos_compartidos.pop(clave, None)
+        if datos is not None and datos.valores is valores:
+            _datos_compartidos[clave] = datos # Pasa a ser la más reciente
+            return datos
+    datos = DatosHoja(valores, numeros_fila=numeros_fila) # Fuera del lock: construir una hoja grande no frena a las demás
+    with _lock_datos_compartidos:
+        _datos_compartidos[clave] = datos
+        while len(_datos_compartidos) > MAX_HOJAS_COMPARTIDAS:
+            del _datos_compartidos[next(iter(_datos_compartidos))]
+    return datos
@@ -0,0 +1,139 @@
+import csv
+import io
+import zlib
+
+from googleapiclient.http import MediaUpload
+
+# Las subidas reanudables exigen partes múltiplo de 256 KB
+TAMANO_PARTE_SUBIDA = 20 * 256 * 1024 # 5 MB
+FILAS_POR_BLOQUE_EXPORTACION = 5000
+
+class SubidaEnStreaming(MediaUpload):
+    """
+    MediaUpload reanudable alimentado por un iterador de bytes, sin tamaño conocido de antemano.
+    A diferencia de MediaIoBaseUpload no necesita un archivo con seek(): solo guarda en memoria
+    la parte pendiente de confirmar y la siguiente, así el uso de memoria no depende del tamaño
+    del archivo.
+
+    googleapiclient pide las partes en orden con getbytes(inicio, largo) y puede repetir la
+    última si hubo un error. Se lee una parte por adelantado para que size() ya conozca el
+    total al enviar la última (si no, una última parte de largo exacto quedaría sin cerrar).
+    """
+
+    def __init__(self, bloques, mimetype, chunksize=TAMANO_PARTE_SUBIDA):
+        super().__init__()
+        self._bloques = iter(bloques)
+        self._mimetype = mimetype
+        self._chunksize = chunksize
+        self._buffer = bytearray()
+        self._inicio_buffer = 0 # Posición en el archivo del primer byte de _buffer
+        self._total = None
+
+    def chunksize(self):
+        return self._chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def size(self):
+        # googleapiclient consulta el tamaño antes de pedir cada parte: leer por adelantado
+        # también antes de la primera, por si el archivo entero cabe justo en una parte
+        self._leer_hasta(self._inicio_buffer + self._chunksize + 1)
+        return self._total
+
+    def resumable(self):
+        return True
+
+    def has_stream(self):
+        return False
+
+    def stream(self):
+        return None
+
+    def _leer_hasta(self, posicion):
+        while self._total is None and self._inicio_buffer + len(self._buffer) < posicion:
+            bloque = next(self._bloques, None)
+            if bloque is None:
+                self._total = self._inicio_buffer + len(self._buffer)
+            else:
+                self._buffer += bloque
+
+    def getbytes(self, begin, length):
+        if begin < self._inicio_buffer:
+            raise ValueError("SubidaEnStreaming no puede volver a una parte ya confirmada")
+        # Lo anterior a `begin` ya fue confirmado por el servidor: se descarta
+        del self._buffer[:begin - self._inicio_buffer]
+        self._inicio_buffer = begin
+        self._leer_hasta(begin + 2 * length + 1)
+        return bytes(self._buffer[:length])
+
+    def to_json(self):
+        raise NotImplementedError("SubidaEnStreaming no se puede serializar")
+
+def generar_csv(filas, filas_por_bloque=FILAS_POR_BLOQUE_EXPORTACION):
+    """Genera el CSV (UTF-8) de `filas` en bloques de bytes, sin armarlo completo en memoria."""
+    salida = io.StringIO()
+    writer = csv.writer(salida, quoting=csv.QUOTE_MINIMAL)
+    for inicio in range(0, len(filas), filas_por_bloque):
+        writer.writerows(filas[inicio:inicio + filas_por_bloque])
+        yield salida.getvalue().encode('utf-8')
+        salida.seek(0)
+        salida.truncate()
+
+def comprimir_gzip(bloques, nivel=6):
+    """Comprime en formato gzip un iterador de bloques de bytes, bloque a bloque."""
+    compresor = zlib.compressobj(nivel, zlib.DEFLATED, 31) # wbits 31: cabecera y cola gzip
+    for bloque in bloques:
+        comprimido = compresor.compress(bloque)
+        if comprimido:
+            yield comprimido
+    yield compresor.flush()
+
+class _SumideroBytes:
+    """Archivo de solo escritura que acumula lo escrito hasta que se retira con retirar()."""
+
+    def __init__(self):
+        self._partes = []
+        self._posicion = 0
+        self.closed = False
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self._posicion
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def retirar(self):
+        datos = b''.join(self._partes)
+        self._partes = []
+        return datos
+
+def generar_parquet(filas, filas_por_bloque=FILAS_POR_BLOQUE_EXPORTACION):
+    """
+    Genera un Parquet (columnas de texto, comprimido con zstd) a partir de filas cuya primera
+    fila es el encabezado. Cada bloque de filas es un row group. Requiere pyarrow.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    encabezado = [str(columna) for columna in filas[0]]
+    esquema = pa.schema([(columna, pa.string()) for columna in encabezado])
+    sumidero = _SumideroBytes()
+    with pq.ParquetWriter(sumidero, esquema, compression='zstd') as writer:
+        for inicio in range(1, len(filas), filas_por_bloque):
+            bloque = filas[inicio:inicio + filas_por_bloque]
+            columnas = [
+                pa.array([str(fila[i]) if i < len(fila) else '' for fila in bloque], type=pa.string())
+                for i in range(len(encabezado))
+            ]
+            writer.write_table(pa.Table.from_arrays(columnas, schema=esquema))
+            yield sumidero.retirar()
+    yield sumidero.retirar() # Pie del archivo, escrito al cerrar
@@ -1,6 +1,17 @@
 import streamlit as st
+import pandas as pd
 import time
 import random # To simulate potential failures
+import string
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from .rate_limiting import LimitadorTasa
+from .instrumentation import registro, METRICA_ETAPA
+from .google_sheets import ENCABEZADOS
+
+# Defaults for concurrent dispatch; adjust to the provider's rate limits
+DEFAULT_MAX_CONCURRENCY = 5
+DEFAULT_MESSAGES_PER_SECOND = 10
 
 # --- Placeholder WhatsApp Functionality ---
 
@@ -31,21 +42,16 @@ def initialize_whatsapp_client():
     return "dummy_client"
 
 
-def send_whatsapp_message(client, recipient_phone, message_body, client_name="Cliente"):
-    """
-    Placeholder function to simulate sending a WhatsApp message.
-    In a real implementation, this would make the API call to the provider.
-    """
-    if not client:
-        st.error("WhatsApp client not initialized.")
-        return False
+def _clean_phone(recipient_phone):
+    """Keeps only the digits of a phone number (basic example)."""
+    return ''.join(filter(str.isdigit, str(recipient_phone)))
 
-    # Clean phone number (basic example)
-    cleaned_phone = ''.join(filter(str.isdigit, str(recipient_phone)))
-    if not cleaned_phone:
-        st.warning(f"Número de teléfono inválido para {client_name}: '{recipient_phone}'. Mensaje no enviado.")
-        return False
 
+def _deliver_message(client, cleaned_phone, message_body):
+    """
+    Performs the actual send and returns (ok, detail). It must not call st.*,
+    because the concurrent dispatcher runs it from worker threads.
+    """
     # --- Real API Call Would Go Here ---
     # Example (Twilio):
     # try:
@@ -54,24 +60,108 @@ def send_whatsapp_message(client, recipient_phone, message_body, client_name="Cl
     #         body=message_body,
     #         to=f'whatsapp:+{cleaned_phone}'
     #     )
-    #     st.success(f"Mensaje enviado a {client_name} ({cleaned_phone}). SID: {message.sid}")
-    #     return True
+    #     return True, f"SID: {message.sid}"
     # except Exception as e:
-    #     st.error(f"Error al enviar mensaje a {client_name} ({cleaned_phone}): {e}")
-    #     return False
+    #     return False, str(e)
     # ------------------------------------
 
     # Simulate sending delay and potential random failure
-    st.info(f"Simulando envío a {client_name} ({cleaned_phone})...")
     time.sleep(random.uniform(0.5, 1.5)) # Simulate network delay
-    
+
     # Simulate a 10% chance of failure for demonstration
-    if random.random() < 0.1: 
-        st.error(f"Simulación fallida: No se pudo enviar mensaje a {client_name} ({cleaned_phone}).")
+    if random.random() < 0.1:
+        return False, "Simulación fallida"
+    return True, "Simulación exitosa"
+
+
+def send_whatsapp_message(client, recipient_phone, message_body, client_name="Cliente"):
+    """
+    Placeholder function to simulate sending a WhatsApp message.
+    In a real implementation, this would make the API call to the provider.
+    """
+    if not client:
+        st.error("WhatsApp client not initialized.")
+        return False
+
+    cleaned_phone = _clean_phone(recipient_phone)
+    if not cleaned_phone:
+        st.warning(f"Número de teléfono inválido para {client_name}: '{recipient_phone}'. Mensaje no enviado.")
         return False
+
+    st.info(f"Simulando envío a {client_name} ({cleaned_phone})...")
+    ok, detail = _deliver_message(client, cleaned_phone, message_body)
+    if ok:
+        st.success(f"{detail}: Mensaje 'enviado' a {client_name} ({cleaned_phone}).")
     else:
-        st.success(f"Simulación exitosa: Mensaje 'enviado' a {client_name} ({cleaned_phone}).")
-        return True
+        st.error(f"{detail}: No se pudo enviar mensaje a {client_name} ({cleaned_phone}).")
+    return ok
+
+
+def dispatch_messages(client, recipients, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                      messages_per_second=DEFAULT_MESSAGES_PER_SECOND, sender=None,
+                      before_send=None, after_send=None, reporter=st):
+    """
+    Sends messages concurrently with at most `max_concurrency` sends in flight and no more
+    than `messages_per_second` started per second (token bucket).
+    `recipients` is an iterable of (key, phone, message_body). Yields one result dict per
+    recipient as soon as its send completes (completion order, not input order):
+    {'key', 'phone', 'ok', 'detail', 'latency'}.
+    `sender(client, cleaned_phone, message_body) -> (ok, detail)` defaults to the provider call.
+    `before_send(key)` runs right before the provider call and `after_send(result)` right after
+    each send finishes (even if the consumer already stopped); both run in worker threads, so
+    they must be thread-safe and must not call st.*.
+    The generator can be consumed from any single thread (a background job's thread for
+    campaigns); workers never report anything. Errors go to `reporter`: `st` on the page, or
+    the job's reporter (ContextoTrabajo.reporte) inside a background job.
+    """
+    if not client:
+        reporter.error("WhatsApp client not initialized.")
+        return
+
+    sender = sender or _deliver_message
+    limiter = LimitadorTasa(messages_per_second)
+
+    def send_one(key, phone, message_body):
+        cleaned_phone = _clean_phone(phone)
+        if not cleaned_phone:
+            result = {'key': key, 'phone': phone, 'ok': False,
+                      'detail': "Número de teléfono inválido", 'latency': 0.0}
+        else:
+            limiter.adquirir()
+            if before_send is not None:
+                before_send(key)
+            start = time.monotonic()
+            try:
+                ok, detail = sender(client, cleaned_phone, message_body)
+            except Exception as e:
+                ok, detail = False, f"Error inesperado: {e}"
+            latency = time.monotonic() - start
+            registro.registrar(METRICA_ETAPA, 'envio_mensaje', latency, error=not ok)
+            result = {'key': key, 'phone': cleaned_phone, 'ok': ok,
+                      'detail': detail, 'latency': latency}
+        if after_send is not None:
+            after_send(result)
+        return result
+
+    # Keep a bounded window of submitted sends so huge campaigns don't queue everything up front
+    recipients = iter(recipients)
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        try:
+            while True:
+                while len(in_flight) < max_concurrency * 2:
+                    recipient = next(recipients, None)
+                    if recipient is None:
+                        break
+                    in_flight.add(pool.submit(send_one, *recipient))
+                if not in_flight:
+                    break
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            for future in in_flight: # Consumer stopped early: don't start pending sends
+                future.cancel()
 
 def format_message(template, client_data):
     """
@@ -99,3 +189,80 @@ def format_message(template, client_data):
     except Exception as e:
         st.error(f"Error inesperado al formatear plantilla: {e}")
         return template # Return original template on error
+
+
+def _is_positional(field):
+    """True for str.format positional placeholders: '{}' (empty name) or '{0}', '{1}'..."""
+    return field == '' or field.isdigit()
+
+
+class CompiledTemplate:
+    """
+    A message template parsed once into literal text and placeholders.
+    `fields` lists the placeholders in order of appearance; `unknown_fields` those that
+    are not in `columns` (ENCABEZADOS by default) and will render as ''. Positional
+    placeholders ('{}', '{0}') are always unknown, even if a sheet has a blank or numeric
+    header, since they can only have been meant as str.format arguments.
+    If the template is malformed (e.g. a lone '{'), `error` is set and it renders verbatim.
+    """
+
+    def __init__(self, template, columns=None):
+        self.template = template
+        self.columns = list(columns) if columns is not None else list(ENCABEZADOS)
+        self.error = None
+        self._parts = [] # (literal, field_name or None, format_spec, conversion)
+        try:
+            self._parts = list(string.Formatter().parse(template))
+        except ValueError as e:
+            self.error = str(e)
+            self._parts = [(template, None, '', None)]
+        self.fields = [field for _, field, _, _ in self._parts if field is not None]
+        known = {column for column in self.columns if not _is_positional(column)}
+        self.unknown_fields = sorted({field for field in self.fields if field not in known})
+
+    def _column_text(self, recipients, field, format_spec, conversion):
+        """Text for one placeholder across all recipients; missing columns and nulls become ''."""
+        if field in self.unknown_fields or field not in recipients.columns:
+            return ''
+        column = recipients[field]
+        values = column.astype(object).where(column.notna(), '')
+        if format_spec or conversion:
+            # Rare: apply the per-value formatting only for this placeholder
+            formatter = string.Formatter()
+            return values.map(lambda value: format(formatter.convert_field(value, conversion), format_spec))
+        return values.astype(str).astype(object)
+
+    def render_frame(self, recipients):
+        """Renders the template for every row of a DataFrame. Returns a Series aligned with it."""
+        messages = pd.Series('', index=recipients.index, dtype=object)
+        for literal, field, format_spec, conversion in self._parts:
+            if literal:
+                messages = messages + literal
+            if field is not None:
+                messages = messages + self._column_text(recipients, field, format_spec, conversion)
+        return messages
+
+    def render(self, client_data):
+        """Renders the template for a single client (dict or Series)."""
+        return self.render_frame(pd.DataFrame([dict(client_data)])).iloc[0]
+
+
+@lru_cache(maxsize=32)
+def compile_template(template, columns=None):
+    """Cached CompiledTemplate; `columns` must be a tuple (or None for ENCABEZADOS)."""
+    return CompiledTemplate(template, columns)
+
+
+def render_messages(template, recipients, columns=None):
+    """
+    Renders a personalized message for every recipient row in one vectorized pass.
+    Placeholders are checked against `columns` (ENCABEZADOS by default) once, with a
+    single warning for unknown ones. Returns a Series of messages aligned with `recipients`.
+    """
+    compiled = compile_template(template, tuple(columns) if columns is not None else None)
+    if compiled.error:
+        st.error(f"Error al formatear plantilla: {compiled.error}")
+    elif compiled.unknown_fields:
+        claves = ', '.join('{' + field + '}' for field in compiled.unknown_fields)
+        st.warning(f"Plantilla contiene claves no encontradas en los datos del cliente: {claves}. Se usará valor vacío.")
+    return compiled.render_frame(recipients)